@@ -0,0 +1,80 @@
+"""Optional runtime accelerations: uvloop and a fast JSON decoder.
+
+Both are soft dependencies. When a requested accelerator is not installed we
+fall back to the stdlib implementation and say so in the startup log.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+JSON_CODECS = ("auto", "orjson", "ujson", "stdlib")
+
+
+@dataclass(frozen=True)
+class JsonCodec:
+    """A named JSON decoder accepting `bytes` or `str`."""
+    name: str
+    loads: Callable[[bytes | str], Any]
+
+
+STDLIB_JSON = JsonCodec("stdlib", json.loads)
+
+
+def _load_codec(name: str) -> Optional[JsonCodec]:
+    try:
+        if name == "orjson":
+            import orjson
+            return JsonCodec("orjson", orjson.loads)
+        if name == "ujson":
+            import ujson
+            return JsonCodec("ujson", ujson.loads)
+    except ImportError:
+        return None
+    return STDLIB_JSON if name == "stdlib" else None
+
+
+def get_json_codec(name: str = "auto") -> JsonCodec:
+    """
+    Resolve a JSON codec by name.
+
+    "auto" picks the fastest installed decoder (orjson, then ujson). An
+    explicitly requested codec that is not installed falls back to stdlib.
+    """
+    if name not in JSON_CODECS:
+        raise ValueError(f"Unknown JSON codec '{name}'; expected one of {JSON_CODECS}")
+    candidates = ("orjson", "ujson") if name == "auto" else (name,)
+    for candidate in candidates:
+        codec = _load_codec(candidate)
+        if codec is not None:
+            return codec
+    if name != "auto":
+        logger.warning("JSON codec '%s' not installed; using stdlib json", name)
+    return STDLIB_JSON
+
+
+def get_loop_factory(use_uvloop: bool) -> tuple[Optional[Callable[[], asyncio.AbstractEventLoop]], str]:
+    """
+    Return an event loop factory for `asyncio.Runner` and its name.
+
+    The factory is None (asyncio's default loop) when uvloop is disabled or
+    not installed.
+    """
+    if not use_uvloop:
+        return None, "asyncio"
+    try:
+        import uvloop
+    except ImportError:
+        logger.warning("use_uvloop is set but uvloop is not installed; "
+                       "using the default asyncio loop")
+        return None, "asyncio"
+    return uvloop.new_event_loop, "uvloop"
+
+
+def log_accelerations(loop_name: str, codec: JsonCodec) -> None:
+    """Log which accelerations are active."""
+    logger.info("Accelerations: event loop=%s, json=%s", loop_name, codec.name)
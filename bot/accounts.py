@@ -0,0 +1,236 @@
+"""Several bot accounts served by one process.
+
+The account in ``[bot]`` is the primary one; ``[[bot.accounts]]`` entries
+add more. Each account has its own pair of clients (see `bot.client`), its
+own sync loop and its own access token, read from the environment variable
+named by `token_env`. Everything else is shared: the command registry,
+dispatcher, rate limiter, history cache, command storage, journal and the
+Anthropic client, so an extra account costs two HTTP sessions and a sync
+loop rather than a whole process.
+
+Sharing one process means sharing its CPU, so the pool schedules the
+accounts fairly:
+
+- Sync loops start staggered across the long-poll timeout, so their
+  responses (and the parsing they cause) arrive spread out rather than in
+  lockstep.
+- Sends go through a `FairSendGate`: at most `max_concurrent` sends run at
+  once, and when they are all busy, waiting accounts are served round-robin,
+  so one account replying to a flood can't starve the others.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncIterator, Iterable, Optional
+
+if TYPE_CHECKING:
+    from .client import MatrixClients
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_ENV = "MATRIX_ACCESS_TOKEN"
+
+# Longest delay between two accounts' first syncs.
+MAX_SYNC_STAGGER = 5.0
+
+
+@dataclass(frozen=True)
+class AccountConfig:
+    """One bot identity."""
+    user_id: str
+    homeserver: str
+    device_id: str = "DEV1"
+    display_name: Optional[str] = None
+    token_env: str = DEFAULT_TOKEN_ENV  # Environment variable holding the access token
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any], homeserver: Optional[str] = None) -> "AccountConfig":
+        """
+        Build an account from a ``[[bot.accounts]]`` entry.
+
+        Args:
+            homeserver: Used when the entry doesn't name its own
+
+        Raises:
+            ValueError: On missing or unknown keys
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Each account must be a table")
+        unknown = set(data) - {"user_id", "homeserver", "device_id", "display_name", "token_env"}
+        if unknown:
+            raise ValueError(f"Unknown account settings: {', '.join(sorted(unknown))}")
+        if not data.get("user_id"):
+            raise ValueError("Each account needs a user_id")
+        if not data.get("token_env"):
+            raise ValueError(f"Account {data['user_id']} needs a token_env")
+        homeserver = data.get("homeserver", homeserver)
+        if not homeserver:
+            raise ValueError(f"Account {data['user_id']} needs a homeserver")
+        return cls(user_id=data["user_id"], homeserver=homeserver,
+                   device_id=data.get("device_id", "DEV1"),
+                   display_name=data.get("display_name"),
+                   token_env=data["token_env"])
+
+    @property
+    def access_token(self) -> str:
+        token = os.getenv(self.token_env)
+        if not token:
+            raise RuntimeError(f"{self.token_env} not set in environment or .env file "
+                               f"(access token for {self.user_id})")
+        return token
+
+
+def account_configs(config) -> list[AccountConfig]:
+    """
+    Return the primary account from `config` followed by its extra accounts.
+
+    Raises:
+        ValueError: On an invalid entry or a user ID listed twice
+    """
+    accounts = [AccountConfig(user_id=config.user_id, homeserver=config.homeserver,
+                              device_id=config.device_id,
+                              display_name=config.display_name)]
+    accounts += [AccountConfig.from_dict(entry, config.homeserver)
+                 for entry in config.accounts or ()]
+    seen = set()
+    for account in accounts:
+        if account.user_id in seen:
+            raise ValueError(f"Account {account.user_id} is listed twice")
+        seen.add(account.user_id)
+    return accounts
+
+
+class FairSendGate:
+    """Caps concurrent sends and serves waiting accounts round-robin."""
+
+    def __init__(self, max_concurrent: int = 16):
+        self.max_concurrent = max_concurrent
+        self._active = 0
+        # Account -> its waiting sends, in the order accounts get served
+        self._waiting: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+
+    @asynccontextmanager
+    async def slot(self, account: Optional[str]) -> AsyncIterator[None]:
+        """Hold one send slot, waiting for `account`'s turn if all are busy."""
+        if self._active < self.max_concurrent and not self._waiting:
+            self._active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiting.setdefault(account or "", deque()).append(waiter)
+            try:
+                await waiter  # The releasing send hands its slot over
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()  # Granted as we were cancelled; pass it on
+                else:
+                    self._forget(account or "", waiter)
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiting.values())
+
+    def _release(self) -> None:
+        while self._waiting:
+            account, queue = next(iter(self._waiting.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(account)  # Next account's turn
+            else:
+                del self._waiting[account]
+            if not waiter.done():
+                waiter.set_result(None)  # Slot passes straight to the waiter
+                return
+        self._active -= 1
+
+    def _forget(self, account: str, waiter: asyncio.Future) -> None:
+        queue = self._waiting.get(account)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._waiting[account]
+
+
+@dataclass
+class Account:
+    """A running account: its settings and clients."""
+    config: AccountConfig
+    clients: MatrixClients
+
+    @property
+    def user_id(self) -> str:
+        return self.config.user_id
+
+
+class AccountPool:
+    """The accounts served by this process, primary first."""
+
+    def __init__(self, accounts: Iterable[Account]):
+        self.accounts = list(accounts)
+        if not self.accounts:
+            raise ValueError("An account pool needs at least one account")
+        self._by_user = {account.user_id: account for account in self.accounts}
+
+    def __iter__(self):
+        return iter(self.accounts)
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    def __contains__(self, user_id: object) -> bool:
+        """Whether `user_id` is one of these accounts."""
+        return user_id in self._by_user
+
+    @property
+    def primary(self) -> Account:
+        return self.accounts[0]
+
+    def get(self, user_id: Optional[str]) -> Account:
+        """Return the account for `user_id`, or the primary one."""
+        return self._by_user.get(user_id, self.primary) if user_id else self.primary
+
+    def for_room(self, room_id: str) -> Account:
+        """
+        Return an account joined to `room_id`, preferring the primary one.
+
+        This is the account that answers commands in the room, so a room
+        the accounts share gets one reply rather than one per account.
+        """
+        for account in self.accounts:
+            if room_id in account.clients.sync.rooms:
+                return account
+        return self.primary
+
+    def next_batches(self) -> dict[str, Optional[str]]:
+        """Each account's sync token, for a restart handoff."""
+        return {account.user_id: account.clients.sync.next_batch for account in self.accounts}
+
+    def restore_next_batches(self, tokens: str | dict[str, Optional[str]] | None) -> None:
+        """Resume from `next_batches()` output (or one token, for the primary)."""
+        if isinstance(tokens, str):
+            tokens = {self.primary.user_id: tokens}
+        for user_id, token in (tokens or {}).items():
+            account = self._by_user.get(user_id)
+            if account is not None and token:
+                account.clients.sync.next_batch = token
+
+    def sync_delays(self, timeout_ms: int) -> list[float]:
+        """Start delays that spread the accounts' sync loops over the timeout."""
+        step = min(MAX_SYNC_STAGGER, timeout_ms / 1000) / len(self.accounts)
+        return [i * step for i in range(len(self.accounts))]
+
+    def metrics(self) -> dict[str, dict[str, Any]]:
+        """Connection pool metrics per account."""
+        return {account.user_id: account.clients.metrics() for account in self.accounts}
+
+    async def close(self) -> None:
+        for account in self.accounts:
+            await account.clients.close()
@@ -9,6 +9,26 @@ logger = logging.getLogger(__name__)
 # Maximum retry attempts for Claude API
 MAX_RETRIES = 3
 
+# API clients by (key, async), shared by every command and bot account so
+# they reuse one connection pool instead of opening one per request.
+_clients: dict[tuple[str, bool], anthropic.Anthropic | anthropic.AsyncAnthropic] = {}
+
+
+def get_client(api_key: str) -> anthropic.Anthropic:
+    """Return the shared synchronous client for `api_key`."""
+    client = _clients.get((api_key, False))
+    if client is None:
+        client = _clients[(api_key, False)] = anthropic.Anthropic(api_key=api_key)
+    return client
+
+
+def get_async_client(api_key: str) -> anthropic.AsyncAnthropic:
+    """Return the shared async client for `api_key`."""
+    client = _clients.get((api_key, True))
+    if client is None:
+        client = _clients[(api_key, True)] = anthropic.AsyncAnthropic(api_key=api_key)
+    return client
+
 
 async def generate_command_code(
     api_key: str,
@@ -25,7 +45,7 @@ async def generate_command_code(
                - test_code: Generated test code for the command
                - error_message: Error message if generation failed, None otherwise
     """
-    client = anthropic.Anthropic(api_key=api_key)
+    client = get_client(api_key)
 
     prompt = f"""You are helping to generate a Matrix bot command. Generate Python code for a command with the following details:
 
@@ -40,6 +60,20 @@ Requirements:
 5. Include the @command decorator with appropriate pattern
 6. The pattern should match `!{command_name}` followed by any arguments
 7. Include clear docstring explaining what the command does
+8. If the command needs to know who sent it or where (room, sender, thread), add a second
+   parameter `ctx: CommandContext` (import it from `bot.commands`). It has `room_id`,
+   `sender`, `event_id`, `thread_root`, `server_timestamp`, `args` (the text after the
+   command, already parsed) and `match` (the pattern's regex match)
+9. If the command needs to remember anything between invocations (counters, preferences,
+   game state), take `ctx: CommandContext` and use `ctx.storage`, a persistent key-value
+   store private to this command. Methods (all synchronous, do not await them):
+   `get(key, default=None)`, `set(key, value)` (JSON-serializable values), `delete(key)`,
+   `incr(key, amount=1)` returning the new number, and `compare_and_set(key, expected, value)`
+   returning whether it was set. Keys are strings. `ctx.storage` is None in some tests, so
+   handle that case. Never keep state in module globals or files, and never import
+   sqlite3, pickle, shelve or bot.storage
+10. If the command does heavy computation and uses neither `ctx.services` nor `ctx.storage`,
+   pass `offload=True` to `@command` so it can run in a worker process
 
 IMPORTANT:
 - Import `from typing import Optional` and `from bot.commands import command`
@@ -134,6 +168,9 @@ Requirements:
 4. Import: `import pytest` and any needed types
 5. Test function names should be descriptive (e.g., `test_{command_name}_success`)
 6. Each test should call the handler function and assert the response
+7. If the handler uses `ctx.storage`, pass a `CommandContext` (from `bot.commands`) whose
+   `storage` is `Store(tmp_path / "kv.sqlite3").namespace("test")` (`Store` from
+   `bot.storage`, `tmp_path` is the pytest fixture)
 
 Generate ONLY the Python test code, no explanations or markdown."""
 
@@ -172,3 +209,41 @@ async def test_{command_name}_basic():
     result = await {command_name}_handler("!{command_name} test")
     assert result is not None
 """
+
+
+async def summarize_conversation(
+    api_key: str,
+    messages: list[tuple[str, str]],
+    model: str = "claude-sonnet-4-5-20250929",
+    max_words: int = 40
+) -> Optional[str]:
+    """
+    Summarize a conversation using Claude API.
+
+    Args:
+        api_key: Anthropic API key
+        messages: (sender, body) pairs, oldest first
+        model: Model to use
+        max_words: Upper bound on summary length
+
+    Returns:
+        The summary text, or None if the request failed
+    """
+    transcript = "\n".join(f"{sender}: {body}" for sender, body in messages)
+    prompt = f"""Summarize this chat conversation in at most {max_words} words.
+Be direct and a little uncomfortably honest about what actually happened.
+Reply with only the summary.
+
+{transcript}"""
+
+    try:
+        client = get_async_client(api_key)
+        response = await client.messages.create(
+            model=model,
+            max_tokens=256,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        return response.content[0].text.strip()
+    except Exception as e:
+        logger.warning("Failed to summarize conversation: %s", e, exc_info=True)
+        return None
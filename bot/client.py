@@ -0,0 +1,225 @@
+"""Matrix client layer with separate connection pools for sync and API calls.
+
+The /sync long-poll holds a connection open for up to the sync timeout. If
+replies share that client's pool they can end up queued behind it, so we run
+two nio clients over the same access token:
+
+- ``sync``: owns the long-poll and event callbacks. Small pool, keep-alive
+  longer than the poll so the connection is reused between syncs.
+- ``api``: carries `room_send`, profile updates and history fetches. Larger
+  pool, bounded nio-level retries.
+
+Each pool records saturation metrics via aiohttp trace hooks.
+"""
+from __future__ import annotations
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from functools import partial
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+from nio import AsyncClient, AsyncClientConfig
+from nio.client.async_client import connect_wrapper, on_request_chunk_sent
+
+from .accel import STDLIB_JSON, JsonCodec
+
+logger = logging.getLogger(__name__)
+
+# Retries nio performs itself for 429s and timeouts on API requests before
+# surfacing an error.
+MAX_REQUEST_RETRIES = 2
+
+
+@dataclass
+class PoolMetrics:
+    """Counters for one connection pool."""
+    name: str
+    limit: int
+    requests: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    queued: int = 0  # Requests currently waiting for a free connection
+    queue_waits: int = 0  # Requests that ever had to wait
+    queue_wait_seconds: float = 0.0
+    connections_created: int = 0
+    connections_reused: int = 0
+
+    @property
+    def saturation(self) -> float:
+        """Fraction of the pool's connection limit currently in use."""
+        return min(1.0, self.in_flight / self.limit) if self.limit else 0.0
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "saturation": round(self.saturation, 3),
+            "queued": self.queued,
+            "queue_waits": self.queue_waits,
+            "queue_wait_seconds": round(self.queue_wait_seconds, 3),
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+        }
+
+    def trace_config(self) -> TraceConfig:
+        """Build an aiohttp TraceConfig that feeds these metrics."""
+        trace = TraceConfig()
+        trace.on_request_chunk_sent.append(on_request_chunk_sent)
+
+        async def queued_start(session, ctx, params):
+            self.queued += 1
+            self.queue_waits += 1
+            ctx.queued_at = time.monotonic()
+
+        async def queued_end(session, ctx, params):
+            self.queued -= 1
+            self.queue_wait_seconds += time.monotonic() - ctx.queued_at
+            logger.debug("%s pool saturated; request waited %.3fs",
+                         self.name, time.monotonic() - ctx.queued_at)
+
+        async def created(session, ctx, params):
+            self.connections_created += 1
+
+        async def reused(session, ctx, params):
+            self.connections_reused += 1
+
+        trace.on_connection_queued_start.append(queued_start)
+        trace.on_connection_queued_end.append(queued_end)
+        trace.on_connection_create_end.append(created)
+        trace.on_connection_reuseconn.append(reused)
+        return trace
+
+
+class PooledAsyncClient(AsyncClient):
+    """AsyncClient whose aiohttp session uses a dedicated, sized pool.
+
+    nio creates its own default session the first time any request method
+    finds `client_session` unset. Here `client_session` is a property that
+    builds the sized, instrumented session on first read instead, so every
+    path (`send` as well as the `@client_session`-decorated helpers such as
+    `get_profile` or `download`) ends up on the same pool. With a proxy
+    configured, nio's own proxy-aware session is used.
+    """
+    _session: Optional[ClientSession] = None
+
+    def __init__(self, *args, pool_name: str = "default", pool_limit: int = 10,
+                 keepalive: float = 30.0, json_codec: JsonCodec = STDLIB_JSON,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_limit = pool_limit
+        self.keepalive = keepalive
+        self.json_codec = json_codec
+        self.pool_metrics = PoolMetrics(name=pool_name, limit=pool_limit)
+
+    @property
+    def client_session(self) -> Optional[ClientSession]:
+        if self._session is None and not self.proxy:
+            self._session = self._create_session()
+        return self._session
+
+    @client_session.setter
+    def client_session(self, session: Optional[ClientSession]) -> None:
+        self._session = session
+
+    def _create_session(self) -> ClientSession:
+        connector = TCPConnector(limit=self.pool_limit,
+                                 keepalive_timeout=self.keepalive)
+        session = ClientSession(
+            timeout=ClientTimeout(total=self.config.request_timeout),
+            trace_configs=[self.pool_metrics.trace_config()],
+            connector=connector,
+        )
+        # Same 16 KiB write-buffer limit nio applies to its own sessions.
+        connector.connect = partial(connect_wrapper, connector)
+        return session
+
+    async def close(self) -> None:
+        """Close the session if one was ever created."""
+        # Checks `_session` directly so closing an unused client doesn't
+        # build a session just to close it.
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def parse_body(self, transport_response) -> dict[Any, Any]:
+        """Decode a response body with the configured JSON codec.
+
+        Decoding straight from bytes skips aiohttp's text decode step, which
+        matters for large sync payloads. Like nio, the Content-Type header is
+        not trusted and undecodable bodies yield an empty dict.
+        """
+        raw = await transport_response.read()
+        if not raw:
+            return {}
+        try:
+            return self.json_codec.loads(raw)
+        except ValueError:
+            return {}
+
+    async def send(self, method, path, data=None, headers=None,
+                   trace_context=None, timeout=None):
+        metrics = self.pool_metrics
+        metrics.requests += 1
+        metrics.in_flight += 1
+        metrics.peak_in_flight = max(metrics.peak_in_flight, metrics.in_flight)
+        try:
+            return await super().send(method, path, data, headers,
+                                      trace_context, timeout)
+        finally:
+            metrics.in_flight -= 1
+
+
+@dataclass
+class MatrixClients:
+    """The pair of clients used by one bot identity."""
+    sync: PooledAsyncClient
+    api: PooledAsyncClient
+
+    def login(self, user_id: str, token: str) -> None:
+        """Attach a pre-issued access token to both clients."""
+        for client in (self.sync, self.api):
+            client.access_token = token
+            client.user_id = user_id  # type: ignore[attr-defined]
+
+    def metrics(self) -> dict[str, dict[str, Any]]:
+        """Return pool metrics keyed by pool name."""
+        return {c.pool_metrics.name: c.pool_metrics.snapshot()
+                for c in (self.sync, self.api)}
+
+    async def close(self) -> None:
+        for client in (self.sync, self.api):
+            try:
+                await client.close()
+            except Exception:
+                logger.warning("Error closing %s client",
+                               client.pool_metrics.name, exc_info=True)
+
+
+def create_clients(homeserver: str, user_id: str, device_id: Optional[str],
+                   sync_pool_size: int = 2, sync_keepalive: float = 75.0,
+                   api_pool_size: int = 10, api_keepalive: float = 30.0,
+                   json_codec: JsonCodec = STDLIB_JSON) -> MatrixClients:
+    """
+    Build the sync and API clients for one account.
+
+    The sync client surfaces every 429 and timeout straight away since the
+    sync supervisor owns backoff for the long-poll; the API client keeps a
+    couple of nio-level retries for sends.
+    """
+    sync_cfg = AsyncClientConfig(store_sync_tokens=True,
+                                 max_limit_exceeded=0, max_timeouts=0)
+    api_cfg = AsyncClientConfig(max_limit_exceeded=MAX_REQUEST_RETRIES,
+                                max_timeouts=MAX_REQUEST_RETRIES)
+    sync = PooledAsyncClient(homeserver, user_id, device_id=device_id,
+                             config=sync_cfg, pool_name="sync",
+                             pool_limit=sync_pool_size, keepalive=sync_keepalive,
+                             json_codec=json_codec)
+    api = PooledAsyncClient(homeserver, user_id, device_id=device_id,
+                            config=api_cfg, pool_name="api",
+                            pool_limit=api_pool_size, keepalive=api_keepalive,
+                            json_codec=json_codec)
+    return MatrixClients(sync=sync, api=api)
@@ -12,6 +12,12 @@ DANGEROUS_MODULES = {
     'builtins.open', 'open',  # File operations could be dangerous
 }
 
+# Direct database/serialization access; command state goes through ctx.storage
+STORAGE_BYPASS_MODULES = {'sqlite3', 'dbm', 'shelve', 'pickle', 'bot.storage'}
+
+# Built-ins that reach attributes by name, so can bypass the private-attribute check
+ATTRIBUTE_BUILTINS = {'getattr', 'setattr', 'delattr', 'hasattr'}
+
 # Allowed safe modules
 SAFE_MODULES = {
     'typing', 'bot.commands', 're', 'json', 'math', 'datetime',
@@ -79,6 +85,46 @@ class CodeValidator:
                 if node.module and node.module in DANGEROUS_MODULES:
                     return f"Dangerous import detected: {node.module}"
 
+            storage_check = self._check_storage_use(node)
+            if storage_check:
+                return storage_check
+
+            private_check = self._check_private_access(node)
+            if private_check:
+                return private_check
+
+        return None
+
+    def _check_storage_use(self, node: ast.AST) -> Optional[str]:
+        """Keep generated code on the public ctx.storage API."""
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name in STORAGE_BYPASS_MODULES:
+                    return f"Use ctx.storage for state instead of importing {alias.name}"
+        if isinstance(node, ast.ImportFrom):
+            module = node.module or ""
+            for alias in node.names:
+                # Covers "from bot.storage import X", "from bot import storage"
+                # and their relative forms
+                full = f"{module}.{alias.name}" if module else alias.name
+                if (module in STORAGE_BYPASS_MODULES or full in STORAGE_BYPASS_MODULES
+                        or (node.level and "storage" in (module, full))):
+                    return f"Use ctx.storage for state instead of importing {full}"
+        if (isinstance(node, ast.Attribute) and node.attr.startswith("_")
+                and isinstance(node.value, ast.Attribute) and node.value.attr == "storage"):
+            return f"Private storage attribute access detected: storage.{node.attr}"
+        return None
+
+    def _check_private_access(self, node: ast.AST) -> Optional[str]:
+        """Reject reaching into private or dunder attributes of any object."""
+        if isinstance(node, ast.Attribute) and node.attr.startswith("_"):
+            return f"Private attribute access detected: {node.attr}"
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id in ATTRIBUTE_BUILTINS and len(node.args) >= 2):
+            name = node.args[1]
+            if not (isinstance(name, ast.Constant) and isinstance(name.value, str)
+                    and not name.value.startswith("_")):
+                return f"{node.func.id}() needs a public attribute name given literally"
         return None
 
     def _check_structure(self, tree: ast.AST, command_name: str) -> Optional[str]:
@@ -1,15 +1,62 @@
 """Dynamic command registry system for The Architect bot."""
 from __future__ import annotations
 import importlib
+import inspect
 import logging
 import os
 import re
 from dataclasses import dataclass
+from html import escape
 from pathlib import Path
-from typing import Callable, Optional, Awaitable
+from typing import Any, AsyncIterator, Callable, Optional, Awaitable
+
+from ..dispatcher import DEFAULT_PRIORITY, PRIORITIES
+from ..ratelimit import Rate, parse_rate
+from ..scheduler import parse_interval
 
 logger = logging.getLogger(__name__)
 
+# Handler signatures:
+#   1: async def handler(body: str) -> Optional[str]
+#   2: async def handler(body: str, ctx: CommandContext) -> Optional[str]
+# Either may instead be an async generator yielding str pieces, which are
+# streamed to the room as they arrive (see bot.outbound.stream_reply).
+HANDLER_API_VERSIONS = (1, 2)
+
+DEFAULT_CATEGORY = "general"
+
+# Matrix caps events at 64 KiB; a listing page's body and formatted_body
+# together stay well below that.
+LISTING_PAGE_BYTES = 16 * 1024
+
+
+@dataclass
+class Reply:
+    """A handler reply with an optional HTML rendering.
+
+    Handlers may return a plain `str` or a Reply; `formatted_body` is sent
+    as `org.matrix.custom.html`.
+    """
+    body: str
+    formatted_body: Optional[str] = None
+
+
+@dataclass(slots=True)
+class CommandContext:
+    """Invocation metadata passed to version 2 handlers."""
+    body: str  # Full (stripped) message text
+    command: str  # Name of the matched command
+    args: str  # Text after the command, or the pattern's first group
+    match: Optional[re.Match] = None  # Result of the command's pattern
+    room_id: Optional[str] = None
+    sender: Optional[str] = None
+    event_id: Optional[str] = None
+    thread_root: Optional[str] = None  # Root event ID when sent in a thread
+    server_timestamp: Optional[int] = None
+    services: Any = None  # Shared bot services (see bot.services)
+    storage: Any = None  # This module's key-value namespace (see bot.storage)
+    client: Any = None  # API client of the account that received the message
+
 
 @dataclass
 class Command:
@@ -17,8 +64,52 @@ class Command:
     name: str
     description: str
     pattern: str  # Regex pattern to match command
-    handler: Callable[[str], Awaitable[Optional[str]]]
+    handler: Callable[..., Awaitable[Optional[str | Reply]]]
     module_name: str  # For reload tracking
+    api_version: int = 1  # Handler signature version
+    category: str = DEFAULT_CATEGORY  # Grouping for !list
+    streaming: bool = False  # Handler is an async generator
+    priority: str = DEFAULT_PRIORITY  # Dispatcher lane (see bot.dispatcher)
+    rate: Optional[Rate] = None  # Per-sender limit (see bot.ratelimit)
+    offload: bool = False  # May run in a worker process (see bot.workers)
+
+
+@dataclass(slots=True)
+class ScheduleContext:
+    """Run metadata passed to @scheduled handlers."""
+    task: str  # Name of the scheduled task
+    job_id: str
+    room_id: str
+    scheduled_for: float  # Nominal Unix time of this run
+    missed: int = 0  # Earlier runs coalesced into this one (see bot.scheduler)
+    payload: Any = None  # Data given when the job was added
+    services: Any = None  # Shared bot services (see bot.services)
+    storage: Any = None  # This module's key-value namespace (see bot.storage)
+    client: Any = None  # API client of the account posting the reply
+
+
+@dataclass
+class ScheduledTask:
+    """A handler run by the scheduler rather than by a message."""
+    name: str
+    handler: Callable[[ScheduleContext], Awaitable[Optional[str | Reply]]]
+    module_name: str
+    every: Optional[float] = None  # Period of the declared jobs, in seconds
+    rooms: tuple[str, ...] = ()  # Rooms that get a declared job
+    jitter: float = 0.0  # Maximum seconds each run may be offset
+    priority: str = DEFAULT_PRIORITY  # Dispatcher lane (see bot.dispatcher)
+    streaming: bool = False  # Handler is an async generator
+
+
+def _detect_api_version(handler: Callable) -> int:
+    """Infer the handler signature version from its positional parameters."""
+    try:
+        params = inspect.signature(handler).parameters.values()
+    except (TypeError, ValueError):
+        return 1
+    positional = [p for p in params
+                  if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+    return 2 if len(positional) >= 2 else 1
 
 
 class CommandRegistry:
@@ -27,22 +118,46 @@ class CommandRegistry:
     def __init__(self):
         self._commands: dict[str, Command] = {}
         self._patterns: list[tuple[re.Pattern, Command]] = []
+        # Listing lines are rendered once per registration; pages are built
+        # on first use and dropped whenever the set of commands changes.
+        self._listing_lines: dict[str, tuple[str, str, int]] = {}
+        self._listing_pages: dict[Optional[str], list[Reply]] = {}
+        self._scheduled: dict[str, ScheduledTask] = {}
 
     def register(self, name: str, description: str, pattern: str,
-                 handler: Callable[[str], Awaitable[Optional[str]]],
-                 module_name: str = "unknown") -> None:
+                 handler: Callable[..., Awaitable[Optional[str | Reply]]],
+                 module_name: str = "unknown",
+                 api_version: Optional[int] = None,
+                 category: Optional[str] = None,
+                 priority: str = DEFAULT_PRIORITY,
+                 rate: str | Rate | None = None,
+                 offload: bool = False) -> None:
         """Register a command with the registry."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'; expected one of {PRIORITIES}")
+        if api_version is None:
+            api_version = _detect_api_version(handler)
+        elif api_version not in HANDLER_API_VERSIONS:
+            raise ValueError(f"Unsupported handler api_version: {api_version}")
         cmd = Command(
             name=name,
             description=description,
             pattern=pattern,
             handler=handler,
-            module_name=module_name
+            module_name=module_name,
+            api_version=api_version,
+            category=(category or DEFAULT_CATEGORY).lower(),
+            streaming=inspect.isasyncgenfunction(handler),
+            priority=priority,
+            rate=parse_rate(rate),
+            offload=offload
         )
         self._commands[name] = cmd
+        self._listing_lines[name] = _render_listing_line(cmd)
+        self._listing_pages.clear()
         # Compile and cache regex pattern
         self._patterns.append((re.compile(pattern, re.IGNORECASE), cmd))
-        logger.info(f"Registered command: {name} (pattern: {pattern})")
+        logger.info("Registered command: %s (pattern: %s)", name, pattern)
 
     def unregister(self, name: str) -> bool:
         """Unregister a command by name."""
@@ -52,29 +167,165 @@ class CommandRegistry:
         cmd = self._commands.pop(name)
         # Remove from patterns list
         self._patterns = [(p, c) for p, c in self._patterns if c.name != name]
-        logger.info(f"Unregistered command: {name}")
+        self._listing_lines.pop(name, None)
+        self._listing_pages.clear()
+        logger.info("Unregistered command: %s", name)
         return True
 
-    async def execute(self, body: str) -> Optional[str]:
-        """Execute the first matching command."""
+    async def execute(self, body: str, found: Optional[tuple[Command, re.Match]] = None,
+                      **context: Any) -> Optional[str | Reply | AsyncIterator[str]]:
+        """Execute the first matching command.
+
+        `found` is the result of an earlier `find(body)`, so callers that
+        already matched the message don't scan the patterns again. Other
+        keyword arguments (room_id, sender, event_id, thread_root,
+        server_timestamp, services, client) are passed on to version 2
+        handlers in their CommandContext. Streaming handlers are not run
+        here: their pieces are returned as an async iterator for the caller
+        to consume.
+        """
         body_stripped = body.strip()
+        if found is None:
+            found = self.find(body_stripped)
+        if found is None:
+            return None  # No command matched
+
+        cmd, match = found
+        try:
+            logger.debug("Executing command: %s", cmd.name)
+            if cmd.api_version == 1:
+                result = cmd.handler(body_stripped)
+            else:
+                services = context.get("services")
+                store = getattr(services, "storage", None)
+                ctx = CommandContext(body=body_stripped, command=cmd.name,
+                                     args=_command_args(body_stripped, match),
+                                     match=match, **context,
+                                     storage=store.namespace(cmd.module_name) if store else None)
+                result = cmd.handler(body_stripped, ctx)
+            if cmd.streaming:
+                return _guard_stream(cmd.name, result)
+            return await result
+        except Exception:
+            logger.exception("Error executing command %s", cmd.name)
+            return f"Error executing command '{cmd.name}'. Check logs for details."
+
+    def register_scheduled(self, name: str,
+                           handler: Callable[[ScheduleContext], Awaitable[Optional[str | Reply]]],
+                           module_name: str = "unknown",
+                           every: str | float | None = None,
+                           rooms: tuple[str, ...] | list[str] = (),
+                           jitter: str | float = 0.0,
+                           priority: str = DEFAULT_PRIORITY) -> None:
+        """Register a task for the scheduler."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'; expected one of {PRIORITIES}")
+        if rooms and every is None:
+            raise ValueError(f"Scheduled task '{name}' lists rooms but no interval")
+        self._scheduled[name] = ScheduledTask(
+            name=name,
+            handler=handler,
+            module_name=module_name,
+            every=parse_interval(every),
+            rooms=tuple(rooms),
+            jitter=parse_interval(jitter) if jitter else 0.0,
+            priority=priority,
+            streaming=inspect.isasyncgenfunction(handler)
+        )
+        logger.info("Registered scheduled task: %s", name)
 
-        # Try to match against all registered patterns
+    def get_scheduled(self, name: str) -> Optional[ScheduledTask]:
+        """Get a scheduled task by name."""
+        return self._scheduled.get(name)
+
+    def scheduled_tasks(self) -> list[ScheduledTask]:
+        """Return all registered scheduled tasks."""
+        return [*self._scheduled.values()]
+
+    async def run_scheduled(self, task: ScheduledTask, ctx: ScheduleContext
+                            ) -> Optional[str | Reply | AsyncIterator[str]]:
+        """Run a scheduled task's handler, returning its reply like `execute`."""
+        store = getattr(ctx.services, "storage", None)
+        if store is not None and ctx.storage is None:
+            ctx.storage = store.namespace(task.module_name)
+        try:
+            result = task.handler(ctx)
+            if task.streaming:
+                return _guard_stream(task.name, result)
+            return await result
+        except Exception:
+            logger.exception("Error running scheduled task %s", task.name)
+            return None
+
+    def find(self, body: str) -> Optional[tuple[Command, re.Match]]:
+        """Return the first command whose pattern matches `body`, and the match."""
+        body = body.strip()
         for pattern, cmd in self._patterns:
-            if pattern.match(body_stripped):
-                try:
-                    logger.debug(f"Executing command: {cmd.name}")
-                    return await cmd.handler(body_stripped)
-                except Exception:
-                    logger.exception(f"Error executing command {cmd.name}")
-                    return f"Error executing command '{cmd.name}'. Check logs for details."
+            match = pattern.match(body)
+            if match:
+                return cmd, match
+        return None
 
-        return None  # No command matched
+    def resolve(self, name: str, body: str) -> Optional[tuple[Command, re.Match]]:
+        """Match `body` against the named command only, like `find` would."""
+        cmd = self._commands.get(name)
+        if cmd is None:
+            return None
+        match = re.match(cmd.pattern, body.strip(), re.IGNORECASE)  # Compiled pattern cached by re
+        return (cmd, match) if match else None
 
     def list_commands(self) -> list[tuple[str, str]]:
         """Return list of (name, description) for all commands."""
         return [(cmd.name, cmd.description) for cmd in self._commands.values()]
 
+    def categories(self) -> list[str]:
+        """Return the sorted names of all categories in use."""
+        return sorted({cmd.category for cmd in self._commands.values()})
+
+    def listing(self, category: Optional[str] = None) -> list[Reply]:
+        """
+        Return the pre-rendered command listing as size-bounded pages.
+
+        Args:
+            category: Only list commands in this category
+
+        Returns:
+            list of Reply pages (text and HTML); empty if nothing matches
+        """
+        key = category.lower() if category else None
+        pages = self._listing_pages.get(key)
+        if pages is None:
+            pages = self._listing_pages[key] = self._paginate(key)
+        return pages
+
+    def _paginate(self, category: Optional[str]) -> list[Reply]:
+        budget = LISTING_PAGE_BYTES - 512  # Room for the header and footer
+        chunks: list[list[tuple[str, str, int]]] = []
+        size = budget
+        for name, line in self._listing_lines.items():
+            if category is not None and self._commands[name].category != category:
+                continue
+            if size + line[2] > budget:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(line)
+            size += line[2]
+
+        title = f"Available {category} commands" if category else "Available commands"
+        prefix = f"!list {category} " if category else "!list "
+        pages = []
+        for number, chunk in enumerate(chunks, 1):
+            heading = title if len(chunks) == 1 else f"{title} (page {number}/{len(chunks)})"
+            text = [f"{heading}:"] + [line[0] for line in chunk]
+            html = (f"<p><strong>{escape(heading)}:</strong></p><ul>"
+                    + "".join(line[1] for line in chunk) + "</ul>")
+            if number < len(chunks):
+                footer = f"Send {prefix}{number + 1} for more."
+                text.append(footer)
+                html += f"<p>{escape(footer)}</p>"
+            pages.append(Reply(body="\n".join(text), formatted_body=html))
+        return pages
+
     def get_command(self, name: str) -> Optional[Command]:
         """Get command by name."""
         return self._commands.get(name)
@@ -83,24 +334,93 @@ class CommandRegistry:
         """Clear all registered commands."""
         self._commands.clear()
         self._patterns.clear()
+        self._listing_lines.clear()
+        self._listing_pages.clear()
+        self._scheduled.clear()
+
+
+async def _guard_stream(name: str, pieces: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Yield a streaming handler's pieces, turning a failure into a final piece."""
+    try:
+        async for piece in pieces:
+            yield piece
+    except Exception:
+        logger.exception("Error executing command %s", name)
+        yield f"\n\nError executing command '{name}'. Check logs for details."
+
+
+def _render_listing_line(cmd: Command) -> tuple[str, str, int]:
+    """Render one command's listing entry as (text, html, encoded size)."""
+    text = f"  !{cmd.name} - {cmd.description}"
+    html = f"<li><code>!{escape(cmd.name)}</code> - {escape(cmd.description)}</li>"
+    return text, html, len(text.encode()) + len(html.encode()) + 1
+
+
+def _command_args(body: str, match: re.Match) -> str:
+    """Argument string: the pattern's first group, else the text after the match."""
+    if match.re.groups and match.group(1) is not None:
+        return match.group(1).strip()
+    return body[match.end():].strip()
 
 
 # Global registry instance
 _registry = CommandRegistry()
 
 
-def command(name: str, description: str, pattern: str):
+def command(name: str, description: str, pattern: str,
+            api_version: Optional[int] = None, category: Optional[str] = None,
+            priority: str = DEFAULT_PRIORITY, rate: str | Rate | None = None,
+            offload: bool = False):
     """Decorator to register a command handler.
 
+    Handlers taking a second positional parameter receive a CommandContext
+    (api_version 2); pass `api_version` to pin the signature explicitly.
+    `category` groups the command in `!list` (default "general").
+    `priority` picks its dispatcher lane: "interactive", "standard" (the
+    default) or "bulk". `rate` (e.g. "3/hour") limits how often one sender
+    may run the command. `offload=True` lets a CPU-heavy command run in a
+    worker process when the bot has them (see bot.workers); such handlers
+    must not rely on ctx.services beyond the config, nor on ctx.storage.
+
     Usage:
         @command(name="ping", description="Ping the bot", pattern=r"^!ping$")
         async def ping_handler(body: str) -> Optional[str]:
             return "pong"
+
+        @command(name="echo", description="Echo", pattern=r"^!echo (.*)$")
+        async def echo_handler(body: str, ctx: CommandContext) -> Optional[str]:
+            return f"{ctx.sender} said {ctx.args}"
     """
-    def decorator(func: Callable[[str], Awaitable[Optional[str]]]):
+    def decorator(func: Callable[..., Awaitable[Optional[str | Reply]]]):
         # Get the module name of the function for tracking
         module_name = func.__module__
-        _registry.register(name, description, pattern, func, module_name)
+        _registry.register(name, description, pattern, func, module_name,
+                           api_version=api_version, category=category,
+                           priority=priority, rate=rate, offload=offload)
+        return func
+    return decorator
+
+
+def scheduled(name: str, every: str | float | None = None,
+              rooms: tuple[str, ...] | list[str] = (), jitter: str | float = 0.0,
+              priority: str = DEFAULT_PRIORITY):
+    """Decorator to register a task run by the scheduler (see bot.scheduler).
+
+    The handler takes a ScheduleContext and returns a reply for the job's
+    room, like a command handler. With `every` (e.g. "1h") and `rooms`, the
+    task runs periodically in each of those rooms; otherwise it runs only
+    when a job is added through ``ctx.services.scheduler.add(name, ...)``.
+    `jitter` (e.g. "5m") spreads runs sharing a period; `priority` picks the
+    dispatcher lane, "bulk" suiting most periodic work.
+
+    Usage:
+        @scheduled(name="standup", every="1d", rooms=["!team:example.org"])
+        async def standup_task(ctx: ScheduleContext) -> Optional[str]:
+            return "Time for standup!"
+    """
+    def decorator(func: Callable[[ScheduleContext], Awaitable[Optional[str | Reply]]]):
+        _registry.register_scheduled(name, func, func.__module__, every=every,
+                                     rooms=rooms, jitter=jitter, priority=priority)
         return func
     return decorator
 
@@ -124,14 +444,15 @@ def load_commands() -> None:
                 importlib.reload(importlib.sys.modules[module_name])
             else:
                 importlib.import_module(module_name)
-            logger.info(f"Loaded command module: {module_name}")
+            logger.info("Loaded command module: %s", module_name)
         except Exception:
-            logger.exception(f"Failed to load command module: {module_name}")
+            logger.exception("Failed to load command module: %s", module_name)
 
 
-async def execute_command(body: str) -> Optional[str]:
+async def execute_command(body: str, found: Optional[tuple[Command, re.Match]] = None,
+                          **context: Any) -> Optional[str | Reply | AsyncIterator[str]]:
     """Execute a command based on message body. This is the main entry point."""
-    return await _registry.execute(body)
+    return await _registry.execute(body, found, **context)
 
 
 def get_registry() -> CommandRegistry:
@@ -8,7 +8,7 @@ from . import command
 from ..claude_integration import generate_command_code
 from ..code_validator import validate_command_code, validate_test_code
 from ..git_integration import git_commit
-from ..reload import restart_bot
+from ..reload import request_restart
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +16,10 @@ logger = logging.getLogger(__name__)
 @command(
     name="add",
     description="Add a new command using AI (usage: !add -n <name> -d \"<description>\")",
-    pattern=r"^!add\s+"
+    pattern=r"^!add\s+",
+    category="admin",
+    priority="bulk",
+    rate="3/hour"
 )
 async def add_handler(body: str) -> Optional[str]:
     """
@@ -50,9 +53,9 @@ async def add_handler(body: str) -> Optional[str]:
         return f"Command '{command_name}' already exists. Use !remove first if you want to replace it."
 
     # Load config
-    from ..config import load_config
+    from ..config import get_config
     try:
-        cfg = load_config()
+        cfg = get_config()
         api_key = cfg.anthropic_api_key
         enable_auto_commit = cfg.enable_auto_commit
     except Exception as e:
@@ -128,14 +131,13 @@ async def add_handler(body: str) -> Optional[str]:
                     "Bot will restart shortly to apply changes."
                 )
 
-        # Schedule bot restart
-        import asyncio
-        asyncio.create_task(_delayed_restart())
+        # The restart waits for in-flight replies, including this one
+        request_restart(f"added command {command_name}")
 
         return (
             f"Command '{command_name}' created successfully!\n"
             f"Description: {command_description}\n"
-            f"Bot will restart in 2 seconds to load the new command."
+            f"Bot will restart shortly to load the new command."
         )
 
     except Exception as e:
@@ -144,10 +146,3 @@ async def add_handler(body: str) -> Optional[str]:
         if command_file.exists():
             command_file.unlink()
         return f"Error creating command: {e}"
-
-
-async def _delayed_restart():
-    """Restart the bot after a short delay to allow message to be sent."""
-    import asyncio
-    await asyncio.sleep(2)  # Wait 2 seconds for message to be sent
-    restart_bot()
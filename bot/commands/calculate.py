@@ -1,163 +1,310 @@
 from __future__ import annotations
+from decimal import Decimal, InvalidOperation, localcontext
+from fractions import Fraction
+from functools import lru_cache
+import math
 from typing import Optional
 import re
-from . import command
+from . import CommandContext, command
+
+# Hard limits so hostile input can't burn CPU or memory.
+MAX_EXPRESSION_LENGTH = 200
+MAX_NESTING_DEPTH = 20
+MAX_RESULT_DIGITS = 100  # |result| must stay below 10**MAX_RESULT_DIGITS
+MAX_RESULT = 10 ** MAX_RESULT_DIGITS
+MAX_EXPONENT = 10_000
+MAX_EXACT_DIGITS = 1000  # Digits in a fraction's numerator or denominator, or a decimal's exponent
+_MAX_EXACT_BITS = math.ceil(MAX_EXACT_DIGITS * math.log2(10))
+DECIMAL_PRECISION = 40
+COMPILE_CACHE_SIZE = 512
+
+MODES = ("float", "decimal", "fraction")
+
+USAGE = "Usage: !calculate <expression>\nExample: !calculate 3+4"
+
+# One token per match: a number, or an operator/parenthesis.
+_TOKEN = re.compile(r"(\d+\.?\d*|\.\d+)|(\*\*|[-+*/%^()])")
+_MODE_FLAG = re.compile(r"^--(float|decimal|fraction)\s+")
+
+# Binary operators: symbol -> (precedence, right associative, opcode)
+_BINARY = {
+    "+": (1, False, "add"),
+    "-": (1, False, "sub"),
+    "*": (2, False, "mul"),
+    "/": (2, False, "div"),
+    "%": (2, False, "mod"),
+    "^": (4, True, "pow"),
+    "**": (4, True, "pow"),
+}
+# Unary minus binds tighter than * but looser than ^, so -2^2 == -4.
+_UNARY_PRECEDENCE = 3
 
 
 @command(
     name="calculate",
-    description="Calculate the result of the simple calculation given e.g. 3+4 or 5-5 or 7*7. Do not use eval.",
-    pattern=r"^!calculate\s*(.*)$"
+    description="Calculate an expression, e.g. 3+4, (2+3)*4 or 2^10; add --fraction or --decimal for exact results. Does not use eval.",
+    pattern=r"^!calculate\s*(.*)$",
+    category="math",
+    priority="interactive",
+    offload=True
 )
-async def calculate_handler(body: str) -> Optional[str]:
+async def calculate_handler(body: str, ctx: Optional[CommandContext] = None) -> Optional[str]:
     """
-    Calculate the result of a simple mathematical expression.
-    
-    Supports basic operations: addition (+), subtraction (-), multiplication (*), and division (/).
-    Does not use eval() for security reasons.
-    
+    Calculate the result of a mathematical expression.
+
+    Supports +, -, *, /, % and ^ (or **) with the usual precedence, unary
+    minus and parentheses. Does not use eval() for security reasons.
+    Prefix the expression with --decimal or --fraction for exact arithmetic
+    (e.g. "!calculate --fraction 1/3+1/6" gives "1/2").
+
     Args:
         body: The full message text containing the command and expression
-        
+        ctx: Invocation context; when given, its pre-parsed arguments are used
+
     Returns:
         The calculation result as a string, or an error message if the expression is invalid
     """
-    match = re.match(r"^!calculate\s*(.*)$", body.strip())
-    if not match:
-        return "Usage: !calculate <expression>\nExample: !calculate 3+4"
-    
-    expression = match.group(1).strip()
-    
-    if not expression:
-        return "Usage: !calculate <expression>\nExample: !calculate 3+4"
-    
+    if ctx is not None:
+        expression = ctx.args
+    else:
+        match = re.match(r"^!calculate\s*(.*)$", body.strip())
+        if not match:
+            return USAGE
+        expression = match.group(1).strip()
+
+    mode = "float"
+    flag = _MODE_FLAG.match(expression)
+    if flag:
+        mode = flag.group(1)
+        expression = expression[flag.end():]
+
     # Remove all whitespace
-    expression = expression.replace(" ", "")
-    
-    # Parse and calculate the expression
+    expression = "".join(expression.split())
+
+    if not expression:
+        return USAGE
+
     try:
-        result = parse_expression(expression)
+        result = evaluate(expression, mode)
         return f"{expression} = {result}"
+    except OverflowError:
+        return "Error: Result too large"
     except ValueError as e:
         return f"Error: {str(e)}"
     except ZeroDivisionError:
         return "Error: Division by zero"
     except Exception:
-        return "Error: Invalid expression. Use simple operations like: 3+4, 5-5, 7*7, 10/2"
+        return "Error: Invalid expression. Use operations like: 3+4, 5-5, 7*7, 10/2, (1+2)^3"
 
 
 def parse_expression(expr: str) -> float:
     """
-    Parse and evaluate a simple mathematical expression without using eval().
-    
+    Evaluate a mathematical expression as a float without using eval().
+
     Args:
         expr: Mathematical expression string
-        
+
     Returns:
         The calculated result
-        
+
     Raises:
-        ValueError: If the expression is invalid
+        ValueError: If the expression is invalid or exceeds a limit
         ZeroDivisionError: If division by zero is attempted
     """
-    # Handle multiplication and division first (operator precedence)
-    # Split by + and - while keeping track of operations
-    parts = []
-    current_num = ""
-    operations = []
-    
-    i = 0
-    while i < len(expr):
-        char = expr[i]
-        
-        if char in "+-":
-            if current_num or (char == "-" and not current_num and not parts):
-                # Handle negative numbers at the start
-                if char == "-" and not current_num and not parts:
-                    current_num = "-"
-                else:
-                    if current_num:
-                        parts.append(evaluate_mult_div(current_num))
-                        current_num = ""
-                    operations.append(char)
-            else:
-                raise ValueError("Invalid expression format")
-        else:
-            current_num += char
-        
-        i += 1
-    
-    if current_num:
-        parts.append(evaluate_mult_div(current_num))
-    
-    if not parts:
-        raise ValueError("No valid expression found")
-    
-    # Now handle addition and subtraction from left to right
-    result = parts[0]
-    for i, op in enumerate(operations):
-        if op == "+":
-            result += parts[i + 1]
-        elif op == "-":
-            result -= parts[i + 1]
-    
-    return result
+    return evaluate(expr, "float")
 
 
-def evaluate_mult_div(expr: str) -> float:
+def evaluate(expr: str, mode: str = "float"):
     """
-    Evaluate multiplication and division in an expression.
-    
+    Evaluate an expression in the given number mode.
+
     Args:
-        expr: Expression containing only numbers, *, and /
-        
+        expr: Expression without whitespace
+        mode: "float", "decimal" or "fraction"
+
     Returns:
-        The calculated result
-        
+        float, Decimal or Fraction depending on mode
+
     Raises:
-        ValueError: If the expression is invalid
+        ValueError: If the expression is invalid or exceeds a limit
         ZeroDivisionError: If division by zero is attempted
     """
-    parts = []
-    operations = []
-    current_num = ""
-    
-    i = 0
-    while i < len(expr):
-        char = expr[i]
-        
-        if char in "*/":
-            if current_num:
-                try:
-                    parts.append(float(current_num))
-                except ValueError:
-                    raise ValueError(f"Invalid number: {current_num}")
-                current_num = ""
-                operations.append(char)
-            else:
-                raise ValueError("Invalid expression format")
-        else:
-            current_num += char
-        
-        i += 1
-    
-    if current_num:
-        try:
-            parts.append(float(current_num))
-        except ValueError:
-            raise ValueError(f"Invalid number: {current_num}")
-    
-    if not parts:
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode: {mode}")
+    program = compile_expression(expr)
+    if mode == "decimal":
+        with localcontext() as decimal_ctx:
+            decimal_ctx.prec = DECIMAL_PRECISION
+            try:
+                return _run(program, Decimal)
+            except InvalidOperation:
+                raise ValueError("Invalid decimal operation")
+    return _run(program, Fraction if mode == "fraction" else float)
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_expression(expr: str) -> tuple[tuple[str, Optional[str]], ...]:
+    """
+    Compile an expression to postfix bytecode.
+
+    The bytecode is a tuple of (opcode, operand) pairs: ("push", "<number>"),
+    ("neg", None) or a binary opcode ("add", "sub", "mul", "div", "mod",
+    "pow"). Compiled programs are cached, so repeated expressions skip
+    tokenizing and parsing entirely.
+
+    Raises:
+        ValueError: If the expression is invalid or exceeds a limit
+    """
+    if len(expr) > MAX_EXPRESSION_LENGTH:
+        raise ValueError(f"Expression too long (max {MAX_EXPRESSION_LENGTH} characters)")
+    parser = _Parser(_tokenize(expr))
+    parser.parse_expression(0)
+    if parser.pos != len(parser.tokens):
+        raise ValueError("Invalid expression format")
+    return tuple(parser.code)
+
+
+def _tokenize(expr: str) -> list[tuple[str, str]]:
+    """Split an expression into ("num", text) and ("op", symbol) tokens in one pass."""
+    tokens = []
+    pos = 0
+    for match in _TOKEN.finditer(expr):
+        if match.start() != pos:
+            raise ValueError(f"Invalid character: {expr[pos]}")
+        number, op = match.groups()
+        tokens.append(("num", number) if number else ("op", op))
+        pos = match.end()
+    if pos != len(expr):
+        raise ValueError(f"Invalid character: {expr[pos]}")
+    if not tokens:
         raise ValueError("No valid expression found")
-    
-    # Evaluate from left to right
-    result = parts[0]
-    for i, op in enumerate(operations):
-        if op == "*":
-            result *= parts[i + 1]
-        elif op == "/":
-            if parts[i + 1] == 0:
+    return tokens
+
+
+class _Parser:
+    """Precedence-climbing parser emitting postfix bytecode."""
+
+    def __init__(self, tokens: list[tuple[str, str]]):
+        self.tokens = tokens
+        self.pos = 0
+        self.depth = 0
+        self.code: list[tuple[str, Optional[str]]] = []
+
+    def _peek(self) -> Optional[tuple[str, str]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse_expression(self, min_precedence: int) -> None:
+        self._parse_operand()
+        while True:
+            token = self._peek()
+            if token is None or token[0] != "op" or token[1] not in _BINARY:
+                return
+            precedence, right_assoc, opcode = _BINARY[token[1]]
+            if precedence < min_precedence:
+                return
+            self.pos += 1
+            self.parse_expression(precedence if right_assoc else precedence + 1)
+            self.code.append((opcode, None))
+
+    def _parse_operand(self) -> None:
+        token = self._peek()
+        if token is None:
+            raise ValueError("Invalid expression format")
+        kind, value = token
+        self.pos += 1
+        if kind == "num":
+            self.code.append(("push", value))
+        elif value == "-":
+            self._nest()
+            self.parse_expression(_UNARY_PRECEDENCE)
+            self.depth -= 1
+            self.code.append(("neg", None))
+        elif value == "(":
+            self._nest()
+            self.parse_expression(0)
+            self.depth -= 1
+            if self._peek() != ("op", ")"):
+                raise ValueError("Missing closing parenthesis")
+            self.pos += 1
+        else:
+            raise ValueError("Invalid expression format")
+
+    def _nest(self) -> None:
+        self.depth += 1
+        if self.depth > MAX_NESTING_DEPTH:
+            raise ValueError(f"Expression nested too deeply (max {MAX_NESTING_DEPTH})")
+
+
+def _power(base, exponent, number_type):
+    if number_type is Fraction and exponent.denominator != 1:
+        raise ValueError("Fraction mode only supports integer exponents")
+    if abs(exponent) > MAX_EXPONENT:
+        raise ValueError(f"Exponent too large (max {MAX_EXPONENT})")
+    if base not in (0, 1, -1):
+        # Estimate the result's size (as a power of ten) before computing it.
+        # Exact modes also need tiny results bounded: (1/3)^999 is a
+        # 477-digit denominator.
+        magnitude = float(exponent) * _log10(abs(base))
+        if magnitude > MAX_RESULT_DIGITS:
+            raise ValueError("Result too large")
+        if number_type is not float and magnitude < -MAX_EXACT_DIGITS:
+            raise ValueError("Result too small")
+    try:
+        result = base ** exponent
+    except (ValueError, OverflowError):
+        raise ValueError("Result too large") from None
+    if isinstance(result, complex):
+        raise ValueError("Result is not a real number")
+    return result
+
+
+def _log10(value) -> float:
+    if isinstance(value, Fraction):
+        return math.log10(value.numerator) - math.log10(value.denominator)
+    return math.log10(value)
+
+
+def _check_exact_size(value) -> None:
+    """Keep fractions' and decimals' representations bounded."""
+    if isinstance(value, Fraction):
+        if max(value.numerator.bit_length(), value.denominator.bit_length()) > _MAX_EXACT_BITS:
+            raise ValueError("Result too large")
+    elif value and value.adjusted() < -MAX_EXACT_DIGITS:
+        raise ValueError("Result too small")
+
+
+def _run(program: tuple[tuple[str, Optional[str]], ...], number_type):
+    """Execute compiled bytecode on a small stack machine."""
+    stack = []
+    push, pop = stack.append, stack.pop
+    for opcode, operand in program:
+        if opcode == "push":
+            push(number_type(operand))
+            continue
+        if opcode == "neg":
+            push(-pop())
+            continue
+        right = pop()
+        left = pop()
+        if opcode == "add":
+            value = left + right
+        elif opcode == "sub":
+            value = left - right
+        elif opcode == "mul":
+            value = left * right
+        elif opcode == "div":
+            if right == 0:
+                raise ZeroDivisionError()
+            value = left / right
+        elif opcode == "mod":
+            if right == 0:
                 raise ZeroDivisionError()
-            result /= parts[i + 1]
-    
-    return result
\ No newline at end of file
+            value = left % right
+        else:
+            value = _power(left, right, number_type)
+        if abs(value) >= MAX_RESULT:
+            raise ValueError("Result too large")
+        if number_type is not float:
+            _check_exact_size(value)
+        push(value)
+    return stack[0]
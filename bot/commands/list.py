@@ -1,25 +1,48 @@
 """List command - shows all available commands."""
 from __future__ import annotations
 from typing import Optional
-from . import command, get_registry
+from . import CommandContext, Reply, command, get_registry
 
 
 @command(
     name="list",
-    description="List all available commands",
-    pattern=r"^!list$"
+    description="List available commands (usage: !list [category] [page])",
+    pattern=r"^!list(?:\s+(.*))?$",
+    category="admin",
+    priority="interactive"
 )
-async def list_handler(body: str) -> Optional[str]:
-    """List all registered commands."""
+async def list_handler(body: str, ctx: Optional[CommandContext] = None) -> Optional[str | Reply]:
+    """
+    List registered commands, one size-bounded page at a time.
+
+    Examples:
+        !list        -> first page of all commands
+        !list 2      -> second page
+        !list math   -> commands in the "math" category
+
+    Args:
+        body: The full message text
+        ctx: Invocation context; when given, its pre-parsed arguments are used
+
+    Returns:
+        A Reply with plain-text and HTML renderings of the page
+    """
+    args = ctx.args if ctx is not None else body.strip()[len("!list"):].strip()
     registry = get_registry()
-    commands_list = registry.list_commands()
 
-    if not commands_list:
-        return "No commands available."
+    words = args.split()
+    page = 1
+    if words and words[-1].isdecimal():  # isdigit() also accepts "²"
+        page = int(words.pop())
+    category = " ".join(words).lower() or None
 
-    # Format the list nicely
-    lines = ["Available commands:"]
-    for name, description in commands_list:
-        lines.append(f"  !{name} - {description}")
+    if category is not None and category not in registry.categories():
+        return (f"Unknown category '{category}'. "
+                f"Categories: {', '.join(registry.categories())}")
 
-    return "\n".join(lines)
+    pages = registry.listing(category)
+    if not pages:
+        return "No commands available."
+    if not 1 <= page <= len(pages):
+        return f"There is no page {page}; pages run from 1 to {len(pages)}."
+    return pages[page - 1]
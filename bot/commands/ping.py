@@ -7,7 +7,9 @@ from . import command
 @command(
     name="ping",
     description="Responds with 'pong'",
-    pattern=r"^!ping$"
+    pattern=r"^!ping$",
+    category="general",
+    priority="interactive"
 )
 async def ping_handler(body: str) -> Optional[str]:
     """Simple ping command."""
@@ -1,127 +1,143 @@
+"""!reactmoji: reply with the opposite energy of each emoji sent.
+
+The opposites live in ``data/reactmoji.json`` and are indexed once at import,
+so edits take effect on the next restart (such as the one ``!add`` and
+``!remove`` trigger). Lookups are keyed on folded grapheme clusters:
+variation selectors and skin-tone modifiers are stripped, so ``☀`` and
+``☀️`` or ``👍`` and ``👍🏽`` hit the same entry.
+"""
 from __future__ import annotations
-from typing import Optional
-from . import command
+import json
+import logging
 import re
+from pathlib import Path
+from typing import Iterator, Optional
+from . import CommandContext, command
+
+logger = logging.getLogger(__name__)
+
+DATA_FILE = Path(__file__).parent / "data" / "reactmoji.json"
+
+ZWJ = "\u200d"
+KEYCAP = "\u20e3"
+# Stripped when folding: text/emoji presentation selectors and skin tones.
+_FOLDED = re.compile("[\ufe0e\ufe0f\U0001f3fb-\U0001f3ff]")
+
+
+def _is_extender(ch: str) -> bool:
+    """Code points that attach to the preceding character's cluster."""
+    return (ch in "\ufe0e\ufe0f" or ch == KEYCAP
+            or "\U0001f3fb" <= ch <= "\U0001f3ff"      # Skin tones
+            or "\U000e0020" <= ch <= "\U000e007f"      # Tag sequences (flags)
+            or "\u0300" <= ch <= "\u036f")            # Combining marks
+
+
+def _is_regional_indicator(ch: str) -> bool:
+    return "\U0001f1e6" <= ch <= "\U0001f1ff"
+
+
+def graphemes(text: str) -> Iterator[str]:
+    """
+    Split text into emoji-aware grapheme clusters.
+
+    Handles the cases that matter for emoji: modifiers and selectors,
+    keycaps, ZWJ sequences and regional-indicator flag pairs. This is not
+    a full UAX #29 implementation.
+    """
+    i, n = 0, len(text)
+    while i < n:
+        start = i
+        if _is_regional_indicator(text[i]):
+            i += 2 if i + 1 < n and _is_regional_indicator(text[i + 1]) else 1
+        else:
+            i += 1
+        while i < n:
+            if _is_extender(text[i]):
+                i += 1
+            elif text[i] == ZWJ and i + 1 < n:
+                i += 2
+            else:
+                break
+        yield text[start:i]
+
+
+def fold(cluster: str) -> str:
+    """Normalize a cluster for lookup by dropping selectors and skin tones."""
+    return _FOLDED.sub("", cluster)
+
+
+def load_index(path: Path = DATA_FILE) -> dict[str, str]:
+    """
+    Load the opposites table and key it by folded cluster.
+
+    Values are kept verbatim so replies use the canonical presentation.
+    """
+    with open(path, encoding="utf-8") as f:
+        mapping = json.load(f)
+    index = {}
+    for emoji, opposite in mapping.items():
+        index.setdefault(fold(emoji), opposite)
+    logger.debug("Loaded %d reactmoji entries from %s", len(index), path)
+    return index
+
+
+OPPOSITES = load_index()
+
+
+def opposites(text: str) -> Optional[str]:
+    """
+    Map every emoji in `text` to its opposite in a single pass.
+
+    Whitespace between emoji is preserved. Returns None if any cluster is
+    unknown (including plain text).
+    """
+    out = []
+    for cluster in graphemes(text):
+        if cluster.isspace():
+            out.append(cluster)
+            continue
+        opposite = OPPOSITES.get(fold(cluster))
+        if opposite is None:
+            return None
+        out.append(opposite)
+    return "".join(out)
+
 
 @command(
     name="reactmoji",
     description="reply with the canonical opposite energy of the emoji the user just sent (e.g. 😇→😈, 🔥→💧, 💤→⚡, etc.)",
-    pattern=r"^!reactmoji\s*(.*)$"
+    pattern=r"^!reactmoji\s*(.*)$",
+    category="fun",
+    priority="interactive"
 )
-async def reactmoji_handler(body: str) -> Optional[str]:
+async def reactmoji_handler(body: str, ctx: Optional[CommandContext] = None) -> Optional[str]:
     """
     Reply with the canonical opposite energy of the provided emoji.
-    
+
     Examples:
         !reactmoji 😇 -> 😈
         !reactmoji 🔥 -> 💧
-        !reactmoji 💤 -> ⚡
-    
+        !reactmoji 😇🔥 -> 😈💧
+
     Args:
         body: The full message text containing the command and emoji
-        
+        ctx: Invocation context; when given, its pre-parsed arguments are used
+
     Returns:
         The opposite emoji, or an error message if no match found
     """
-    match = re.match(r"^!reactmoji\s*(.*)$", body)
-    if not match:
-        return None
-    
-    emoji_input = match.group(1).strip()
-    
+    if ctx is not None:
+        emoji_input = ctx.args
+    else:
+        match = re.match(r"^!reactmoji\s*(.*)$", body)
+        if not match:
+            return None
+        emoji_input = match.group(1).strip()
+
     if not emoji_input:
         return "Please provide an emoji! Example: !reactmoji 😇"
-    
-    opposite_map = {
-        "😇": "😈",
-        "😈": "😇",
-        "🔥": "💧",
-        "💧": "🔥",
-        "💤": "⚡",
-        "⚡": "💤",
-        "☀️": "🌙",
-        "🌙": "☀️",
-        "🌞": "🌚",
-        "🌚": "🌞",
-        "❄️": "🔥",
-        "🧊": "🔥",
-        "🌊": "🔥",
-        "💦": "🔥",
-        "👼": "👿",
-        "👿": "👼",
-        "😊": "😢",
-        "😢": "😊",
-        "😂": "😭",
-        "😭": "😂",
-        "😍": "🤢",
-        "🤢": "😍",
-        "😴": "😃",
-        "😃": "😴",
-        "🥶": "🥵",
-        "🥵": "🥶",
-        "❤️": "💔",
-        "💔": "❤️",
-        "💚": "🖤",
-        "🖤": "💚",
-        "🌱": "🥀",
-        "🥀": "🌱",
-        "🌸": "🍂",
-        "🍂": "🌸",
-        "🌈": "⛈️",
-        "⛈️": "🌈",
-        "🌤️": "⛈️",
-        "☁️": "☀️",
-        "🌟": "🌑",
-        "🌑": "🌟",
-        "⭐": "🕳️",
-        "✨": "💀",
-        "💀": "✨",
-        "👆": "👇",
-        "👇": "👆",
-        "👍": "👎",
-        "👎": "👍",
-        "🔊": "🔇",
-        "🔇": "🔊",
-        "📈": "📉",
-        "📉": "📈",
-        "🏃": "🚶",
-        "🚶": "🏃",
-        "🌅": "🌇",
-        "🌇": "🌅",
-        "🌄": "🌆",
-        "🌆": "🌄",
-        "🎉": "😐",
-        "😐": "🎉",
-        "🎊": "😑",
-        "😑": "🎊",
-        "💪": "🦴",
-        "🦴": "💪",
-        "🧠": "💭",
-        "💭": "🧠",
-        "🌵": "🌴",
-        "🌴": "🌵",
-        "🏔️": "🏖️",
-        "🏖️": "🏔️",
-        "🌋": "🧊",
-        "🍕": "🥗",
-        "🥗": "🍕",
-        "🍰": "🥦",
-        "🥦": "🍰",
-        "🍺": "☕",
-        "☕": "🍺",
-        "🌮": "🥙",
-        "🥙": "🌮",
-        "🎮": "📚",
-        "📚": "🎮",
-        "🎸": "🎻",
-        "🎻": "🎸",
-        "🚀": "⚓",
-        "⚓": "🚀",
-        "✈️": "🚢",
-        "🚢": "✈️",
-    }
-    
-    if emoji_input in opposite_map:
-        return opposite_map[emoji_input]
-    else:
-        return f"I don't know the opposite of {emoji_input} yet! 🤷"
\ No newline at end of file
+
+    result = opposites(emoji_input)
+    if result is None:
+        return f"I don't know the opposite of {emoji_input} yet! 🤷"
+    return result
@@ -0,0 +1,43 @@
+"""Remind command - posts a message in the room after a delay."""
+from __future__ import annotations
+from typing import Optional
+from . import CommandContext, ScheduleContext, command, scheduled
+from ..scheduler import parse_interval
+
+USAGE = "Usage: !remind in <delay> <message> (e.g. !remind in 20m stand up)"
+
+MAX_DELAY = 365 * 86400
+
+
+@command(
+    name="remind",
+    description="Post a reminder later (usage: !remind in <delay> <message>)",
+    pattern=r"^!remind\b",
+    category="general",
+    priority="interactive",
+    rate="20/hour"
+)
+async def remind_handler(body: str, ctx: CommandContext) -> Optional[str]:
+    """Schedule a reminder in this room."""
+    parts = ctx.args.split(maxsplit=2)
+    if len(parts) < 3 or parts[0].lower() != "in":
+        return USAGE
+    try:
+        delay = parse_interval(parts[1])
+    except ValueError as e:
+        return f"{e}\n{USAGE}"
+    if delay > MAX_DELAY:
+        return "Reminders can be at most a year away."
+    scheduler = getattr(ctx.services, "scheduler", None)
+    if scheduler is None:
+        return "Reminders are not available right now."
+    scheduler.add("remind", ctx.room_id, delay=delay,
+                  payload={"sender": ctx.sender, "text": parts[2]})
+    return f"OK, I'll remind you in {parts[1]}."
+
+
+@scheduled(name="remind", priority="interactive")
+async def remind_task(ctx: ScheduleContext) -> Optional[str]:
+    """Post a reminder added by remind_handler."""
+    payload = ctx.payload or {}
+    return f"{payload.get('sender', 'Someone')}: reminder: {payload.get('text', '')}"
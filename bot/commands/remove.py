@@ -6,7 +6,7 @@ from pathlib import Path
 from typing import Optional
 from . import command, get_registry
 from ..git_integration import git_remove
-from ..reload import restart_bot
+from ..reload import request_restart
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +17,10 @@ PROTECTED_COMMANDS = {"add", "remove", "list", "ping", "greetings"}
 @command(
     name="remove",
     description="Remove a dynamically added command (usage: !remove <command_name>)",
-    pattern=r"^!remove\s+(\w+)$"
+    pattern=r"^!remove\s+(\w+)$",
+    category="admin",
+    priority="bulk",
+    rate="5/hour"
 )
 async def remove_handler(body: str) -> Optional[str]:
     """Remove a command from the system."""
@@ -46,9 +49,9 @@ async def remove_handler(body: str) -> Optional[str]:
         return f"Command file not found: {command_file}"
 
     # Import config to check if auto-commit is enabled
-    from ..config import load_config
+    from ..config import get_config
     try:
-        cfg = load_config()
+        cfg = get_config()
         enable_auto_commit = cfg.enable_auto_commit
     except Exception:
         enable_auto_commit = False
@@ -79,16 +82,7 @@ async def remove_handler(body: str) -> Optional[str]:
     # Unregister from registry
     registry.unregister(command_name)
 
-    # Schedule bot restart (will happen after this message is sent)
-    # We need to do this in a way that doesn't interrupt the message send
-    import asyncio
-    asyncio.create_task(_delayed_restart())
+    # The restart waits for in-flight replies, including this one
+    request_restart(f"removed command {command_name}")
 
     return f"Command '{command_name}' removed successfully. Bot will restart shortly to apply changes."
-
-
-async def _delayed_restart():
-    """Restart the bot after a short delay to allow message to be sent."""
-    import asyncio
-    await asyncio.sleep(2)  # Wait 2 seconds for message to be sent
-    restart_bot()
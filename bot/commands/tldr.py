@@ -1,42 +1,105 @@
+"""Tldr command - summarizes the current thread or room."""
 from __future__ import annotations
 from typing import Optional
-from . import command
+from . import CommandContext, command
+import logging
 import random
 
+logger = logging.getLogger(__name__)
+
+# Messages fetched to seed a summary not yet built from the history cache.
+SEED_MESSAGES = 100
+
+# Fallback summaries used when no history is available.
+SUMMARIES = [
+    "Everyone argues but nobody actually reads the links",
+    "Strong opinions expressed with zero supporting evidence provided",
+    "Derailed into arguing about something completely different now",
+    "Same debate recycled for the hundredth time today",
+    "Everyone agrees violently while using different words exactly",
+    "Nobody knows what they're talking about here honestly",
+    "Confidently incorrect people explaining things to actual experts",
+    "Could have been resolved with simple Google search",
+    "People talking past each other without realizing it",
+    "Thread died when someone asked for actual sources",
+    "Argument over semantics instead of the actual issue",
+    "Everyone stopped reading after the first two messages",
+    "Passive aggressive subtweets disguised as helpful advice responses",
+    "Main point lost in increasingly pedantic side arguments",
+    "Confidently stating opinions as if they were facts",
+    "Circular argument that went nowhere but wasted time",
+    "People agreeing with different interpretations of same thing",
+    "Unnecessary drama over something that doesn't matter really",
+    "Strong feelings about topic nobody will remember tomorrow",
+    "Walls of text that nobody will actually read"
+]
+
+
 @command(
     name="tldr",
-    description="generate an uncomfortably-honest 8-word summary of the current thread",
-    pattern=r"^!tldr\s*(.*)$"
+    description="summarize the current thread (or room) from recent messages",
+    pattern=r"^!tldr\s*(.*)$",
+    category="chat"
 )
-async def tldr_handler(body: str) -> Optional[str]:
-    """Generate an uncomfortably-honest 8-word summary of the current thread.
-    
-    This command creates a brutally honest, satirical 8-word summary.
-    Note: This is a mock implementation as actual thread analysis would require
-    access to message history which isn't available in this handler signature.
+async def tldr_handler(body: str, ctx: Optional[CommandContext] = None) -> Optional[str]:
+    """Summarize the current thread, or the room when not used in a thread.
+
+    Summaries are extractive and maintained incrementally by the shared
+    summarizer as messages arrive, so answering costs no rescan of the
+    thread. With `tldr_mode = "model"` a Claude summary is produced instead,
+    cached until new messages land. Without any history available (e.g.
+    when called directly), falls back to an uncomfortably-honest 8-word
+    summary.
     """
-    
-    summaries = [
-        "Everyone argues but nobody actually reads the links",
-        "Strong opinions expressed with zero supporting evidence provided",
-        "Derailed into arguing about something completely different now",
-        "Same debate recycled for the hundredth time today",
-        "Everyone agrees violently while using different words exactly",
-        "Nobody knows what they're talking about here honestly",
-        "Confidently incorrect people explaining things to actual experts",
-        "Could have been resolved with simple Google search",
-        "People talking past each other without realizing it",
-        "Thread died when someone asked for actual sources",
-        "Argument over semantics instead of the actual issue",
-        "Everyone stopped reading after the first two messages",
-        "Passive aggressive subtweets disguised as helpful advice responses",
-        "Main point lost in increasingly pedantic side arguments",
-        "Confidently stating opinions as if they were facts",
-        "Circular argument that went nowhere but wasted time",
-        "People agreeing with different interpretations of same thing",
-        "Unnecessary drama over something that doesn't matter really",
-        "Strong feelings about topic nobody will remember tomorrow",
-        "Walls of text that nobody will actually read"
-    ]
-    
-    return random.choice(summaries)
\ No newline at end of file
+    services = ctx.services if ctx is not None else None
+    summarizer = getattr(services, "summarizer", None)
+    if summarizer is None or ctx.room_id is None:
+        return random.choice(SUMMARIES)
+
+    room_id, thread = ctx.room_id, ctx.thread_root
+    conversation = summarizer.get(room_id, thread)
+    if (conversation is None or not conversation.seeded) and services.history is not None:
+        # Only live messages so far (e.g. right after a restart): seed from
+        # the history cache, which backfills once if needed and also holds
+        # the live messages already observed.
+        messages = await services.history.fetch(room_id, SEED_MESSAGES,
+                                                client=ctx.client or services.client,
+                                                thread=thread)
+        conversation = summarizer.seed(room_id, thread, messages)
+    if conversation is None or not conversation.messages:
+        return random.choice(SUMMARIES)
+
+    config = services.config
+    if config is not None and config.tldr_mode == "model":
+        summary = await _model_summary(services, room_id, thread)
+        if summary:
+            return f"TL;DR: {summary}"
+
+    summary = conversation.summary()
+    if not summary:
+        return random.choice(SUMMARIES)
+    return f"TL;DR ({conversation.messages} messages): {summary}"
+
+
+async def _model_summary(services, room_id: str, thread: Optional[str]) -> Optional[str]:
+    """Claude summary of the conversation, reused until new messages arrive."""
+    summarizer = services.summarizer
+    cached = summarizer.cached_model_summary(room_id, thread)
+    if cached:
+        return cached
+
+    from ..claude_integration import summarize_conversation
+    messages = services.history.recent(room_id, SEED_MESSAGES, thread) \
+        if services.history is not None else []
+    if not messages:
+        return None
+    try:
+        api_key = services.config.anthropic_api_key
+    except RuntimeError:
+        logger.warning("tldr_mode is 'model' but no Anthropic API key is set")
+        return None
+    summary = await summarize_conversation(
+        api_key, [(m.sender, m.body) for m in messages if not m.body.startswith("!")])
+    if summary:
+        summarizer.store_model_summary(room_id, thread, summary)
+    return summary
\ No newline at end of file
@@ -1,105 +1,222 @@
+"""!vibecode: reply with the smallest runnable snippet for a description.
+
+Snippets and their weighted keywords live in ``data/vibecode.json``. At load
+time every keyword phrase goes into one word-level Aho-Corasick automaton,
+so a lookup is a single pass over the description whose cost does not grow
+with the number of snippets. Each matched phrase adds its weight to the
+snippets that list it; the highest total wins. Descriptions with no match
+get a second try with misspelt words snapped to the keyword vocabulary.
+"""
 from __future__ import annotations
-from typing import Optional
-from . import command
+import difflib
+import json
+import logging
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+from . import CommandContext, command
+
+logger = logging.getLogger(__name__)
+
+DATA_FILE = Path(__file__).parent / "data" / "vibecode.json"
+
+# A snippet must score at least this much to be offered.
+MIN_SCORE = 1.0
+# Similarity cutoff (0-1) for the fuzzy fallback; lower is more forgiving.
+FUZZY_CUTOFF = 0.8
+# Shorter words are left alone; "know" is too close to "now" to guess.
+FUZZY_MIN_LENGTH = 5
+MAX_TOP_K = 5
+
+USAGE = "Please provide a description of what you want the code to do. Usage: !vibecode <description>"
+
+_WORD = re.compile(r"[a-z0-9]+")
+_TOP_FLAG = re.compile(r"^--top\s+(\d+)\s*")
+
+Phrase = tuple[str, ...]
+
+
+def _normalize(text: str) -> list[str]:
+    """Lowercase, split into words and fold simple plurals ("files" -> "file")."""
+    words = []
+    for word in _WORD.findall(text.lower()):
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+class _Automaton:
+    """Aho-Corasick automaton over word sequences."""
+
+    def __init__(self, phrases: list[Phrase]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[Phrase]] = [[]]
+        for phrase in phrases:
+            state = 0
+            for word in phrase:
+                nxt = self._goto[state].get(word)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][word] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(phrase)
+
+        # Breadth-first: a state's failure link is the longest proper suffix
+        # that is also a trie path; its outputs include the suffix's.
+        queue = list(self._goto[0].values())
+        while queue:
+            state = queue.pop(0)
+            for word, nxt in self._goto[state].items():
+                queue.append(nxt)
+                if state:
+                    fail = self._fail[state]
+                    while fail and word not in self._goto[fail]:
+                        fail = self._fail[fail]
+                    self._fail[nxt] = self._goto[fail].get(word, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def matches(self, words: list[str]) -> Iterator[Phrase]:
+        state = 0
+        for word in words:
+            while state and word not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(word, 0)
+            yield from self._out[state]
+
+
+@dataclass
+class Snippet:
+    """One entry from the snippet data file."""
+    name: str
+    title: str
+    code: str
+    keywords: dict[Phrase, float]
+    requires: frozenset[Phrase]  # At least one must match; empty means none needed
+
+    def render(self) -> str:
+        return f"```python\n{self.code}\n```"
+
+
+class SnippetIndex:
+    """Keyword index over all snippets, built once."""
+
+    def __init__(self, snippets: list[Snippet]):
+        self.snippets = snippets
+        # phrase -> [(snippet position, weight)]
+        self._postings: defaultdict[Phrase, list[tuple[int, float]]] = defaultdict(list)
+        for position, snippet in enumerate(snippets):
+            for phrase, weight in snippet.keywords.items():
+                self._postings[phrase].append((position, weight))
+        self._automaton = _Automaton(list(self._postings))
+        self._vocabulary = sorted({w for phrase in self._postings for w in phrase})
+
+    @classmethod
+    def load(cls, path: Path = DATA_FILE) -> "SnippetIndex":
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+        snippets = [
+            Snippet(name=entry["name"], title=entry["title"], code=entry["code"],
+                    keywords={tuple(_normalize(k)): float(w)
+                              for k, w in entry["keywords"].items()},
+                    requires=frozenset(tuple(_normalize(k))
+                                       for k in entry.get("requires", ())))
+            for entry in entries
+        ]
+        logger.debug("Loaded %d vibecode snippets from %s", len(snippets), path)
+        return cls(snippets)
+
+    def search(self, description: str, k: int = 1,
+               fuzzy: bool = True) -> list[Snippet]:
+        """
+        Return up to `k` snippets ranked by keyword score.
+
+        Ties keep data-file order, so earlier entries win.
+        """
+        words = _normalize(description)
+        ranked = self._rank(words)
+        if not ranked and fuzzy:
+            corrected = self._correct(words)
+            if corrected != words:
+                ranked = self._rank(corrected)
+        return [self.snippets[position] for position in ranked[:k]]
+
+    def _rank(self, words: list[str]) -> list[int]:
+        matched = set(self._automaton.matches(words))
+        scores: defaultdict[int, float] = defaultdict(float)
+        for phrase in matched:
+            for position, weight in self._postings[phrase]:
+                scores[position] += weight
+        eligible = [
+            position for position, score in scores.items()
+            if score >= MIN_SCORE
+            and (not self.snippets[position].requires
+                 or self.snippets[position].requires & matched)
+        ]
+        return sorted(eligible, key=lambda p: (-scores[p], p))
+
+    def _correct(self, words: list[str]) -> list[str]:
+        corrected = []
+        for word in words:
+            if len(word) < FUZZY_MIN_LENGTH:
+                corrected.append(word)
+                continue
+            close = difflib.get_close_matches(word, self._vocabulary, n=1,
+                                              cutoff=FUZZY_CUTOFF)
+            corrected.append(close[0] if close else word)
+        return corrected
+
+
+INDEX = SnippetIndex.load()
+
 
 @command(
     name="vibecode",
     description="reply with the smallest runnable snippet that accomplishes the user's described behavior",
-    pattern=r"^!vibecode\s*(.*)$"
+    pattern=r"^!vibecode\s*(.*)$",
+    category="code",
+    offload=True
 )
-async def vibecode_handler(body: str) -> Optional[str]:
+async def vibecode_handler(body: str, ctx: Optional[CommandContext] = None) -> Optional[str]:
     """
     Generate the smallest runnable code snippet that accomplishes the user's described behavior.
-    
+
+    Prefix the description with "--top N" to get the N best matches.
+
     Args:
         body: The full message text containing the command and description
-        
+        ctx: Invocation context; when given, its pre-parsed arguments are used
+
     Returns:
         A minimal, runnable code snippet or an error message
     """
-    import re
-    
-    match = re.match(r"^!vibecode\s*(.*)$", body, re.DOTALL)
-    if not match:
-        return None
-    
-    description = match.group(1).strip()
-    
+    if ctx is not None:
+        description = ctx.args
+    else:
+        match = re.match(r"^!vibecode\s*(.*)$", body, re.DOTALL)
+        if not match:
+            return None
+        description = match.group(1).strip()
+
+    k = 1
+    flag = _TOP_FLAG.match(description)
+    if flag:
+        k = max(1, min(int(flag.group(1)), MAX_TOP_K))
+        description = description[flag.end():]
+
     if not description:
-        return "Please provide a description of what you want the code to do. Usage: !vibecode <description>"
-    
-    # Generate minimal code snippets based on common patterns
-    desc_lower = description.lower()
-    
-    # HTTP request
-    if any(word in desc_lower for word in ["http", "api", "request", "get", "post", "fetch", "curl"]):
-        if "post" in desc_lower:
-            return "```python\nimport requests\nresponse = requests.post('URL', json={'key': 'value'})\nprint(response.json())\n```"
-        return "```python\nimport requests\nresponse = requests.get('URL')\nprint(response.json())\n```"
-    
-    # File operations
-    if any(word in desc_lower for word in ["read file", "open file", "read from file"]):
-        return "```python\nwith open('file.txt', 'r') as f:\n    data = f.read()\nprint(data)\n```"
-    
-    if any(word in desc_lower for word in ["write file", "save to file", "write to file"]):
-        return "```python\nwith open('file.txt', 'w') as f:\n    f.write('content')\n```"
-    
-    # JSON operations
-    if "parse json" in desc_lower or "load json" in desc_lower:
-        return "```python\nimport json\ndata = json.loads('{\"key\": \"value\"}')\nprint(data['key'])\n```"
-    
-    if "json" in desc_lower and "file" in desc_lower:
-        return "```python\nimport json\nwith open('data.json') as f:\n    data = json.load(f)\nprint(data)\n```"
-    
-    # List operations
-    if "sort" in desc_lower and "list" in desc_lower:
-        return "```python\nitems = [3, 1, 2]\nitems.sort()\nprint(items)\n```"
-    
-    if "reverse" in desc_lower and "list" in desc_lower:
-        return "```python\nitems = [1, 2, 3]\nitems.reverse()\nprint(items)\n```"
-    
-    # String operations
-    if "split string" in desc_lower:
-        return "```python\ntext = 'hello world'\nwords = text.split()\nprint(words)\n```"
-    
-    if "join" in desc_lower and ("list" in desc_lower or "array" in desc_lower):
-        return "```python\nitems = ['a', 'b', 'c']\nresult = ','.join(items)\nprint(result)\n```"
-    
-    # Date/time
-    if any(word in desc_lower for word in ["current time", "now", "timestamp", "current date"]):
-        return "```python\nfrom datetime import datetime\nprint(datetime.now())\n```"
-    
-    # Web scraping
-    if any(word in desc_lower for word in ["scrape", "parse html", "beautifulsoup"]):
-        return "```python\nfrom bs4 import BeautifulSoup\nimport requests\nhtml = requests.get('URL').text\nsoup = BeautifulSoup(html, 'html.parser')\nprint(soup.find('tag'))\n```"
-    
-    # Database
-    if "sqlite" in desc_lower or ("database" in desc_lower and "query" in desc_lower):
-        return "```python\nimport sqlite3\ncon = sqlite3.connect('db.sqlite')\ncur = con.cursor()\nresult = cur.execute('SELECT * FROM table').fetchall()\nprint(result)\n```"
-    
-    # Random
-    if "random" in desc_lower:
-        if "choice" in desc_lower or "pick" in desc_lower:
-            return "```python\nimport random\nitems = [1, 2, 3]\nprint(random.choice(items))\n```"
-        return "```python\nimport random\nprint(random.randint(1, 100))\n```"
-    
-    # Sleep/wait
-    if "sleep" in desc_lower or "wait" in desc_lower:
-        return "```python\nimport time\ntime.sleep(1)  # seconds\n```"
-    
-    # Environment variable
-    if "environment variable" in desc_lower or "env var" in desc_lower:
-        return "```python\nimport os\nvalue = os.getenv('VAR_NAME', 'default')\nprint(value)\n```"
-    
-    # Command line arguments
-    if "command line" in desc_lower or "argv" in desc_lower or "arguments" in desc_lower:
-        return "```python\nimport sys\nargs = sys.argv[1:]  # exclude script name\nprint(args)\n```"
-    
-    # CSV
-    if "csv" in desc_lower:
-        if "write" in desc_lower:
-            return "```python\nimport csv\nwith open('data.csv', 'w', newline='') as f:\n    writer = csv.writer(f)\n    writer.writerow(['col1', 'col2'])\n```"
-        return "```python\nimport csv\nwith open('data.csv') as f:\n    reader = csv.reader(f)\n    for row in reader:\n        print(row)\n```"
-    
-    # Default response
-    return f"I'll create a minimal snippet for: {description}\n\n```python\n# {description}\npass  # Replace with your implementation\n```\n\nNote: Please be more specific about the task (e.g., 'read a file', 'make HTTP request', 'parse JSON') for a better snippet."
\ No newline at end of file
+        return USAGE
+
+    results = INDEX.search(description, k)
+    if not results:
+        return f"I'll create a minimal snippet for: {description}\n\n```python\n# {description}\npass  # Replace with your implementation\n```\n\nNote: Please be more specific about the task (e.g., 'read a file', 'make HTTP request', 'parse JSON') for a better snippet."
+    if k == 1:
+        return results[0].render()
+    return "\n\n".join(f"{i}. {snippet.title}\n{snippet.render()}"
+                       for i, snippet in enumerate(results, 1))
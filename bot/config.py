@@ -1,18 +1,48 @@
+"""Bot configuration: the BotConfig snapshot and the service that reloads it.
+
+`ConfigService` loads config.toml and .env once and hands out an immutable
+`BotConfig`. A background task polls both files' modification times; when
+they change (and then stay unchanged for the debounce period) the new file
+is parsed and validated, the snapshot is swapped in with a single assignment
+and subscribers are told about it. A file that fails to validate is logged
+and ignored, leaving the previous snapshot in place. Reading the config is
+an attribute access and never touches the disk.
+"""
 from __future__ import annotations
+import asyncio
+import logging
 import os
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, fields
+from typing import Callable, Optional
 from dotenv import load_dotenv
 
+from .accel import JSON_CODECS
+from .accounts import account_configs
+from .dispatcher import lane_configs
+from .policy import PolicyRule
+from .ratelimit import parse_rate
+
 try:
     import tomllib  # Python 3.11+
 except ModuleNotFoundError:  # pragma: no cover
     import tomli as tomllib  # type: ignore
 
+logger = logging.getLogger(__name__)
+
 CONFIG_FILE = "config.toml"
+ENV_FILE = ".env"
+
+# Settings that take effect without a restart; changes to anything else are
+# picked up by the snapshot but only applied at the next start.
+RELOADABLE = frozenset({
+    "log_level", "allowed_rooms", "room_policies", "enable_auto_commit",
+    "rate_limit_user", "rate_limit_room", "rate_limit_notice",
+    "stream_edit_interval", "tldr_mode", "config_poll_interval", "config_debounce",
+    "restart_mode", "shutdown_drain_timeout", "shutdown_flush_timeout",
+})
 
 
-@dataclass
+@dataclass(frozen=True)
 class BotConfig:
     homeserver: str
     user_id: str
@@ -21,11 +51,59 @@ class BotConfig:
     log_level: str = "INFO"
     allowed_rooms: list[str] = None  # List of allowed room IDs
     enable_auto_commit: bool = True  # Auto-commit code changes to git
+    log_format: str = "text"  # "text" or "json"
+    log_message_bodies: bool = False  # Include message text in logs
+    log_sampling: dict[str, float] = None  # Logger name -> fraction kept
+    sync_timeout_ms: int = 30000  # Long-poll timeout (upper bound)
+    sync_min_timeout_ms: int = 5000  # Floor when adapting after failures
+    sync_backoff_cap: float = 60.0  # Max seconds between sync retries
+    sync_stall_grace: float = 30.0  # Seconds past timeout before a sync is hung
+    sync_pool_size: int = 2  # Connections for the /sync long-poll
+    sync_keepalive: float = 75.0  # Idle seconds before a sync connection closes
+    api_pool_size: int = 10  # Connections for sends and other API calls
+    api_keepalive: float = 30.0  # Idle seconds before an API connection closes
+    state_dir: str = ".bot_state"  # Where runtime state files are kept
+    dedup_ttl: float = 3600.0  # Seconds an event ID is remembered
+    dedup_max_events: int = 100000  # Cap on remembered event IDs
+    dedup_persist: bool = True  # Spill seen event IDs to state_dir
+    use_uvloop: bool = True  # Use uvloop's event loop when installed
+    json_codec: str = "auto"  # "auto", "orjson", "ujson" or "stdlib"
+    history_depth: int = 200  # Messages kept per room and per thread
+    history_max_rooms: int = 500  # Rooms kept before evicting the coldest
+    history_max_bytes: int = 16 * 1024 * 1024  # Approximate memory budget
+    tldr_mode: str = "extractive"  # "extractive" or "model" (Claude)
+    render_cache_size: int = 512  # Rendered Markdown replies kept (LRU)
+    stream_edit_interval: float = 1.0  # Min seconds between streamed edits
+    dispatch_max_workers: int = 8  # Shared slots for standard and bulk commands
+    dispatch_lanes: dict[str, dict] = None  # Per-priority lane overrides
+    rate_limit_user: str = "20/min"  # Per sender, all commands ("" = off)
+    rate_limit_room: str = "60/min"  # Per room, all commands ("" = off)
+    rate_limit_notice: str = "1/min"  # "Slow down" replies per sender
+    rate_limit_max_keys: int = 50000  # Cap on tracked buckets
+    room_policies: list[dict] = None  # Per-room/server rules (see bot/policy.py)
+    config_poll_interval: float = 2.0  # Seconds between config file checks
+    config_debounce: float = 0.5  # Seconds a changed file must stay unchanged
+    restart_mode: str = "handoff"  # "handoff" (start successor first) or "exec"
+    shutdown_drain_timeout: float = 10.0  # Seconds running handlers get to finish
+    shutdown_flush_timeout: float = 5.0  # Further seconds for sends in progress
+    outbound_journal: bool = True  # Journal replies in state_dir until acknowledged
+    journal_max_entries: int = 10000  # Cap on journaled replies
+    journal_replay_max_age: float = 600.0  # Older unsent replies are dropped at start
+    storage_cache_size: int = 10000  # Command state entries kept in memory
+    storage_flush_interval: float = 1.0  # Seconds between write-behind flushes
+    accounts: list[dict] = None  # Extra bot accounts served by this process
+    send_max_concurrent: int = 16  # Sends in flight across all accounts
+    worker_processes: int = 0  # Processes for offloaded commands (0 = in-process)
+    worker_max_pending: int = 100  # Calls queued per worker before rejecting
+    worker_call_timeout: float = 60.0  # Seconds a running call may go silent
 
     def __post_init__(self):
         """Initialize default values for mutable fields."""
-        if self.allowed_rooms is None:
-            self.allowed_rooms = []
+        for name, default in (("allowed_rooms", list), ("log_sampling", dict),
+                              ("dispatch_lanes", dict), ("room_policies", list),
+                              ("accounts", list)):
+            if getattr(self, name) is None:
+                object.__setattr__(self, name, default())
 
     @property
     def access_token(self) -> str:
@@ -45,7 +123,12 @@ class BotConfig:
 
 
 def load_config(path: str = CONFIG_FILE) -> BotConfig:
+    """Read .env and parse and validate `path`. Prefer `get_config()`."""
     load_dotenv()
+    return _parse_config(path)
+
+
+def _parse_config(path: str) -> BotConfig:
     if not os.path.exists(path):
         raise FileNotFoundError(
             f"Config file '{path}' not found. Create it from config.example.toml")
@@ -61,4 +144,149 @@ def load_config(path: str = CONFIG_FILE) -> BotConfig:
     if "allowed_rooms" in bot and not isinstance(bot["allowed_rooms"], list):
         bot["allowed_rooms"] = [bot["allowed_rooms"]]
 
-    return BotConfig(**bot)
+    if bot.get("log_format", "text") not in ("text", "json"):
+        raise ValueError("bot.log_format must be 'text' or 'json'")
+    if bot.get("tldr_mode", "extractive") not in ("extractive", "model"):
+        raise ValueError("bot.tldr_mode must be 'extractive' or 'model'")
+    if bot.get("restart_mode", "handoff") not in ("handoff", "exec"):
+        raise ValueError("bot.restart_mode must be 'handoff' or 'exec'")
+    if bot.get("json_codec", "auto") not in JSON_CODECS:
+        raise ValueError(f"bot.json_codec must be one of {JSON_CODECS}")
+    lane_configs(bot.get("dispatch_lanes"))  # Raises on unknown lanes/settings
+    if bot.get("worker_processes", 0) < 0:
+        raise ValueError("bot.worker_processes must not be negative")
+    if bot.get("worker_call_timeout", 60.0) <= 0:
+        raise ValueError("bot.worker_call_timeout must be positive")
+    for key in ("rate_limit_user", "rate_limit_room", "rate_limit_notice"):
+        try:
+            parse_rate(bot.get(key))
+        except ValueError as e:
+            raise ValueError(f"bot.{key}: {e}") from None
+    for entry in bot.get("room_policies", []):
+        try:
+            PolicyRule.from_dict(entry)
+        except ValueError as e:
+            raise ValueError(f"bot.room_policies: {e}") from None
+
+    config = BotConfig(**bot)
+    try:
+        account_configs(config)
+    except ValueError as e:
+        raise ValueError(f"bot.accounts: {e}") from None
+    return config
+
+
+Subscriber = Callable[[BotConfig, BotConfig], None]
+
+
+class ConfigService:
+    """Holds the current BotConfig and reloads it when its files change."""
+
+    def __init__(self, path: str = CONFIG_FILE, env_path: str = ENV_FILE):
+        self.path = path
+        self.env_path = env_path
+        load_dotenv(env_path)
+        self._current = _parse_config(path)
+        self._signature = self._stat()
+        self._subscribers: list[Subscriber] = []
+
+    @property
+    def current(self) -> BotConfig:
+        """The current snapshot."""
+        return self._current
+
+    def subscribe(self, callback: Subscriber) -> None:
+        """Call `callback(old, new)` after each successful reload."""
+        self._subscribers.append(callback)
+
+    def reload(self) -> bool:
+        """
+        Re-read .env and the config file and swap in the new snapshot.
+
+        Values in .env override the environment on reload, so rotated
+        tokens and keys take effect.
+
+        Returns:
+            True if the config changed, False if it was unchanged or invalid
+        """
+        self._signature = self._stat()
+        try:
+            load_dotenv(self.env_path, override=True)
+            new = _parse_config(self.path)
+        except (OSError, ValueError, TypeError, tomllib.TOMLDecodeError) as e:
+            logger.error("Not reloading %s: %s", self.path, e)
+            return False
+        old = self._current
+        if new == old:
+            return False
+        self._current = new
+        changed = [f.name for f in fields(BotConfig)
+                   if getattr(old, f.name) != getattr(new, f.name)]
+        logger.info("Reloaded %s; changed: %s", self.path, ", ".join(changed))
+        needs_restart = [name for name in changed if name not in RELOADABLE]
+        if needs_restart:
+            logger.warning("Restart to apply: %s", ", ".join(needs_restart))
+        for callback in list(self._subscribers):
+            try:
+                callback(old, new)
+            except Exception:
+                logger.exception("Config subscriber %r failed", callback)
+        return True
+
+    async def watch(self, stop: asyncio.Event) -> None:
+        """Poll the config files until `stop` is set, reloading on change."""
+        while not await _wait(stop, self._current.config_poll_interval):
+            signature = self._stat()
+            if signature == self._signature:
+                continue
+            # Editors often write in several steps; wait for the files to settle.
+            while not await _wait(stop, self._current.config_debounce):
+                settled = self._stat()
+                if settled == signature:
+                    break
+                signature = settled
+            else:
+                return
+            self.reload()
+
+    def _stat(self) -> tuple:
+        signature = []
+        for path in (self.path, self.env_path):
+            try:
+                st = os.stat(path)
+            except OSError:
+                signature.append(None)
+            else:
+                signature.append((st.st_mtime_ns, st.st_size))
+        return tuple(signature)
+
+
+async def _wait(stop: asyncio.Event, seconds: float) -> bool:
+    """Sleep for `seconds`; return True early if `stop` is set."""
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+_service: Optional[ConfigService] = None
+
+
+def get_config_service() -> ConfigService:
+    """Return the process-wide ConfigService, loading config on first use."""
+    global _service
+    if _service is None:
+        _service = ConfigService()
+    return _service
+
+
+def set_config_service(service: Optional[ConfigService]) -> None:
+    """Install (or with None, forget) the process-wide ConfigService."""
+    global _service
+    _service = service
+
+
+def get_config() -> BotConfig:
+    """Return the current config snapshot without touching the disk."""
+    return get_config_service().current
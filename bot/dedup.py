@@ -0,0 +1,154 @@
+"""Seen-event index for exactly-once handling of Matrix events.
+
+A sync retry or a restart can deliver the same event twice. `SeenEvents`
+remembers recently handled event IDs in time buckets: IDs are hashed to
+64-bit integers (much smaller than the ID strings), whole buckets expire
+together, and the total is capped. With a spill file the index survives an
+`os.execv` restart or a crash.
+"""
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _key(event_id: str) -> int:
+    """Hash an event ID to a stable 64-bit key."""
+    digest = hashlib.blake2b(event_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class SeenEvents:
+    """Bounded, time-bucketed set of handled event IDs."""
+
+    def __init__(self, ttl: float = 3600.0, max_events: int = 100000,
+                 buckets: int = 6, path: Optional[str | Path] = None,
+                 clock=time.time):
+        self.ttl = ttl
+        self.max_events = max_events
+        self.bucket_width = ttl / buckets
+        self.path = Path(path) if path else None
+        self._clock = clock
+        # Oldest bucket first; each entry is (bucket start time, keys). Keys
+        # are held in a dict used as an insertion-ordered set so a single
+        # overfull bucket can shed its oldest entries.
+        self._buckets: deque[tuple[float, dict[int, None]]] = deque()
+        self._size = 0
+        self._spill = None
+        self._spill_lines = 0
+        if self.path:
+            self._load()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, event_id: str) -> bool:
+        self._expire()
+        key = _key(event_id)
+        return any(key in keys for _, keys in self._buckets)
+
+    def check_and_add(self, event_id: str) -> bool:
+        """Record an event ID. Returns True if it had not been seen before."""
+        now = self._clock()
+        self._expire(now)
+        key = _key(event_id)
+        for _, keys in self._buckets:
+            if key in keys:
+                return False
+        self._add(key, now)
+        if self.path:
+            self._append(key, now)
+        return True
+
+    def _add(self, key: int, ts: float) -> None:
+        start = ts - ts % self.bucket_width
+        if not self._buckets or self._buckets[-1][0] < start:
+            self._buckets.append((start, {}))
+        self._buckets[-1][1][key] = None
+        self._size += 1
+        while self._size > self.max_events and len(self._buckets) > 1:
+            _, dropped = self._buckets.popleft()
+            self._size -= len(dropped)
+        if self._size > self.max_events:
+            # A burst within one bucket window: drop its oldest keys.
+            keys = self._buckets[0][1]
+            while self._size > self.max_events:
+                del keys[next(iter(keys))]
+                self._size -= 1
+
+    def _expire(self, now: Optional[float] = None) -> None:
+        cutoff = (self._clock() if now is None else now) - self.ttl
+        while self._buckets and self._buckets[0][0] + self.bucket_width <= cutoff:
+            _, dropped = self._buckets.popleft()
+            self._size -= len(dropped)
+
+    # -- on-disk spill -----------------------------------------------------
+
+    def _append(self, key: int, ts: float) -> None:
+        try:
+            if self._spill is None:
+                self._spill = open(self.path, "a", encoding="ascii")
+            self._spill.write(f"{int(ts)} {key:016x}\n")
+            # Flushed to the kernel so an exec-restart or crash keeps it;
+            # no fsync, losing the tail on power failure is acceptable.
+            self._spill.flush()
+            self._spill_lines += 1
+            if self._spill_lines > 2 * self.max_events:
+                self.compact()
+        except OSError:
+            logger.warning("Could not write seen-event spill file %s",
+                           self.path, exc_info=True)
+
+    def _load(self) -> None:
+        """Restore unexpired entries from the spill file and compact it."""
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            return
+        cutoff = self._clock() - self.ttl
+        loaded = 0
+        try:
+            with open(self.path, encoding="ascii") as f:
+                for line in f:
+                    try:
+                        ts_str, key_str = line.split()
+                        ts = float(ts_str)
+                        key = int(key_str, 16)
+                    except ValueError:
+                        continue  # Torn write from a crash
+                    if ts >= cutoff:
+                        self._add(key, ts)
+                        loaded += 1
+        except OSError:
+            logger.warning("Could not read seen-event spill file %s",
+                           self.path, exc_info=True)
+            return
+        logger.info("Restored %d seen event IDs from %s", loaded, self.path)
+        self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the spill file with only the entries still held in memory."""
+        if not self.path:
+            return
+        self.close()
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            with open(tmp, "w", encoding="ascii") as f:
+                for start, keys in self._buckets:
+                    for key in keys:
+                        f.write(f"{int(start)} {key:016x}\n")
+            os.replace(tmp, self.path)
+            self._spill_lines = self._size
+        except OSError:
+            logger.warning("Could not compact seen-event spill file %s",
+                           self.path, exc_info=True)
+
+    def close(self) -> None:
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
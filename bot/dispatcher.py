@@ -0,0 +1,204 @@
+"""Priority lanes for command execution.
+
+Each command declares a priority class (`@command(priority=...)`):
+
+- ``interactive``: cheap, instant commands (``!ping``, ``!list``)
+- ``standard``: the default, including generated commands
+- ``bulk``: expensive work such as ``!add``
+
+Every class has its own queue and concurrency budget. Standard and bulk
+share a pool of `max_workers` slots, handed out by stride scheduling: each
+start advances the lane's pass value by ``1 / weight`` and the runnable lane
+with the lowest pass goes next, so under contention lanes get slots in
+proportion to their weights. Interactive is a preempting lane: while it has
+work waiting, queued work in other lanes is held back, and it may run
+beyond the shared pool (within its own budget), so a cheap command never
+waits for an expensive one to finish. Running work is never interrupted.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, fields, replace
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("interactive", "standard", "bulk")  # Highest first
+DEFAULT_PRIORITY = "standard"
+
+# Recent queue waits kept per lane for latency percentiles.
+WAIT_SAMPLES = 1000
+
+
+class DispatcherBusy(Exception):
+    """Raised when a lane's queue is full."""
+
+
+@dataclass(frozen=True)
+class LaneConfig:
+    """Scheduling parameters for one priority class."""
+    concurrency: int  # Jobs of this class that may run at once
+    weight: float  # Share of the shared pool under contention
+    max_queued: int  # Waiting jobs beyond which new ones are rejected
+    preempts: bool = False  # Runs ahead of, and outside the pool used by, other lanes
+
+
+DEFAULT_LANES = {
+    "interactive": LaneConfig(concurrency=8, weight=8, max_queued=100, preempts=True),
+    "standard": LaneConfig(concurrency=4, weight=3, max_queued=100),
+    "bulk": LaneConfig(concurrency=1, weight=1, max_queued=10),
+}
+
+
+def lane_configs(overrides: Optional[dict[str, dict[str, Any]]] = None) -> dict[str, LaneConfig]:
+    """
+    Merge per-lane overrides (e.g. from config.toml) into the defaults.
+
+    Raises:
+        ValueError: On an unknown lane or setting
+    """
+    lanes = dict(DEFAULT_LANES)
+    known = {f.name for f in fields(LaneConfig)}
+    for name, settings in (overrides or {}).items():
+        if name not in lanes:
+            raise ValueError(f"Unknown dispatch lane '{name}'; expected one of {PRIORITIES}")
+        unknown = set(settings) - known
+        if unknown:
+            raise ValueError(f"Unknown setting(s) for dispatch lane '{name}': {sorted(unknown)}")
+        lanes[name] = replace(lanes[name], **settings)
+    return lanes
+
+
+@dataclass
+class _Job:
+    factory: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    enqueued_at: float
+
+
+class _Lane:
+    __slots__ = ("name", "config", "queue", "running", "pass_value",
+                 "submitted", "completed", "rejected", "waits")
+
+    def __init__(self, name: str, config: LaneConfig):
+        self.name = name
+        self.config = config
+        self.queue: deque[_Job] = deque()
+        self.running = 0
+        self.pass_value = 0.0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.waits: deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    @property
+    def runnable(self) -> bool:
+        return bool(self.queue) and self.running < self.config.concurrency
+
+    def snapshot(self) -> dict[str, Any]:
+        waits = sorted(self.waits)
+        p99 = waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0
+        return {
+            "queued": len(self.queue),
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_p99_seconds": round(p99, 4),
+        }
+
+
+class Dispatcher:
+    """Runs jobs through per-priority queues with weighted fair sharing."""
+
+    def __init__(self, lanes: Optional[dict[str, LaneConfig]] = None,
+                 max_workers: int = 8, clock: Callable[[], float] = time.monotonic):
+        self.max_workers = max_workers
+        self._clock = clock
+        self._lanes = {name: _Lane(name, config)
+                       for name, config in (lanes or DEFAULT_LANES).items()}
+        self._pooled = 0  # Running jobs counted against max_workers
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, priority: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Queue `factory()` in the lane for `priority` and return its result.
+
+        Raises:
+            DispatcherBusy: If the lane's queue is full
+            ValueError: On an unknown priority
+        """
+        lane = self._lanes.get(priority)
+        if lane is None:
+            raise ValueError(f"Unknown priority '{priority}'")
+        if len(lane.queue) >= lane.config.max_queued:
+            lane.rejected += 1
+            raise DispatcherBusy(f"Too many queued {priority} jobs")
+        if not lane.queue and not lane.running:
+            # A lane waking from idle must not cash in credit for the time
+            # it had nothing to do.
+            lane.pass_value = max(lane.pass_value, self._min_active_pass())
+        job = _Job(factory, asyncio.get_running_loop().create_future(), self._clock())
+        lane.queue.append(job)
+        lane.submitted += 1
+        self._schedule()
+        return await job.future
+
+    def tasks(self) -> set[asyncio.Task]:
+        """The tasks running jobs right now."""
+        return set(self._tasks)
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        """Return per-lane counters and queue-wait p99."""
+        return {name: lane.snapshot() for name, lane in self._lanes.items()}
+
+    def _min_active_pass(self) -> float:
+        active = [l.pass_value for l in self._lanes.values() if l.queue or l.running]
+        return min(active, default=0.0)
+
+    def _pick(self) -> Optional[_Lane]:
+        runnable = [l for l in self._lanes.values() if l.runnable]
+        if any(l.queue and l.config.preempts for l in self._lanes.values()):
+            candidates = [l for l in runnable if l.config.preempts]
+        elif self._pooled < self.max_workers:
+            candidates = runnable
+        else:
+            return None
+        if not candidates:
+            return None
+        return min(candidates, key=lambda l: l.pass_value)
+
+    def _schedule(self) -> None:
+        while (lane := self._pick()) is not None:
+            job = lane.queue.popleft()
+            if job.future.done():  # Submitter gave up while queued
+                continue
+            lane.pass_value += 1 / lane.config.weight
+            lane.running += 1
+            if not lane.config.preempts:
+                self._pooled += 1
+            lane.waits.append(self._clock() - job.enqueued_at)
+            task = asyncio.create_task(self._run(lane, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, lane: _Lane, job: _Job) -> None:
+        try:
+            result = await job.factory()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as exc:
+            if not job.future.done():
+                job.future.set_exception(exc)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            lane.running -= 1
+            lane.completed += 1
+            if not lane.config.preempts:
+                self._pooled -= 1
+            self._schedule()
@@ -0,0 +1,254 @@
+"""Markdown to Matrix HTML rendering and size-aware message splitting.
+
+Handlers reply in a small Markdown dialect: fenced code blocks, inline code,
+``**bold**``, ``*italic*``, ``[links](https://...)``, ``#`` headings and
+``-`` bullet lists. `render_markdown` turns that into the HTML subset Matrix
+clients accept in ``formatted_body``. Fenced code gets a ``language-*``
+class and, when Pygments is installed, inline token colours.
+
+Rendering goes through a `RenderCache`, an LRU keyed by a hash of the text,
+so the same reply (a `!list` page, a common `!vibecode` snippet) is only
+rendered once.
+"""
+from __future__ import annotations
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from html import escape
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pygments import lex
+    from pygments.lexers import get_lexer_by_name
+    from pygments.styles import get_style_by_name
+    from pygments.util import ClassNotFound
+except ImportError:  # Optional; code blocks are sent uncoloured
+    lex = None
+
+HIGHLIGHT_STYLE = "default"
+
+_FENCE = re.compile(r"^\s*```\s*([\w+#.-]*)\s*$")
+_HEADING = re.compile(r"^(#{1,6})\s+(.*)$")
+_BULLET = re.compile(r"^\s*[-*]\s+(.*)$")
+_INLINE_CODE = re.compile(r"(`[^`\n]+`)")
+_BOLD = re.compile(r"\*\*(.+?)\*\*")
+_ITALIC = re.compile(r"(?<![*\w])\*(?!\s)([^*\n]+?)(?<!\s)\*(?![*\w])")
+_LINK = re.compile(r"\[([^\]\n]+)\]\((https?://[^)\s]+)\)")
+# Cheap test for "is there any Markdown at all"; plain replies skip rendering.
+_MARKDOWN_HINT = re.compile(
+    r"```|`[^`\n]+`|\*\*.+?\*\*|(?<![*\w])\*[^*\s]|\[[^\]\n]+\]\(https?://"
+    r"|^#{1,6}\s|^\s*[-*]\s", re.MULTILINE)
+
+
+def has_markdown(text: str) -> bool:
+    """Return True if `text` uses any Markdown this module renders."""
+    return _MARKDOWN_HINT.search(text) is not None
+
+
+def render_markdown(text: str) -> Optional[str]:
+    """
+    Render Markdown to Matrix HTML.
+
+    Returns:
+        The HTML, or None when the text contains no Markdown (plain
+        replies need no ``formatted_body``)
+    """
+    if not has_markdown(text):
+        return None
+    out: list[str] = []
+    paragraph: list[str] = []
+    bullets: list[str] = []
+    code: Optional[list[str]] = None
+    language = ""
+
+    def flush() -> None:
+        if paragraph:
+            out.append("<p>" + "<br>".join(_inline(line) for line in paragraph) + "</p>")
+            paragraph.clear()
+        if bullets:
+            out.append("<ul>" + "".join(f"<li>{_inline(item)}</li>" for item in bullets) + "</ul>")
+            bullets.clear()
+
+    for line in text.split("\n"):
+        fence = _FENCE.match(line)
+        if code is not None:
+            if fence and not fence.group(1):
+                out.append(_code_block("\n".join(code), language))
+                code = None
+            else:
+                code.append(line)
+            continue
+        if fence:
+            flush()
+            code, language = [], fence.group(1).lower()
+            continue
+        heading = _HEADING.match(line)
+        bullet = _BULLET.match(line)
+        if heading:
+            flush()
+            level = len(heading.group(1))
+            out.append(f"<h{level}>{_inline(heading.group(2))}</h{level}>")
+        elif bullet:
+            if paragraph:
+                flush()
+            bullets.append(bullet.group(1))
+        elif not line.strip():
+            flush()
+        else:
+            if bullets:
+                flush()
+            paragraph.append(line)
+    if code is not None:  # Unterminated fence: render what we have
+        out.append(_code_block("\n".join(code), language))
+    flush()
+    return "".join(out)
+
+
+def _inline(text: str) -> str:
+    parts = []
+    for i, part in enumerate(_INLINE_CODE.split(text)):
+        if i % 2:
+            parts.append(f"<code>{escape(part[1:-1])}</code>")
+            continue
+        part = escape(part, quote=False)
+        part = _LINK.sub(_link, part)
+        part = _BOLD.sub(r"<strong>\1</strong>", part)
+        part = _ITALIC.sub(r"<em>\1</em>", part)
+        parts.append(part)
+    return "".join(parts)
+
+
+def _link(match: re.Match) -> str:
+    # The text is already escaped except for quotes, which matter in href.
+    href = match.group(2).replace('"', "&quot;")
+    return f'<a href="{href}">{match.group(1)}</a>'
+
+
+def _code_block(code: str, language: str) -> str:
+    attr = f' class="language-{escape(language)}"' if language else ""
+    return f"<pre><code{attr}>{_highlight(code, language)}</code></pre>"
+
+
+def _highlight(code: str, language: str) -> str:
+    """Colour code with Pygments using Matrix's data-mx-color spans."""
+    if lex is None or not language:
+        return escape(code, quote=False)
+    try:
+        lexer = get_lexer_by_name(language)
+    except ClassNotFound:
+        return escape(code, quote=False)
+    style = get_style_by_name(HIGHLIGHT_STYLE)
+    out = []
+    for token_type, value in lex(code, lexer):
+        value = escape(value, quote=False)
+        color = style.style_for_token(token_type)["color"]
+        out.append(f'<span data-mx-color="#{color}">{value}</span>'
+                   if color and value.strip() else value)
+    # Lexers append a trailing newline the source didn't have.
+    html = "".join(out)
+    return html[:-1] if html.endswith("\n") and not code.endswith("\n") else html
+
+
+class RenderCache:
+    """LRU cache of rendered HTML keyed by a hash of the Markdown source."""
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, Optional[str]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def render(self, text: str) -> Optional[str]:
+        """Return `render_markdown(text)`, rendering only on a cache miss."""
+        key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        try:
+            html = self._entries[key]
+        except KeyError:
+            pass
+        else:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+        self.misses += 1
+        html = render_markdown(text)
+        if self.maxsize > 0:
+            self._entries[key] = html
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return html
+
+
+def split_message(text: str, limit: int) -> list[str]:
+    """
+    Split text into chunks of at most `limit` UTF-8 bytes.
+
+    Chunks break between lines, preferring a blank line once a chunk is
+    mostly full. A code block that spans chunks is closed at the end of
+    one and reopened (with its language) at the start of the next, so each
+    chunk renders on its own. Only lines longer than a whole chunk are cut,
+    at a space where possible.
+    """
+    if _size(text) <= limit:
+        return [text]
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    fence: Optional[str] = None  # Opening fence line while inside a block
+    closer = len("\n```".encode())
+
+    def flush() -> None:
+        nonlocal size
+        if current:
+            chunks.append("\n".join(current))
+        current.clear()
+        size = 0
+
+    # Leave room for reopening and closing a code block around a long line.
+    for line in _fit_lines(text, max(limit - 128, limit // 2)):
+        line_size = _size(line) + 1
+        marker = _FENCE.match(line)
+        if fence is None and not line.strip() and size >= limit * 0.75:
+            flush()  # Good place for a break: between paragraphs
+            continue
+        closing = fence is not None and marker is not None and not marker.group(1)
+        budget = limit - (closer if fence is not None and not closing else 0)
+        if current and size + line_size > budget:
+            if fence is not None:
+                current.append("```")
+            flush()
+            if fence is not None:
+                current.append(fence)
+                size = _size(fence) + 1
+        current.append(line)
+        size += line_size
+        if closing:
+            fence = None
+        elif fence is None and marker:
+            fence = line.strip()
+    flush()
+    return chunks
+
+
+def _fit_lines(text: str, max_bytes: int) -> list[str]:
+    """Split text into lines, cutting any line longer than `max_bytes`."""
+    lines = []
+    for line in text.split("\n"):
+        while _size(line) > max_bytes:
+            head = line.encode()[:max_bytes].decode(errors="ignore")
+            space = head.rfind(" ")
+            if space > len(head) // 2:
+                head = head[:space + 1]
+            lines.append(head.rstrip())
+            line = line[len(head):]
+        lines.append(line)
+    return lines
+
+
+def _size(text: str) -> int:
+    return len(text.encode())
@@ -1,10 +1,22 @@
 from __future__ import annotations
-from nio import RoomMessageText, AsyncClient, RoomSendResponse
+from nio import RoomMessageText, AsyncClient
 import asyncio
 import logging
+import math
 import time
-
-from .commands import execute_command
+from typing import AsyncIterator, Optional
+
+from .commands import Reply, ScheduleContext, execute_command, get_registry
+from .dedup import SeenEvents
+from .dispatcher import Dispatcher, DispatcherBusy
+from .policy import RoomPolicies
+from .ratelimit import RateLimiter
+from .scheduler import RetryLater, Run
+from .history import thread_root
+from .logging_setup import redact
+from .outbound import EDIT_INTERVAL, send_reply
+from .services import get_services
+from .workers import WorkerPool
 
 logger = logging.getLogger(__name__)
 
@@ -15,16 +27,67 @@ HISTORICAL_SKEW_MS = 5000  # allow 5s clock skew / startup delay
 # Store config for use in handlers
 _config = None
 
+# Compiled room policies; rebuilt (dropping cached decisions) by set_config
+_room_policies = RoomPolicies()
+
+# Commands currently running per room, for policy max_concurrent
+_room_running: dict[str, int] = {}
+
+# Event IDs already handled, so retried syncs and restarts don't double-reply
+_seen_events = SeenEvents()
+
+# Runs commands in priority lanes so cheap ones never queue behind bulk work
+_dispatcher = Dispatcher()
+
+BUSY_REPLY = "I'm busy with other requests right now; please try again in a moment."
+# Seconds before a one-shot scheduled job the dispatcher turned away fires again
+SCHEDULED_RETRY_DELAY = 5.0
+
+# Per-sender/room/command token buckets; unlimited until configured
+_rate_limiter = RateLimiter()
+
+# Worker processes for offloaded commands; None runs everything in-process
+_workers: Optional[WorkerPool] = None
+
 
 def set_config(config):
-    """Set the bot config for use in handlers."""
-    global _config
+    """Set the bot config for use in handlers and recompile room policies."""
+    global _config, _room_policies
+    _room_policies = RoomPolicies.from_config(config) if config else RoomPolicies()
     _config = config
 
 
-async def generate_reply(body: str) -> str | None:
-    """Generate reply using the dynamic command registry."""
-    return await execute_command(body)
+def set_seen_events(seen: SeenEvents):
+    """Replace the seen-event index (e.g. with a persistent one)."""
+    global _seen_events
+    _seen_events = seen
+
+
+def set_dispatcher(dispatcher: Dispatcher):
+    """Replace the command dispatcher (e.g. with configured lanes)."""
+    global _dispatcher
+    _dispatcher = dispatcher
+
+
+def set_rate_limiter(limiter: RateLimiter):
+    """Replace the command rate limiter (e.g. with configured rates)."""
+    global _rate_limiter
+    _rate_limiter = limiter
+
+
+def set_workers(workers: Optional[WorkerPool]):
+    """Run offloaded commands in `workers` (None runs them in-process)."""
+    global _workers
+    _workers = workers
+
+
+async def generate_reply(body: str, **context) -> str | Reply | AsyncIterator[str] | None:
+    """Generate reply using the dynamic command registry.
+
+    Pass ``found`` (from `CommandRegistry.find`) when the command is
+    already known, so it isn't matched again.
+    """
+    return await execute_command(body, **context)
 
 
 def is_old_event(event) -> bool:
@@ -33,43 +96,128 @@ def is_old_event(event) -> bool:
 
 
 async def on_message(client: AsyncClient, room, event: RoomMessageText):
+    # Never react to our own messages, from any of our accounts
+    accounts = get_services().accounts
+    if event.sender == client.user_id or (accounts is not None and event.sender in accounts):
+        return
+
+    # In a room several accounts share, only one of them answers
+    if accounts is not None and accounts.for_room(room.room_id).user_id != client.user_id:
+        return
+
     # Ignore events that are older than when the bot started (minus skew)
     if is_old_event(event):
         logger.debug("Ignoring old event %s from %s in %s",
                      event.event_id, event.sender, room.room_id)
         return
 
-    # Check if room is allowed (if config has allowed_rooms list)
-    if _config and _config.allowed_rooms and room.room_id not in _config.allowed_rooms:
+    policy = _room_policies.for_room(room.room_id)
+    if not policy.enabled:
         logger.debug("Ignoring message from non-allowed room: %s", room.room_id)
         return
 
-    try:
-        reply = await generate_reply(event.body)
+    found = get_registry().find(event.body)
+    if found is None:
+        return  # Not a command
 
-        if not reply:
-            return  # Nothing to send
+    # Handle each command at most once; plain chat never touches the index
+    if not _seen_events.check_and_add(event.event_id):
+        logger.debug("Ignoring duplicate event %s in %s",
+                     event.event_id, room.room_id)
+        return
+    cmd = found[0]
+    if not policy.allows(cmd.name):
+        logger.debug("Command %s disabled in %s", cmd.name, room.room_id)
+        return
+
+    decision = _rate_limiter.check(event.sender, room.room_id, cmd.name, cmd.rate,
+                                   room_rate=policy.rate)
+    if not decision.allowed:
+        logger.debug("Rate limited %s from %s in %s (retry in %.0fs)",
+                     cmd.name, event.sender, room.room_id, decision.retry_after)
+        if decision.notify:
+            await send_reply(client, room.room_id, event,
+                             f"Slow down! You can use !{cmd.name} again in "
+                             f"{math.ceil(decision.retry_after)}s.")
+        return
 
-        logger.info("Replying in %s to %s: %s",
-                    room.room_id, event.sender, reply)
-        resp: RoomSendResponse = await client.room_send(
+    async def respond():
+        run = _workers.execute if _workers is not None and cmd.offload else generate_reply
+        reply = await run(
+            event.body,
+            found=found,
             room_id=room.room_id,
-            message_type="m.room.message",
-            content={
-                "msgtype": "m.text",
-                "body": reply,
-                "m.relates_to": {
-                    "rel_type": "m.thread",
-                    "event_id": event.event_id,
-                    "is_falling_back": True,
-                    "m.in_reply_to": {"event_id": event.event_id}
-                },
-            },
+            sender=event.sender,
+            event_id=event.event_id,
+            thread_root=thread_root(event),
+            server_timestamp=event.server_timestamp,
+            services=get_services(),
+            client=client,
         )
-        # type: ignore[attr-defined]
-        if hasattr(resp, 'transport_response') and resp.transport_response.ok:
-            logger.debug("Message sent successfully")
+
+        if not reply:
+            return  # Nothing to send
+
+        if isinstance(reply, (str, Reply)):
+            logger.info("Replying in %s to %s: %s", room.room_id, event.sender,
+                        redact(reply.body if isinstance(reply, Reply) else reply))
         else:
-            logger.warning("Message send may have failed: %s", resp)
+            logger.info("Streaming reply in %s to %s", room.room_id, event.sender)
+        await send_reply(client, room.room_id, event, reply,
+                         edit_interval=_config.stream_edit_interval if _config else EDIT_INTERVAL)
+
+    running = _room_running.get(room.room_id, 0)
+    if policy.max_concurrent is not None and running >= policy.max_concurrent:
+        logger.warning("Room %s at its limit of %d running commands; rejecting %s",
+                       room.room_id, policy.max_concurrent, cmd.name)
+        await send_reply(client, room.room_id, event, BUSY_REPLY)
+        return
+
+    _room_running[room.room_id] = running + 1
+    try:
+        await _dispatcher.submit(cmd.priority, respond)
+    except DispatcherBusy:
+        logger.warning("Dispatcher busy; rejecting %s from %s in %s",
+                       cmd.name, event.sender, room.room_id)
+        await send_reply(client, room.room_id, event, BUSY_REPLY)
     except Exception:  # pragma: no cover - log unexpected
         logger.exception("Failed handling message event")
+    finally:
+        remaining = _room_running[room.room_id] - 1
+        if remaining:
+            _room_running[room.room_id] = remaining
+        else:
+            del _room_running[room.room_id]
+
+
+async def on_scheduled(client: AsyncClient, run: Run):
+    """Run a due scheduler job through the dispatcher and post its reply."""
+    job = run.job
+    task = get_registry().get_scheduled(job.task)
+    if task is None:
+        logger.warning("Job %s refers to unknown scheduled task %s; skipping",
+                       job.job_id, job.task)
+        return
+    policy = _room_policies.for_room(job.room_id)
+    if not policy.enabled or not policy.allows(task.name):
+        logger.debug("Scheduled task %s disabled in %s", task.name, job.room_id)
+        return
+
+    async def respond():
+        ctx = ScheduleContext(task=task.name, job_id=job.job_id, room_id=job.room_id,
+                              scheduled_for=run.scheduled_for, missed=run.missed,
+                              payload=job.payload, services=get_services(),
+                              client=client)
+        reply = await get_registry().run_scheduled(task, ctx)
+        if not reply:
+            return
+        logger.info("Posting scheduled %s in %s", task.name, job.room_id)
+        await send_reply(client, job.room_id, None, reply,
+                         edit_interval=_config.stream_edit_interval if _config else EDIT_INTERVAL)
+
+    try:
+        await _dispatcher.submit(task.priority, respond)
+    except DispatcherBusy:
+        logger.warning("Dispatcher busy; could not start scheduled %s in %s",
+                       task.name, job.room_id)
+        raise RetryLater(SCHEDULED_RETRY_DELAY)
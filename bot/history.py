@@ -0,0 +1,275 @@
+"""Bounded in-memory message history per room and per thread.
+
+Filled from the sync stream the bot already receives, so commands can read
+recent context without a homeserver round-trip. Each room keeps a ring buffer
+of its latest messages plus ring buffers for its most recently active
+threads. Rooms are evicted least-recently-used once the room count or the
+approximate memory budget is exceeded; a threaded message is charged to the
+budget once for each buffer holding it, so the budget is an upper bound. On
+a miss, history is lazily backfilled through paginated ``/messages``
+requests, once per room unless the backfill fails.
+"""
+from __future__ import annotations
+import itertools
+import logging
+import sys
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from nio import MessageDirection, RoomMessagesError, RoomMessageText
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message overhead (object, strings' headers, deque slot) used for
+# the memory budget on top of the text lengths.
+MESSAGE_OVERHEAD_BYTES = 400
+
+# Events requested per /messages page during backfill.
+BACKFILL_PAGE_SIZE = 100
+
+# Latest messages per room checked for an event already recorded, as happens
+# when several bot accounts share a room (see bot.accounts).
+DUPLICATE_WINDOW = 32
+
+
+def thread_root(event) -> Optional[str]:
+    """Return the thread root event ID if the event was sent in a thread."""
+    relates_to = event.source.get("content", {}).get("m.relates_to") or {}
+    if relates_to.get("rel_type") == "m.thread":
+        return relates_to.get("event_id")
+    return None
+
+
+@dataclass(slots=True)
+class HistoryMessage:
+    """A text message as kept in the history cache."""
+    event_id: str
+    sender: str
+    body: str
+    server_timestamp: int
+    thread_root: Optional[str] = None
+
+    @classmethod
+    def from_event(cls, event: RoomMessageText) -> "HistoryMessage":
+        return cls(event_id=event.event_id,
+                   sender=sys.intern(event.sender),
+                   body=event.body,
+                   server_timestamp=event.server_timestamp,
+                   thread_root=thread_root(event))
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + MESSAGE_OVERHEAD_BYTES
+
+
+class _RoomHistory:
+    __slots__ = ("messages", "threads", "bytes", "backfilled")
+
+    def __init__(self, depth: int):
+        self.messages: deque[HistoryMessage] = deque(maxlen=depth)
+        self.threads: OrderedDict[str, deque[HistoryMessage]] = OrderedDict()
+        self.bytes = 0
+        self.backfilled = False
+
+
+class MessageHistory:
+    """Per-room and per-thread ring buffers with LRU eviction of cold rooms."""
+
+    def __init__(self, depth: int = 200, thread_depth: int = 200,
+                 max_threads_per_room: int = 50, max_rooms: int = 500,
+                 max_bytes: int = 16 * 1024 * 1024):
+        self.depth = depth
+        self.thread_depth = thread_depth
+        self.max_threads_per_room = max_threads_per_room
+        self.max_rooms = max_rooms
+        self.max_bytes = max_bytes
+        self._rooms: OrderedDict[str, _RoomHistory] = OrderedDict()
+        self._bytes = 0
+        self._listeners: list[Callable[[str, HistoryMessage], None]] = []
+
+    def __len__(self) -> int:
+        return sum(len(room.messages) for room in self._rooms.values())
+
+    @property
+    def approx_bytes(self) -> int:
+        return self._bytes
+
+    def subscribe(self, listener: Callable[[str, HistoryMessage], None]) -> None:
+        """Call `listener(room_id, message)` for every message recorded live."""
+        self._listeners.append(listener)
+
+    def record(self, room_id: str, event: RoomMessageText) -> Optional[HistoryMessage]:
+        """Record a message event received from sync; None if already recorded."""
+        room = self._rooms.get(room_id)
+        if room is not None and any(
+                m.event_id == event.event_id
+                for m in itertools.islice(reversed(room.messages), DUPLICATE_WINDOW)):
+            return None
+        message = HistoryMessage.from_event(event)
+        self.add(room_id, message)
+        for listener in self._listeners:
+            try:
+                listener(room_id, message)
+            except Exception:
+                logger.exception("History listener failed")
+        return message
+
+    def add(self, room_id: str, message: HistoryMessage) -> None:
+        """Append a message to its room (and thread) buffers."""
+        room = self._room(room_id)
+        self._append(room, message)
+        if message.thread_root:
+            thread = room.threads.get(message.thread_root)
+            if thread is None:
+                thread = room.threads[message.thread_root] = deque(maxlen=self.thread_depth)
+                while len(room.threads) > self.max_threads_per_room:
+                    _, evicted = room.threads.popitem(last=False)
+                    self._charge(room, -sum(m.size for m in evicted))
+            else:
+                room.threads.move_to_end(message.thread_root)
+            if len(thread) == thread.maxlen:
+                self._charge(room, -thread[0].size)
+            thread.append(message)
+            self._charge(room, message.size)
+        self._evict()
+
+    def recent(self, room_id: str, limit: Optional[int] = None,
+               thread: Optional[str] = None) -> list[HistoryMessage]:
+        """
+        Return cached messages, oldest first, without any network access.
+
+        Args:
+            room_id: Room to read
+            limit: Maximum number of (most recent) messages to return
+            thread: Thread root event ID to restrict to that thread
+
+        Returns:
+            list of HistoryMessage; empty if nothing is cached
+        """
+        room = self._rooms.get(room_id)
+        if room is None:
+            return []
+        self._rooms.move_to_end(room_id)
+        if thread is None:
+            messages = list(room.messages)
+        else:
+            replies = room.threads.get(thread, ())
+            root = [m for m in room.messages if m.event_id == thread][:1]
+            messages = root + list(replies)
+        return messages[-limit:] if limit else messages
+
+    async def fetch(self, room_id: str, limit: int, client=None,
+                    thread: Optional[str] = None) -> list[HistoryMessage]:
+        """
+        Return up to `limit` recent messages, backfilling on a cache miss.
+
+        Backfill needs `client` (an nio AsyncClient); without it this is
+        equivalent to `recent`. It runs once per room, or again on a later
+        call if it failed.
+        """
+        messages = self.recent(room_id, limit, thread)
+        if len(messages) >= limit or client is None:
+            return messages
+        room = self._room(room_id)
+        if room.backfilled:
+            return messages
+        room.backfilled = True  # Concurrent fetches don't backfill again
+        complete = False
+        try:
+            complete = await self._backfill(client, room_id, room, max(limit, self.depth))
+        finally:
+            if not complete:
+                room.backfilled = False  # Retry on the next miss
+        return self.recent(room_id, limit, thread)
+
+    async def _backfill(self, client, room_id: str, room: _RoomHistory,
+                        wanted: int) -> bool:
+        """Prepend older messages to `room`; False if a page request failed."""
+        older: list[HistoryMessage] = []
+        token = None
+        complete = True
+        while len(older) < wanted:
+            resp = await client.room_messages(
+                room_id, start=token, direction=MessageDirection.back,
+                limit=min(BACKFILL_PAGE_SIZE, wanted - len(older)))
+            if isinstance(resp, RoomMessagesError):
+                logger.warning("History backfill failed for %s: %s", room_id, resp)
+                complete = False
+                break
+            for event in resp.chunk:  # Newest first
+                if isinstance(event, RoomMessageText):
+                    older.append(HistoryMessage.from_event(event))
+            if not resp.chunk or not resp.end or resp.end == token:
+                break
+            token = resp.end
+
+        if self._rooms.get(room_id) is not room:
+            return complete  # Evicted while paginating
+
+        # Paginated messages not already held predate the live ones, so
+        # rebuild the buffer oldest-first: backfilled, then live.
+        live = list(room.messages)
+        held = {m.event_id for m in live}  # Including arrivals during backfill
+        older = [m for m in older if m.event_id not in held]
+        room.messages.clear()
+        self._charge(room, -room.bytes)
+        for message in reversed(older):
+            self._append(room, message)
+        for message in live:
+            self._append(room, message)
+        self._rebuild_threads(room)
+        logger.debug("Backfilled %d messages in %s", len(older), room_id)
+        self._evict()
+        return complete
+
+    def _rebuild_threads(self, room: _RoomHistory) -> None:
+        threads: OrderedDict[str, deque[HistoryMessage]] = OrderedDict()
+        for message in room.messages:
+            if message.thread_root:
+                thread = threads.get(message.thread_root)
+                if thread is None:
+                    thread = threads[message.thread_root] = deque(maxlen=self.thread_depth)
+                else:
+                    threads.move_to_end(message.thread_root)
+                thread.append(message)
+        # Keep live-only thread entries that scrolled out of the room buffer.
+        for root, messages in room.threads.items():
+            if root not in threads:
+                threads[root] = messages
+                threads.move_to_end(root, last=False)
+        while len(threads) > self.max_threads_per_room:
+            threads.popitem(last=False)
+        room.threads = threads
+        self._charge(room, sum(m.size for thread in threads.values() for m in thread))
+
+    def _room(self, room_id: str) -> _RoomHistory:
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = _RoomHistory(self.depth)
+        else:
+            self._rooms.move_to_end(room_id)
+        return room
+
+    def _append(self, room: _RoomHistory, message: HistoryMessage) -> None:
+        if len(room.messages) == room.messages.maxlen:
+            self._charge(room, -room.messages[0].size)
+        room.messages.append(message)
+        self._charge(room, message.size)
+
+    def _charge(self, room: _RoomHistory, size: int) -> None:
+        room.bytes += size
+        self._bytes += size
+
+    def _evict(self) -> None:
+        while len(self._rooms) > 1 and (len(self._rooms) > self.max_rooms
+                                        or self._bytes > self.max_bytes):
+            room_id, room = self._rooms.popitem(last=False)
+            self._bytes -= room.bytes
+            logger.debug("Evicted history for cold room %s", room_id)
+        if self._bytes > self.max_bytes and self._rooms:
+            # One room is over budget by itself; shed its coldest threads.
+            room = next(reversed(self._rooms.values()))
+            while self._bytes > self.max_bytes and room.threads:
+                _, evicted = room.threads.popitem(last=False)
+                self._charge(room, -sum(m.size for m in evicted))
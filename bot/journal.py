@@ -0,0 +1,149 @@
+"""Write-ahead journal for outbound messages.
+
+Every reply is recorded with the transaction ID it will be sent under
+before the send starts, and marked done once the homeserver acknowledges
+it. Replies still pending when the process dies (crash, ``os.execv``
+restart, cut off at shutdown) are replayed at the next start with the same
+transaction ID, so a send the server did receive is deduplicated rather
+than posted twice.
+
+The journal is a SQLite database in WAL mode with ``synchronous=NORMAL``:
+a commit is an append to the write-ahead log with no fsync, which survives
+a process crash; fsyncs happen in batches at checkpoints. That keeps the
+cost on the reply path to two small writes. Done entries are deleted by a
+periodic compaction that also caps the table at `max_entries` rows.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import secrets
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background compactions.
+COMPACT_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    txn_id TEXT PRIMARY KEY,
+    room_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL,
+    done REAL,
+    account TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_by_state ON outbox (done, created);
+"""
+
+
+def new_txn_id() -> str:
+    """A transaction ID unique across restarts."""
+    return f"bot{int(time.time() * 1000)}.{secrets.token_hex(6)}"
+
+
+class OutboundJournal:
+    """Durable record of replies between "about to send" and "acknowledged"."""
+
+    def __init__(self, path: str | Path, max_entries: int = 10000,
+                 clock: Callable[[], float] = time.time):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._clock = clock
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(outbox)")}
+        if "account" not in columns:  # Journals from before multi-account
+            self._db.execute("ALTER TABLE outbox ADD COLUMN account TEXT")
+        self._rows = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def record(self, room_id: str, content: dict[str, Any],
+               account: Optional[str] = None) -> str:
+        """
+        Journal a reply about to be sent and return its transaction ID.
+
+        Args:
+            account: User ID of the account sending it, so a replay goes
+                     out from the same account under the same transaction ID
+        """
+        txn_id = new_txn_id()
+        self._db.execute(
+            "INSERT INTO outbox (txn_id, room_id, content, created, account) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (txn_id, room_id, json.dumps(content, ensure_ascii=False), self._clock(), account))
+        self._rows += 1
+        if self._rows > self.max_entries:
+            self.compact()
+        return txn_id
+
+    def done(self, txn_id: str) -> None:
+        """Mark a reply acknowledged (or permanently rejected)."""
+        self._db.execute("UPDATE outbox SET done = ? WHERE txn_id = ?",
+                         (self._clock(), txn_id))
+
+    def pending(self, max_age: Optional[float] = None) -> list[dict[str, Any]]:
+        """
+        Return unacknowledged replies, oldest first.
+
+        Args:
+            max_age: Skip (and mark done) replies older than this many seconds;
+                     a very late answer is worse than none
+        """
+        if max_age is not None:
+            stale = self._db.execute(
+                "UPDATE outbox SET done = ? WHERE done IS NULL AND created < ?",
+                (self._clock(), self._clock() - max_age)).rowcount
+            if stale:
+                logger.warning("Dropping %d journaled replies older than %.0fs",
+                               stale, max_age)
+        rows = self._db.execute(
+            "SELECT txn_id, room_id, content, account FROM outbox "
+            "WHERE done IS NULL ORDER BY created").fetchall()
+        return [{"txn_id": txn_id, "room_id": room_id, "content": json.loads(content),
+                 "account": account}
+                for txn_id, room_id, content, account in rows]
+
+    def compact(self) -> int:
+        """
+        Delete done entries and, past `max_entries`, the oldest pending ones.
+
+        Returns:
+            Number of rows deleted
+        """
+        deleted = self._db.execute("DELETE FROM outbox WHERE done IS NOT NULL").rowcount
+        excess = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0] - self.max_entries
+        if excess > 0:
+            logger.warning("Outbound journal full; dropping %d oldest pending replies", excess)
+            deleted += self._db.execute(
+                "DELETE FROM outbox WHERE txn_id IN "
+                "(SELECT txn_id FROM outbox ORDER BY created LIMIT ?)", (excess,)).rowcount
+        self._rows = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        self._db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return deleted
+
+    async def maintain(self, stop: asyncio.Event, interval: float = COMPACT_INTERVAL) -> None:
+        """Compact every `interval` seconds until `stop` is set."""
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                self.compact()
+            except sqlite3.Error:
+                logger.warning("Could not compact outbound journal %s",
+                               self.path, exc_info=True)
+
+    def close(self) -> None:
+        """Compact and close; pending entries stay for the next start."""
+        try:
+            self.compact()
+        finally:
+            self._db.close()
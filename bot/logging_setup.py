@@ -0,0 +1,227 @@
+"""Logging pipeline: queue-backed handler, JSON output, sampling and redaction.
+
+Records are handed to a bounded in-memory queue on the event loop and written
+out by a background thread (``logging.handlers.QueueListener``), so a slow
+stderr or log file never stalls message handling. When a record's arguments
+are immutable (strings, numbers, `Redacted` bodies) formatting ``msg % args``
+is left to the writer thread, keeping the hot path to a filter check and a
+``put_nowait``; anything else is formatted straight away so the log shows the
+arguments as they were when the call was made.
+"""
+from __future__ import annotations
+import json
+import logging
+import logging.handlers
+import math
+import queue
+import sys
+from typing import Optional
+
+# Upper bound on buffered records; when the writer falls behind we drop
+# records rather than block the event loop.
+QUEUE_SIZE = 10000
+
+TEXT_FORMAT = "[%(levelname)s] %(name)s: %(message)s"
+
+# Argument types that can't change between the logging call and the writer
+# thread formatting the record.
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+# Whether message bodies may appear in logs (see `redact`).
+_log_bodies = False
+_listener: Optional[_QueueListener] = None
+
+
+class Redacted:
+    """Lazy wrapper for user/bot message text in log arguments.
+
+    Rendered only when the record is formatted (on the writer thread), and
+    only as a length placeholder unless body logging is enabled.
+    """
+    __slots__ = ("text",)
+
+    def __init__(self, text: Optional[str]):
+        self.text = text
+
+    def __str__(self) -> str:
+        if self.text is None:
+            return "<none>"
+        if _log_bodies:
+            return self.text
+        return f"<redacted {len(self.text)} chars>"
+
+    __repr__ = __str__
+
+
+def redact(text: Optional[str]) -> Redacted:
+    """Wrap message text so it is redacted in logs unless explicitly enabled."""
+    return Redacted(text)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of DEBUG/INFO records for selected loggers.
+
+    ``rates`` maps a logger name (or dotted prefix) to the fraction of records
+    to keep, e.g. ``{"bot.handlers": 0.1}`` keeps every tenth record and
+    ``0.4`` keeps two in five. Sampling is counter based rather than random
+    so output is deterministic: record ``n`` is kept when ``n * rate`` crosses
+    a whole number. WARNING and above are never sampled.
+    """
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self._rates = {name: max(0.0, min(1.0, float(rate)))
+                       for name, rate in rates.items()}
+        self._counters: dict[str, int] = {}
+        self._resolved: dict[str, Optional[str]] = {}
+
+    def _rule_for(self, name: str) -> Optional[str]:
+        try:
+            return self._resolved[name]
+        except KeyError:
+            pass
+        rule = None
+        for prefix in self._rates:
+            if name == prefix or name.startswith(prefix + "."):
+                if rule is None or len(prefix) > len(rule):
+                    rule = prefix
+        self._resolved[name] = rule
+        return rule
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rule = self._rule_for(record.name)
+        if rule is None:
+            return True
+        rate = self._rates[rule]
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        count = self._counters.get(rule, 0)
+        self._counters[rule] = count + 1
+        # The epsilon keeps float error (0.29 * 100 == 28.999999999999996)
+        # from shifting which record is kept.
+        return (math.floor((count + 1) * rate + 1e-9)
+                > math.floor(count * rate + 1e-9))
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers safe formatting and drops records when full."""
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener lives in the same process, so the record can be passed
+        # through untouched and formatted on the writer thread, unless an
+        # argument could be mutated before then.
+        args = record.args
+        if isinstance(args, dict):
+            args = args.values()
+        if args and not all(isinstance(arg, (Redacted, *_IMMUTABLE_ARGS))
+                            for arg in args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """QueueListener whose `stop` may be called more than once."""
+
+    def start(self) -> None:
+        super().start()
+        self.running = True
+
+    def stop(self) -> None:
+        if getattr(self, "running", False):
+            self.running = False
+            super().stop()
+
+
+def setup_logging(level: str | int = "INFO", fmt: str = "text",
+                  log_bodies: bool = False,
+                  sampling: Optional[dict[str, float]] = None,
+                  stream=None) -> logging.handlers.QueueListener:
+    """Install the queue-backed logging pipeline on the root logger.
+
+    Safe to call more than once; a previous pipeline is flushed and replaced.
+
+    Args:
+        level: Root log level name or number
+        fmt: "text" for human-readable lines, "json" for structured output
+        log_bodies: Include message bodies wrapped with `redact` in output
+        sampling: Optional per-logger keep fractions for DEBUG/INFO records
+        stream: Output stream for the writer (defaults to stderr)
+
+    Returns:
+        The running QueueListener
+    """
+    global _listener, _log_bodies
+    shutdown_logging()
+    _log_bodies = log_bodies
+
+    sink = logging.StreamHandler(stream or sys.stderr)
+    if fmt == "json":
+        sink.setFormatter(JsonFormatter())
+    else:
+        sink.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    handler = _NonBlockingQueueHandler(queue.Queue(maxsize=QUEUE_SIZE))
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    set_level(level)
+
+    _listener = _QueueListener(handler.queue, sink)
+    _listener.start()
+    return _listener
+
+
+def set_level(level: str | int) -> None:
+    """Change the root log level."""
+    if isinstance(level, str):
+        level = level.upper()
+    logging.getLogger().setLevel(level)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the background writer."""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, _NonBlockingQueueHandler) and handler.dropped:
+            sys.stderr.write(
+                f"[WARNING] logging: dropped {handler.dropped} records "
+                "while the log sink was slow\n")
+            handler.dropped = 0
+
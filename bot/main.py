@@ -2,20 +2,42 @@ from __future__ import annotations
 import asyncio
 import logging
 import signal
-from nio import AsyncClient, AsyncClientConfig, RoomMessageText
+from pathlib import Path
+from typing import Optional
+from nio import RoomMessageText
 
-from .config import load_config
-from .handlers import on_message, set_config
+from .accel import get_json_codec, get_loop_factory, log_accelerations
+from .accounts import Account, AccountPool, FairSendGate, account_configs
+from .client import MatrixClients, create_clients
+from .commands import get_registry
+from .config import BotConfig, ConfigService, set_config_service
+from .dedup import SeenEvents
+from .dispatcher import Dispatcher, lane_configs
+from .formatting import RenderCache
+from .handlers import (on_message, on_scheduled, set_config, set_dispatcher,
+                       set_rate_limiter, set_seen_events, set_workers)
+from .history import MessageHistory
+from .summarizer import Summarizer
+from .logging_setup import set_level, setup_logging, shutdown_logging
+from .journal import OutboundJournal
+from .outbound import room_send, set_journal, set_render_cache, set_send_gate
+from .ratelimit import RateLimiter
+from .scheduler import Scheduler
+from .reload import (HandoffChannel, Successor, restart_bot, take_over,
+                     wait_for_restart_request)
+from .services import set_services
+from .shutdown import ShutdownCoordinator
+from .storage import Store
+from .sync import SyncSupervisor
+from .workers import WorkerPool
 
-logging.basicConfig(level=logging.INFO,
-                    format="[%(levelname)s] %(name)s: %(message)s")
 logger = logging.getLogger("matrix-bot")
 
 STOP = asyncio.Event()
 
 
 def _install_signal_handlers():
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
     for sig in (signal.SIGINT, signal.SIGTERM):
         try:
             loop.add_signal_handler(sig, lambda s=sig: STOP.set())
@@ -23,8 +45,8 @@ def _install_signal_handlers():
             signal.signal(sig, lambda *_: STOP.set())
 
 
-async def login_if_needed(client: AsyncClient, user_id: str, token: str | None):
-    """Attach access token to client and ensure user_id is set.
+async def login_if_needed(clients: MatrixClients, user_id: str, token: str | None):
+    """Attach access token to the sync and API clients and set user_id.
 
     We rely on a pre-issued access token (no password login here). The nio
     AsyncClient does not populate a user field inside its config object; the
@@ -36,51 +58,255 @@ async def login_if_needed(client: AsyncClient, user_id: str, token: str | None):
     if not token:
         raise RuntimeError(
             "Access token must be provided via env var MATRIX_ACCESS_TOKEN")
-    client.access_token = token
     # nio sets `client.user_id` when logging in, but since we're injecting an
     # existing token we must set it manually so event handlers can compare.
-    client.user_id = user_id  # type: ignore[attr-defined]
-    logger.info("Using provided access token for %s", client.user_id)
+    clients.login(user_id, token)
+    logger.info("Using provided access token for %s", user_id)
 
 
-async def run():
-    cfg = load_config()
+async def run(config_service: ConfigService, loop_name: str = "asyncio"):
+    _install_signal_handlers()
+    cfg = config_service.current
+    setup_logging(level=cfg.log_level, fmt=cfg.log_format,
+                  log_bodies=cfg.log_message_bodies,
+                  sampling=cfg.log_sampling)
+    json_codec = get_json_codec(cfg.json_codec)
+    log_accelerations(loop_name, json_codec)
     set_config(cfg)  # Make config available to handlers
-    client_cfg = AsyncClientConfig(store_sync_tokens=True)
-    client = AsyncClient(cfg.homeserver, cfg.user_id,
-                         device_id=cfg.device_id, config=client_cfg)
+    set_render_cache(RenderCache(cfg.render_cache_size))
+    dispatcher = Dispatcher(lane_configs(cfg.dispatch_lanes),
+                            max_workers=cfg.dispatch_max_workers)
+    set_dispatcher(dispatcher)
+    rate_limiter = RateLimiter(user_rate=cfg.rate_limit_user,
+                               room_rate=cfg.rate_limit_room,
+                               notice_rate=cfg.rate_limit_notice,
+                               max_keys=cfg.rate_limit_max_keys)
+    set_rate_limiter(rate_limiter)
+    # Each account gets separate clients (and connection pools) for the
+    # long-poll and for sends, so replies never queue behind a waiting sync.
+    # Everything else is shared by the accounts (see bot.accounts).
+    pool = AccountPool(
+        Account(account, create_clients(account.homeserver, account.user_id,
+                                        account.device_id,
+                                        sync_pool_size=cfg.sync_pool_size,
+                                        sync_keepalive=cfg.sync_keepalive,
+                                        api_pool_size=cfg.api_pool_size,
+                                        api_keepalive=cfg.api_keepalive,
+                                        json_codec=json_codec))
+        for account in account_configs(cfg))
+    if len(pool) > 1:
+        set_send_gate(FairSendGate(cfg.send_max_concurrent))
 
     # Register callbacks.
     # nio expects callbacks with the signature (room, event). Our handler also
-    # needs the client, so we wrap it in a small adapter that supplies it.
-    async def _on_message_wrapper(room, event):  # type: ignore[unused-ignore]
-        await on_message(client, room, event)
+    # needs the client to reply with, so we wrap it in a small adapter that
+    # supplies the receiving account's API client.
+    # nio awaits callbacks inside `sync()`, so each message is handled in its
+    # own task; otherwise a slow command would look like a hung sync.
+    # Every message seen is also recorded in the history cache first, so
+    # handlers can read context without a round-trip.
+    history = MessageHistory(depth=cfg.history_depth,
+                             thread_depth=cfg.history_depth,
+                             max_rooms=cfg.history_max_rooms,
+                             max_bytes=cfg.history_max_bytes)
+    summarizer = Summarizer(ignore_senders=[account.user_id for account in pool])
+    history.subscribe(summarizer.observe)
+    coordinator = ShutdownCoordinator(drain_timeout=cfg.shutdown_drain_timeout,
+                                      flush_timeout=cfg.shutdown_flush_timeout)
+    coordinator.on_close(pool.close)
+    coordinator.track_source(dispatcher.tasks)
+
+    def _message_callback(account: Account):
+        async def _on_message_wrapper(room, event):  # type: ignore[unused-ignore]
+            if not coordinator.accepting:
+                return
+            history.record(room.room_id, event)  # Once, however many accounts see it
+            coordinator.track(asyncio.create_task(
+                on_message(account.clients.api, room, event)))
+        return _on_message_wrapper
+
+    for account in pool:
+        account.clients.sync.add_event_callback(_message_callback(account), RoomMessageText)
+    set_services(config=cfg, client=pool.primary.clients.api, history=history,
+                 summarizer=summarizer, accounts=pool)
+
+    def _apply_config(old: BotConfig, new: BotConfig) -> None:
+        if new.log_level != old.log_level:
+            set_level(new.log_level)
+        set_config(new)  # Recompiles room policies
+        rate_limiter.set_rates(user_rate=new.rate_limit_user,
+                               room_rate=new.rate_limit_room,
+                               notice_rate=new.rate_limit_notice)
+        set_services(config=new)
+        coordinator.drain_timeout = new.shutdown_drain_timeout
+        coordinator.flush_timeout = new.shutdown_flush_timeout
+
+    config_service.subscribe(_apply_config)
+    config_watcher = asyncio.create_task(config_service.watch(STOP))
+
+    for account in pool:
+        await login_if_needed(account.clients, account.user_id,
+                              account.config.access_token)
+
+        # Optionally set display name
+        if account.config.display_name:
+            try:
+                await account.clients.api.set_displayname(account.config.display_name)
+            except Exception:
+                logger.warning("Could not set display name for %s",
+                               account.user_id, exc_info=True)
+
+    # Offloaded commands run in worker processes. They start before any
+    # handoff, so a successor only reports ready once its workers are up.
+    if cfg.worker_processes:
+        workers = WorkerPool(cfg.worker_processes, max_pending=cfg.worker_max_pending,
+                             call_timeout=cfg.worker_call_timeout)
+        await workers.start()
+        set_workers(workers)
+        coordinator.on_close(workers.close)
+
+    # When started by a restart handoff, warm up, then take over the
+    # predecessor's sync positions and unsent replies. State files (seen
+    # events, command storage, the journal) are only opened afterwards,
+    # once the predecessor has persisted them.
+    handed_over = []
+    predecessor = await HandoffChannel.from_env()
+    if predecessor is not None:
+        for account in pool:
+            await account.clients.api.whoami()  # Fails fast on a bad token; warms the pool
+        handoff = await take_over(predecessor)
+        if handoff is not None:
+            pool.restore_next_batches(handoff.get("next_batch"))
+            handed_over = handoff.get("unsent", [])
+            logger.info("Took over from predecessor (%d unsent replies)", len(handed_over))
+
+    seen_events = SeenEvents(
+        ttl=cfg.dedup_ttl, max_events=cfg.dedup_max_events,
+        path=Path(cfg.state_dir) / "seen_events" if cfg.dedup_persist else None)
+    set_seen_events(seen_events)
+    coordinator.on_persist(seen_events.close)
+
+    store = Store(Path(cfg.state_dir) / "storage.sqlite3",
+                  cache_size=cfg.storage_cache_size)
+    set_services(storage=store)
+    coordinator.on_persist(store.close)
+    store_task = asyncio.create_task(store.maintain(STOP, cfg.storage_flush_interval))
 
-    client.add_event_callback(_on_message_wrapper, RoomMessageText)
+    # Scheduled jobs run like commands: each is a tracked task that goes
+    # through the dispatcher and the outbound journal.
+    scheduler = Scheduler(lambda run: on_scheduled(
+                              pool.for_room(run.job.room_id).clients.api, run),
+                          path=Path(cfg.state_dir) / "schedule.sqlite3",
+                          spawn=coordinator.track)
+    scheduler.declare(get_registry().scheduled_tasks())
+    set_services(scheduler=scheduler)
+    coordinator.on_persist(scheduler.close)
 
-    await login_if_needed(client, cfg.user_id, cfg.access_token)
+    # Replies journaled but never acknowledged (by us before a crash, or by
+    # the predecessor) are resent under their original transaction IDs.
+    replay = []
+    journal_task = None
+    if cfg.outbound_journal:
+        journal = OutboundJournal(Path(cfg.state_dir) / "outbound.sqlite3",
+                                  max_entries=cfg.journal_max_entries)
+        set_journal(journal)
+        coordinator.on_persist(journal.close)
+        journal_task = asyncio.create_task(journal.maintain(STOP))
+        replay = journal.pending(cfg.journal_replay_max_age)
+    journaled = {reply["txn_id"] for reply in replay}
+    replay += [reply for reply in handed_over if reply.get("txn_id") not in journaled]
+    coordinator.track(asyncio.create_task(_resend(pool, replay)))
 
-    # Optionally set display name
-    if cfg.display_name:
+    exec_restart = False
+
+    async def _restart_when_requested() -> Optional[Successor]:
+        nonlocal exec_restart
+        while True:
+            await wait_for_restart_request()
+            if config_service.current.restart_mode == "exec":
+                exec_restart = True
+                STOP.set()
+                return None
+            successor = await Successor.start()
+            if successor is not None:
+                STOP.set()
+                return successor
+
+    restart_watcher = asyncio.create_task(_restart_when_requested())
+    scheduler_task = asyncio.create_task(scheduler.run(STOP))
+
+    logger.info("Starting sync loops for %d accounts", len(pool))
+    supervisors = {account.user_id: SyncSupervisor(account.clients.sync, STOP,
+                                                   timeout_ms=cfg.sync_timeout_ms,
+                                                   min_timeout_ms=cfg.sync_min_timeout_ms,
+                                                   backoff_cap=cfg.sync_backoff_cap,
+                                                   stall_grace=cfg.sync_stall_grace)
+                   for account in pool}
+    set_services(sync=supervisors)
+    await asyncio.gather(*(_sync_after(delay, supervisor) for delay, supervisor
+                           in zip(pool.sync_delays(cfg.sync_timeout_ms), supervisors.values())))
+    config_watcher.cancel()
+    if journal_task is not None:
+        journal_task.cancel()
+    store_task.cancel()
+    scheduler_task.cancel()
+    successor = None
+    if restart_watcher.done():
+        successor = restart_watcher.result()
+    else:
+        restart_watcher.cancel()
+
+    logger.info("Shutting down (sync: %s; connection pools: %s; dispatch lanes: %s)",
+                {user_id: supervisor.status() for user_id, supervisor in supervisors.items()},
+                pool.metrics(), dispatcher.snapshot())
+    report = await coordinator.shutdown()
+    if successor is not None:
+        if await successor.hand_over(pool.next_batches(), report.unsent):
+            logger.info("Handed over to pid %d", successor.process.pid)
+        else:
+            logger.error("Successor did not confirm the handoff")
+    if exec_restart:
+        restart_bot()
+
+
+async def _sync_after(delay: float, supervisor: SyncSupervisor) -> None:
+    """Run `supervisor` after `delay` seconds, unless stopped first."""
+    if delay:
         try:
-            await client.set_displayname(cfg.display_name)
-        except Exception:
-            logger.warning("Could not set display name", exc_info=True)
+            await asyncio.wait_for(STOP.wait(), delay)
+            return
+        except asyncio.TimeoutError:
+            pass
+    await supervisor.run()
 
-    logger.info("Starting sync loop")
 
-    while not STOP.is_set():
+async def _resend(pool: AccountPool, replies: list[dict]) -> None:
+    """Send replies left unsent by a predecessor or a previous run."""
+    if replies:
+        logger.info("Resending %d unsent replies", len(replies))
+    for reply in replies:
         try:
-            resp = await client.sync(timeout=30000)
-            if hasattr(resp, 'next_batch'):
-                pass
+            # The same account, so the server deduplicates by transaction ID
+            client = pool.get(reply.get("account")).clients.api
+            await room_send(client, reply["room_id"], reply["content"],
+                            txn_id=reply.get("txn_id"))
         except Exception:
-            logger.exception("Sync failed; retrying in 5s")
-            await asyncio.sleep(5)
+            logger.exception("Could not resend reply in %s", reply["room_id"])
+
+
+def main():
+    setup_logging()
+    config_service = ConfigService()
+    set_config_service(config_service)
+    cfg = config_service.current
+    # The loop implementation has to be chosen before the loop exists.
+    loop_factory, loop_name = get_loop_factory(cfg.use_uvloop)
+    try:
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            runner.run(run(config_service, loop_name))
+    finally:
+        shutdown_logging()
 
-    logger.info("Shutting down")
-    await client.close()
 
 if __name__ == "__main__":
-    _install_signal_handlers()
-    asyncio.run(run())
+    main()
@@ -0,0 +1,311 @@
+"""Outbound stage: turn handler replies into Matrix events and send them.
+
+Replies are threaded under the message that triggered them (or under its
+thread root if it was already in a thread). Plain strings are rendered from
+Markdown to ``formatted_body`` through the shared render cache, and bodies
+too large for one event are split into several messages.
+
+Streaming handlers' output is sent as soon as the first piece arrives and
+then grown in place with ``m.replace`` edits, at most one per edit interval;
+pieces arriving in between are coalesced into the next edit.
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Optional
+
+from nio import AsyncClient, RoomSendResponse
+
+from .accounts import FairSendGate
+from .commands import Reply
+from .formatting import RenderCache, split_message
+from .history import thread_root
+from .journal import OutboundJournal
+
+logger = logging.getLogger(__name__)
+
+# Plain-text bytes per message. The rendered HTML can be several times the
+# size of the source (highlighted code especially), so this sits well under
+# the 64 KiB event limit.
+MAX_CHUNK_BYTES = 16 * 1024
+# If body and formatted_body together exceed this, send the body alone.
+MAX_CONTENT_BYTES = 60 * 1024
+HTML_FORMAT = "org.matrix.custom.html"
+# Minimum seconds between edits of a streamed reply.
+EDIT_INTERVAL = 1.0
+# Journaled sends that fail transiently (5xx, or 408/429 once nio's own
+# retries are spent) are retried this many times, first after
+# SEND_RETRY_DELAY seconds and doubling from there.
+SEND_RETRIES = 3
+SEND_RETRY_DELAY = 2.0
+
+_render_cache = RenderCache()
+
+# Sends in progress (with the task awaiting them), and sends abandoned by a
+# cancelled task, so shutdown can flush the former and report or hand over
+# the latter. Entries are (room_id, content, txn_id, account[, task]).
+_in_flight: dict[int, tuple[str, dict[str, Any], Optional[str], Optional[str],
+                            Optional[asyncio.Task]]] = {}
+_cut_off: list[tuple[str, dict[str, Any], Optional[str], Optional[str]]] = []
+_send_ids = itertools.count()
+
+# Write-ahead journal for sends; None keeps them in memory only
+_journal: Optional[OutboundJournal] = None
+
+# Shares send slots fairly between accounts (see bot.accounts); None is unlimited
+_send_gate: Optional[FairSendGate] = None
+
+
+def set_render_cache(cache: RenderCache) -> None:
+    """Replace the shared render cache (e.g. with a differently sized one)."""
+    global _render_cache
+    _render_cache = cache
+
+
+def get_render_cache() -> RenderCache:
+    return _render_cache
+
+
+def set_journal(journal: Optional[OutboundJournal]) -> None:
+    """Journal every send in `journal` (None turns journaling off)."""
+    global _journal
+    _journal = journal
+
+
+def set_send_gate(gate: Optional[FairSendGate]) -> None:
+    """Route every send through `gate` (None removes the limit)."""
+    global _send_gate
+    _send_gate = gate
+
+
+def unsent() -> list[dict[str, Any]]:
+    """Return the sends that were cut off or are still in progress."""
+    pending = _cut_off + [entry[:4] for entry in _in_flight.values()]
+    return [{"room_id": room_id, "content": content, "txn_id": txn_id, "account": account}
+            for room_id, content, txn_id, account in pending]
+
+
+def sending_tasks() -> set[asyncio.Task]:
+    """Return the tasks currently waiting on a send."""
+    return {task for *_, task in _in_flight.values() if task is not None}
+
+
+async def room_send(client: AsyncClient, room_id: str, content: dict[str, Any],
+                    txn_id: Optional[str] = None) -> Any:
+    """
+    Send one ``m.room.message``, tracking it until it completes.
+
+    With a journal, the send is recorded under a new transaction ID first
+    and marked done once the server accepts it, or rejects it for good (a
+    4xx other than rate limiting). A transient failure is retried under the
+    same transaction ID, so the server drops duplicates, up to
+    `SEND_RETRIES` times with backoff; a send that still fails, or raises,
+    stays pending in the journal and is replayed at the next start.
+
+    Args:
+        txn_id: Resend an earlier, journaled send under its transaction ID
+    """
+    account = getattr(client, "user_id", None)
+    if txn_id is None and _journal is not None:
+        txn_id = _journal.record(room_id, content, account)
+    send_id = next(_send_ids)
+    _in_flight[send_id] = (room_id, content, txn_id, account, asyncio.current_task())
+    try:
+        for attempt in itertools.count():
+            if _send_gate is None:
+                resp = await _send(client, room_id, content, txn_id)
+            else:
+                async with _send_gate.slot(account):
+                    resp = await _send(client, room_id, content, txn_id)
+            if (txn_id is None or attempt >= SEND_RETRIES
+                    or isinstance(resp, RoomSendResponse) or _rejected(resp)):
+                break
+            delay = SEND_RETRY_DELAY * 2 ** attempt
+            logger.info("Send in %s failed, retrying in %.0fs: %s", room_id, delay, resp)
+            await asyncio.sleep(delay)
+    except asyncio.CancelledError:
+        _cut_off.append((room_id, content, txn_id, account))
+        raise
+    finally:
+        del _in_flight[send_id]
+    if txn_id is not None and _journal is not None:
+        if isinstance(resp, RoomSendResponse) or _rejected(resp):
+            _journal.done(txn_id)
+        else:
+            logger.warning("Send in %s failed; kept for replay: %s", room_id, resp)
+    return resp
+
+
+def _rejected(resp: Any) -> bool:
+    """Whether a send error would fail again if replayed (a 4xx but 408 or 429)."""
+    status = getattr(getattr(resp, "transport_response", None), "status", None)
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+
+async def _send(client: AsyncClient, room_id: str, content: dict[str, Any],
+                txn_id: Optional[str]) -> Any:
+    return await client.room_send(room_id=room_id, message_type="m.room.message",
+                                  content=content, **({"tx_id": txn_id} if txn_id else {}))
+
+
+def thread_relation(event) -> Optional[dict[str, Any]]:
+    """
+    Build the ``m.relates_to`` for a threaded reply to `event`.
+
+    A message that is itself in a thread is answered in that thread; a
+    thread can't be rooted at a threaded event. Without an event (scheduled
+    messages) there is nothing to relate to.
+    """
+    if event is None:
+        return None
+    return {
+        "rel_type": "m.thread",
+        "event_id": thread_root(event) or event.event_id,
+        "is_falling_back": True,
+        "m.in_reply_to": {"event_id": event.event_id},
+    }
+
+
+def build_contents(reply: str | Reply,
+                   relates_to: Optional[dict[str, Any]] = None) -> list[dict[str, Any]]:
+    """
+    Turn a handler reply into one or more ``m.room.message`` contents.
+
+    A Reply that already carries a ``formatted_body`` is sent as-is when it
+    fits in one event. Otherwise the body is split into chunks and each chunk
+    is rendered from Markdown through the render cache.
+    """
+    if isinstance(reply, str):
+        reply = Reply(body=reply)
+    if reply.formatted_body and _content_size(reply.body, reply.formatted_body) <= MAX_CONTENT_BYTES:
+        parts = [(reply.body, reply.formatted_body)]
+    else:
+        parts = [(chunk, _render_cache.render(chunk))
+                 for chunk in split_message(reply.body, MAX_CHUNK_BYTES)]
+
+    contents = []
+    for body, html in parts:
+        content: dict[str, Any] = {"msgtype": "m.text", "body": body}
+        if html and _content_size(body, html) <= MAX_CONTENT_BYTES:
+            content["format"] = HTML_FORMAT
+            content["formatted_body"] = html
+        if relates_to:
+            content["m.relates_to"] = relates_to
+        contents.append(content)
+    return contents
+
+
+def edit_content(event_id: str, content: dict[str, Any]) -> dict[str, Any]:
+    """Wrap `content` as an ``m.replace`` edit of `event_id`."""
+    edit = {
+        "msgtype": content["msgtype"],
+        "body": f"* {content['body']}",
+        "m.new_content": {k: v for k, v in content.items() if k != "m.relates_to"},
+        "m.relates_to": {"rel_type": "m.replace", "event_id": event_id},
+    }
+    if "formatted_body" in content:
+        edit["format"] = content["format"]
+        edit["formatted_body"] = f"* {content['formatted_body']}"
+    return edit
+
+
+async def send_reply(client: AsyncClient, room_id: str, event,
+                     reply: str | Reply | AsyncIterator[str],
+                     edit_interval: float = EDIT_INTERVAL) -> list[Any]:
+    """
+    Send `reply` to `room_id` as a threaded answer to `event`, or as a
+    plain message when `event` is None.
+
+    Async iterators (from streaming handlers) go through `stream_reply`.
+
+    Returns:
+        The room_send response for each message sent
+    """
+    if not isinstance(reply, (str, Reply)):
+        return await stream_reply(client, room_id, event, reply, edit_interval)
+    responses = []
+    for content in build_contents(reply, thread_relation(event)):
+        resp = await room_send(client, room_id, content)
+        if isinstance(resp, RoomSendResponse):
+            logger.debug("Message sent successfully")
+        else:
+            logger.warning("Message send may have failed: %s", resp)
+        responses.append(resp)
+    return responses
+
+
+async def stream_reply(client: AsyncClient, room_id: str, event,
+                       pieces: AsyncIterator[str],
+                       edit_interval: float = EDIT_INTERVAL) -> list[Any]:
+    """
+    Stream a reply built from appended text pieces.
+
+    The first piece is sent immediately; later ones are coalesced and
+    applied as edits no more often than every `edit_interval` seconds. Text
+    that outgrows one event continues in a new message.
+
+    Returns:
+        The room_send response for each message and edit sent
+    """
+    relation = thread_relation(event)
+    text = ""
+    finished = False
+    updated = asyncio.Event()
+
+    async def collect() -> None:
+        nonlocal text, finished
+        try:
+            async for piece in pieces:
+                text += piece
+                updated.set()
+        finally:
+            finished = True
+            updated.set()
+
+    collector = asyncio.create_task(collect())
+    event_ids: list[str] = []
+    sent: list[str] = []  # Text currently shown in each message
+    responses: list[Any] = []
+    last_send: Optional[float] = None
+    try:
+        while True:
+            await updated.wait()
+            if last_send is not None:
+                delay = last_send + edit_interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            updated.clear()
+            before = len(responses)
+            for i, part in enumerate(split_message(text, MAX_CHUNK_BYTES) if text else ()):
+                if i < len(sent) and part == sent[i]:
+                    continue
+                [content] = build_contents(part, relation)
+                if i < len(sent):
+                    content = edit_content(event_ids[i], content)
+                resp = await room_send(client, room_id, content)
+                responses.append(resp)
+                if not isinstance(resp, RoomSendResponse):
+                    raise RuntimeError(f"Streaming reply failed: {resp}")
+                if i < len(sent):
+                    sent[i] = part
+                else:
+                    event_ids.append(resp.event_id)
+                    sent.append(part)
+            if len(responses) > before:
+                last_send = time.monotonic()
+            if finished and not updated.is_set():
+                break
+        await collector  # Surface any error from the handler
+    finally:
+        collector.cancel()
+    logger.debug("Streamed reply in %s: %d messages, %d sends",
+                  room_id, len(event_ids), len(responses))
+    return responses
+
+
+def _content_size(body: str, html: str) -> int:
+    return len(json.dumps(body, ensure_ascii=False).encode()) + \
+        len(json.dumps(html, ensure_ascii=False).encode())
@@ -0,0 +1,152 @@
+"""Per-room policies: where the bot answers, which commands, and how much.
+
+Rules come from ``room_policies`` in config.toml and match a room by
+exact ID (``"!abc:example.org"``), by server (``"*:example.org"``) or
+everything (``"*"``). When several rules match a room, the more specific
+rule wins field by field: room over server over ``"*"``. Fields a rule
+leaves unset are inherited from the less specific rules.
+
+The legacy ``allowed_rooms`` list still works. When it is non-empty, rooms
+not on it are disabled unless a rule enables them.
+
+Rules are compiled into hash maps once. Each room's merged policy is
+resolved on first sight and cached until the rules are replaced, so a
+per-event check is one dict lookup.
+"""
+from __future__ import annotations
+import logging
+from dataclasses import dataclass, fields
+from typing import Any, Iterable, Optional
+
+from .ratelimit import Rate, parse_rate
+
+logger = logging.getLogger(__name__)
+
+# Rooms whose resolved policy is cached; the cache is dropped when full.
+MAX_CACHED_ROOMS = 10000
+
+
+@dataclass(frozen=True)
+class PolicyRule:
+    """One ``room_policies`` entry; None fields inherit."""
+    match: str
+    enabled: Optional[bool] = None
+    commands: Optional[frozenset[str]] = None  # Allowlist; None allows all
+    deny_commands: Optional[frozenset[str]] = None
+    rate: Optional[Rate] = None  # Replaces rate_limit_room for the room
+    max_concurrent: Optional[int] = None  # Commands running at once in the room
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "PolicyRule":
+        """
+        Build a rule from its config table.
+
+        Raises:
+            ValueError: On unknown keys or invalid values
+        """
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Unknown room policy key(s): {sorted(unknown)}")
+        if "match" not in data:
+            raise ValueError("Room policy needs a 'match' (room ID, '*:server' or '*')")
+        match = data["match"]
+        if "*" in match and match != "*" and not (match.startswith("*:") and "*" not in match[2:]):
+            raise ValueError(f"Invalid room policy match '{match}'")
+        max_concurrent = data.get("max_concurrent")
+        if max_concurrent is not None and max_concurrent < 1:
+            raise ValueError("Room policy max_concurrent must be at least 1")
+        return cls(
+            match=match,
+            enabled=data.get("enabled"),
+            commands=_names(data.get("commands")),
+            deny_commands=_names(data.get("deny_commands")),
+            rate=parse_rate(data.get("rate")),
+            max_concurrent=max_concurrent,
+        )
+
+
+def _names(values: Optional[Iterable[str]]) -> Optional[frozenset[str]]:
+    return None if values is None else frozenset(v.lower() for v in values)
+
+
+@dataclass(frozen=True)
+class RoomPolicy:
+    """The merged policy for one room."""
+    enabled: bool = True
+    commands: Optional[frozenset[str]] = None
+    deny_commands: frozenset[str] = frozenset()
+    rate: Optional[Rate] = None
+    max_concurrent: Optional[int] = None
+
+    def allows(self, command: str) -> bool:
+        """Return True if `command` may run in this room."""
+        command = command.lower()
+        if command in self.deny_commands:
+            return False
+        return self.commands is None or command in self.commands
+
+
+class RoomPolicies:
+    """Compiled room rules with a per-room decision cache."""
+
+    def __init__(self, rules: Iterable[PolicyRule] = (),
+                 allowed_rooms: Iterable[str] = ()):
+        self._default: Optional[PolicyRule] = None
+        self._servers: dict[str, PolicyRule] = {}
+        self._rooms: dict[str, PolicyRule] = {}
+        allowed = list(allowed_rooms)
+        if allowed:
+            self._default = PolicyRule(match="*", enabled=False)
+            for room_id in allowed:
+                self._rooms[room_id] = PolicyRule(match=room_id, enabled=True)
+        for rule in rules:
+            if rule.match == "*":
+                self._default = _overlay(self._default, rule)
+            elif rule.match.startswith("*:"):
+                server = rule.match[2:]
+                self._servers[server] = _overlay(self._servers.get(server), rule)
+            else:
+                self._rooms[rule.match] = _overlay(self._rooms.get(rule.match), rule)
+        self._cache: dict[str, RoomPolicy] = {}
+
+    @classmethod
+    def from_config(cls, config) -> "RoomPolicies":
+        """Compile the policies described by a BotConfig."""
+        rules = [PolicyRule.from_dict(entry) for entry in config.room_policies]
+        return cls(rules, config.allowed_rooms)
+
+    def for_room(self, room_id: str) -> RoomPolicy:
+        """Return the merged policy for `room_id`."""
+        policy = self._cache.get(room_id)
+        if policy is None:
+            if len(self._cache) >= MAX_CACHED_ROOMS:
+                self._cache.clear()
+            policy = self._cache[room_id] = self._resolve(room_id)
+        return policy
+
+    def invalidate(self) -> None:
+        """Forget every cached per-room decision."""
+        self._cache.clear()
+
+    def _resolve(self, room_id: str) -> RoomPolicy:
+        _, _, server = room_id.partition(":")
+        merged: dict[str, Any] = {}
+        # Least to most specific, so later rules override earlier ones.
+        for rule in (self._default, self._servers.get(server), self._rooms.get(room_id)):
+            if rule is None:
+                continue
+            for field in ("enabled", "commands", "deny_commands", "rate", "max_concurrent"):
+                value = getattr(rule, field)
+                if value is not None:
+                    merged[field] = value
+        return RoomPolicy(**merged)
+
+
+def _overlay(base: Optional[PolicyRule], rule: PolicyRule) -> PolicyRule:
+    """Combine two rules for the same match; `rule`'s set fields win."""
+    if base is None:
+        return rule
+    values = {f.name: getattr(rule, f.name) if getattr(rule, f.name) is not None
+              else getattr(base, f.name) for f in fields(PolicyRule)}
+    return PolicyRule(**values)
@@ -0,0 +1,206 @@
+"""Token-bucket rate limits for commands.
+
+Each command invocation is checked against up to three buckets:
+
+- per sender, across all commands (``BotConfig.rate_limit_user``)
+- per room, across all commands (``BotConfig.rate_limit_room``)
+- per sender and command, when the command declares
+  ``@command(rate="3/hour")``
+
+A request is admitted only if every applicable bucket has a token, and only
+then are tokens taken. Rejected senders get at most one "slow down" notice
+per ``rate_limit_notice`` window; everything else is dropped silently, so a
+flood costs a regex match and a few dict lookups per message.
+
+Buckets live in one LRU-ordered table capped at `max_keys`. A bucket that
+has been idle long enough to refill completely carries no state worth
+keeping, so idle buckets are evicted from the cold end as we go.
+"""
+from __future__ import annotations
+import logging
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+_PERIODS = {"s": 1.0, "sec": 1.0, "second": 1.0,
+            "m": 60.0, "min": 60.0, "minute": 60.0,
+            "h": 3600.0, "hour": 3600.0,
+            "d": 86400.0, "day": 86400.0}
+_RATE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*/\s*(\d*(?:\.\d+)?)\s*([a-z]+)\s*$")
+
+# Buckets examined for idle eviction per check.
+EVICT_BATCH = 4
+
+
+@dataclass(frozen=True)
+class Rate:
+    """`limit` requests per `period` seconds; bursts of up to `limit`."""
+    limit: float
+    period: float
+
+    @property
+    def per_second(self) -> float:
+        return self.limit / self.period
+
+    @property
+    def refill_seconds(self) -> float:
+        """Time for an empty bucket to refill completely."""
+        return self.period
+
+    def __str__(self) -> str:
+        return f"{self.limit:g}/{self.period:g}s"
+
+
+def parse_rate(spec: str | Rate | None) -> Optional[Rate]:
+    """
+    Parse a rate such as "5/min", "3/hour" or "10/30s".
+
+    None or an empty string means "no limit".
+
+    Raises:
+        ValueError: If the spec can't be parsed
+    """
+    if spec is None or isinstance(spec, Rate):
+        return spec
+    if not spec.strip():
+        return None
+    match = _RATE.match(spec.lower())
+    if not match or match.group(3) not in _PERIODS:
+        raise ValueError(f"Invalid rate '{spec}'; expected e.g. '5/min' or '10/30s'")
+    limit = float(match.group(1))
+    period = float(match.group(2) or 1) * _PERIODS[match.group(3)]
+    if limit <= 0 or period <= 0:
+        raise ValueError(f"Invalid rate '{spec}'; limit and period must be positive")
+    return Rate(limit, period)
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "idle_after")
+
+    def __init__(self, rate: Rate, now: float):
+        self.tokens = rate.limit
+        self.updated = now
+        self.idle_after = rate.refill_seconds
+
+
+class TokenBuckets:
+    """A bounded table of token buckets keyed by arbitrary hashables."""
+
+    def __init__(self, max_keys: int = 50000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets: OrderedDict[Hashable, _Bucket] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def try_acquire(self, wants: list[tuple[Hashable, Rate]]) -> float:
+        """
+        Take one token from every bucket in `wants`, or from none.
+
+        Returns:
+            0.0 if admitted, otherwise seconds until all buckets have a token
+        """
+        now = self._clock()
+        self._evict_idle(now)
+        buckets = []
+        wait = 0.0
+        for key, rate in wants:
+            bucket = self._bucket(key, rate, now)
+            if bucket.tokens < 1.0:
+                wait = max(wait, (1.0 - bucket.tokens) / rate.per_second)
+            buckets.append(bucket)
+        if wait:
+            return wait
+        for bucket in buckets:
+            bucket.tokens -= 1.0
+        return 0.0
+
+    def _bucket(self, key: Hashable, rate: Rate, now: float) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(rate, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.idle_after = rate.refill_seconds
+            bucket.tokens = min(rate.limit,
+                                bucket.tokens + (now - bucket.updated) * rate.per_second)
+            bucket.updated = now
+        return bucket
+
+    def _evict_idle(self, now: float) -> None:
+        for _ in range(EVICT_BATCH):
+            if not self._buckets:
+                return
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket.updated < bucket.idle_after:
+                return  # Everything behind it was used more recently
+            del self._buckets[key]
+
+
+@dataclass(frozen=True)
+class Decision:
+    """Outcome of a rate-limit check."""
+    allowed: bool
+    retry_after: float = 0.0  # Seconds until the request would be admitted
+    notify: bool = False  # Send the sender a "slow down" notice
+
+
+ALLOWED = Decision(allowed=True)
+
+
+class RateLimiter:
+    """Applies user, room and per-command rates to command invocations."""
+
+    def __init__(self, user_rate: str | Rate | None = None,
+                 room_rate: str | Rate | None = None,
+                 notice_rate: str | Rate | None = "1/min",
+                 max_keys: int = 50000, clock: Callable[[], float] = time.monotonic):
+        self.user_rate = parse_rate(user_rate)
+        self.room_rate = parse_rate(room_rate)
+        self.notice_rate = parse_rate(notice_rate)
+        self._buckets = TokenBuckets(max_keys, clock)
+        self._notices = TokenBuckets(max_keys, clock)
+        self.rejected = 0
+
+    def set_rates(self, user_rate: str | Rate | None = None,
+                  room_rate: str | Rate | None = None,
+                  notice_rate: str | Rate | None = "1/min") -> None:
+        """Change the default rates (e.g. on config reload), keeping bucket state."""
+        self.user_rate = parse_rate(user_rate)
+        self.room_rate = parse_rate(room_rate)
+        self.notice_rate = parse_rate(notice_rate)
+
+    def check(self, sender: str, room_id: str, command: str,
+              command_rate: Optional[Rate] = None,
+              room_rate: Optional[Rate] = None) -> Decision:
+        """
+        Decide whether `sender` may run `command` in `room_id` now.
+
+        Args:
+            command_rate: The command's own per-sender rate, if any
+            room_rate: Overrides the default room rate (e.g. from room policy)
+        """
+        wants = []
+        if self.user_rate:
+            wants.append((("user", sender), self.user_rate))
+        room_rate = room_rate or self.room_rate
+        if room_rate:
+            wants.append((("room", room_id), room_rate))
+        if command_rate:
+            wants.append((("cmd", command, sender), command_rate))
+        if not wants:
+            return ALLOWED
+        wait = self._buckets.try_acquire(wants)
+        if not wait:
+            return ALLOWED
+        self.rejected += 1
+        notify = (self.notice_rate is not None
+                  and not self._notices.try_acquire([(sender, self.notice_rate)]))
+        return Decision(allowed=False, retry_after=wait, notify=notify)
@@ -1,11 +1,59 @@
-"""Bot reload mechanism for applying code changes."""
+"""Bot reload mechanism for applying code changes.
+
+Two ways to restart:
+
+- ``exec``: `restart_bot` replaces the process in place with ``os.execv``.
+  Simple, but the bot is offline until the new image has imported, logged
+  in and synced, and whatever was in flight is lost.
+- ``handoff`` (the default): `request_restart` asks the running bot to
+  start its successor alongside itself. The two talk over a socketpair:
+
+  1. The successor imports commands, logs in and warms its connections,
+     then sends ``{"type": "ready"}``.
+  2. The old process stops syncing, lets in-flight handlers finish (up to
+     a deadline) and persists its state. It sends each reply it did not
+     get to send as ``{"type": "unsent", "reply"}``, then
+     ``{"type": "handoff"}`` with its sync token.
+  3. The successor acknowledges with ``{"type": "done"}``, sends those
+     replies and resumes syncing from the token; the old process exits.
+
+  If the successor fails to become ready, it is killed and the old process
+  carries on.
+"""
 from __future__ import annotations
+import asyncio
+import json
 import os
+import socket
 import sys
 import logging
+from typing import Any, Optional
 
 logger = logging.getLogger(__name__)
 
+# Environment variable telling a successor which fd is its handoff socket.
+HANDOFF_FD_ENV = "BOT_HANDOFF_FD"
+# Seconds the old process waits for its successor to report ready.
+READY_TIMEOUT = 120.0
+# Seconds either side waits for the other's next message after ready.
+HANDOFF_TIMEOUT = 60.0
+# Longest message on the channel: one reply (Matrix caps events at 64 KiB)
+# with room for JSON escaping of every character.
+MAX_MESSAGE_BYTES = 1024 * 1024
+
+_restart_requested: Optional[asyncio.Event] = None
+
+
+def restart_command() -> list[str]:
+    """
+    The command line that started this process, to start another like it.
+
+    Uses `sys.orig_argv` rather than `sys.argv`: under ``python -m bot.main``
+    the latter starts with the path of bot/main.py, which can't be run as a
+    script because of its relative imports.
+    """
+    return [sys.executable, *sys.orig_argv[1:]]
+
 
 def restart_bot() -> None:
     """
@@ -17,17 +65,178 @@ def restart_bot() -> None:
     logger.info("Restarting bot...")
 
     try:
-        # Get the Python executable and original arguments
-        python = sys.executable
-        args = [python] + sys.argv
+        args = restart_command()
 
         # Close file descriptors to avoid issues
         # (nio client should be closed before this is called)
 
         # Replace the current process with a new one
-        os.execv(python, args)
+        os.execv(args[0], args)
 
     except Exception as e:
         logger.exception(f"Failed to restart bot: {e}")
         # If restart fails, we should at least try to continue running
         raise RuntimeError(f"Bot restart failed: {e}")
+
+
+def _restart_event() -> asyncio.Event:
+    global _restart_requested
+    if _restart_requested is None:
+        _restart_requested = asyncio.Event()
+    return _restart_requested
+
+
+def request_restart(reason: str = "") -> None:
+    """Ask the running bot to restart once the current reply is on its way."""
+    logger.info("Restart requested%s", f": {reason}" if reason else "")
+    _restart_event().set()
+
+
+async def wait_for_restart_request() -> None:
+    """Return once `request_restart` has been called."""
+    await _restart_event().wait()
+    _restart_event().clear()
+
+
+class HandoffChannel:
+    """Newline-delimited JSON messages over one end of a socketpair."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def open(cls, sock: socket.socket, limit: int = MAX_MESSAGE_BYTES) -> "HandoffChannel":
+        """Wrap `sock`; `limit` bounds the length of one message."""
+        reader, writer = await asyncio.open_connection(sock=sock, limit=limit)
+        return cls(reader, writer)
+
+    @classmethod
+    async def from_env(cls) -> Optional["HandoffChannel"]:
+        """The channel to our predecessor, if we were started by a handoff."""
+        fd = os.environ.pop(HANDOFF_FD_ENV, None)
+        if fd is None:
+            return None
+        return await cls.open(socket.socket(fileno=int(fd)))
+
+    async def send(self, message: dict[str, Any]) -> None:
+        self._writer.write(json.dumps(message).encode() + b"\n")
+        await self._writer.drain()
+
+    async def receive(self, timeout: float = HANDOFF_TIMEOUT) -> Optional[dict[str, Any]]:
+        """Return the next message, or None if the peer hung up."""
+        line = await asyncio.wait_for(self._reader.readline(), timeout)
+        return json.loads(line) if line else None
+
+    async def end(self) -> None:
+        """Tell the peer no more messages follow, while still receiving its own."""
+        if self._writer.can_write_eof() and not self._writer.is_closing():
+            self._writer.write_eof()
+
+    async def close(self) -> None:
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass
+
+
+class Successor:
+    """The old process's side of a handoff to a newly started process."""
+
+    def __init__(self, process: asyncio.subprocess.Process, channel: HandoffChannel):
+        self.process = process
+        self.channel = channel
+
+    @classmethod
+    async def start(cls, ready_timeout: float = READY_TIMEOUT) -> Optional["Successor"]:
+        """
+        Launch a new bot process and wait for it to report ready.
+
+        Returns:
+            The ready successor, or None if it failed to start (it is killed)
+        """
+        ours, theirs = socket.socketpair()
+        env = dict(os.environ, **{HANDOFF_FD_ENV: str(theirs.fileno())})
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *restart_command(), env=env, pass_fds=(theirs.fileno(),))
+        except OSError:
+            logger.exception("Could not start successor process")
+            ours.close()
+            return None
+        finally:
+            theirs.close()
+        successor = cls(process, await HandoffChannel.open(ours))
+        try:
+            message = await successor.channel.receive(ready_timeout)
+        except (asyncio.TimeoutError, ValueError):
+            message = None
+        except asyncio.CancelledError:
+            await successor.abort()
+            raise
+        if not message or message.get("type") != "ready":
+            logger.error("Successor (pid %d) did not become ready; keeping this process",
+                         process.pid)
+            await successor.abort()
+            return None
+        logger.info("Successor (pid %d) is ready; handing over", process.pid)
+        return successor
+
+    async def hand_over(self, next_batch: str | dict[str, Optional[str]] | None,
+                        unsent: list[dict[str, Any]]) -> bool:
+        """
+        Pass the sync token (or tokens by account, see
+        `AccountPool.next_batches`) and unsent replies and wait for
+        acknowledgement.
+
+        Returns:
+            True if the successor confirmed it has taken over
+        """
+        try:
+            for reply in unsent:  # One per message, so no message outgrows the limit
+                await self.channel.send({"type": "unsent", "reply": reply})
+            await self.channel.send({"type": "handoff", "next_batch": next_batch})
+            message = await self.channel.receive()
+        except (OSError, asyncio.TimeoutError, ValueError):
+            logger.exception("Handoff to pid %d failed", self.process.pid)
+            return False
+        finally:
+            await self.channel.close()
+        return bool(message) and message.get("type") == "done"
+
+    async def abort(self) -> None:
+        await self.channel.close()
+        if self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+
+
+async def take_over(channel: HandoffChannel) -> Optional[dict[str, Any]]:
+    """
+    Successor side: report ready and wait for the old process's state.
+
+    Returns:
+        The handoff message (``next_batch`` and ``unsent``), or None if the
+        old process went away without sending one
+    """
+    await channel.send({"type": "ready"})
+    unsent = []
+    try:
+        while (message := await channel.receive()) and message.get("type") == "unsent":
+            unsent.append(message["reply"])
+    except (asyncio.TimeoutError, ValueError, KeyError) as e:
+        # The predecessor exits regardless, so its state is lost
+        logger.error("Handoff from predecessor failed (%s); starting from the "
+                     "stored sync token and journal", type(e).__name__)
+        await channel.close()
+        return None
+    if not message or message.get("type") != "handoff":
+        logger.warning("Predecessor sent no handoff; starting from the stored sync token")
+        await channel.close()
+        return None
+    try:
+        await channel.send({"type": "done"})
+    finally:
+        await channel.close()
+    return dict(message, unsent=unsent)
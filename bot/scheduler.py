@@ -0,0 +1,313 @@
+"""Timed and periodic jobs.
+
+A job runs a task declared with ``@scheduled`` (see `bot.commands`) in one
+room, either once at a given time or every `every` seconds. Jobs come from
+two places: tasks that declare ``every`` and ``rooms`` get one job per room
+at startup, and handlers add jobs at runtime through
+``ctx.services.scheduler`` (reminders, say).
+
+All jobs share one heap ordered by due time and one runner task, which
+sleeps until the earliest due time (or until an earlier job is added), so
+thousands of timers cost one sleeping coroutine and O(log n) per change.
+Jobs are persisted to SQLite and survive restarts.
+
+- **Catch-up with coalescing**: a periodic job that missed several runs
+  while the bot was down runs once, with ``missed`` set to the number of
+  runs skipped, then resumes its normal cadence.
+- **Jitter**: a job may be offset by up to `jitter` seconds, so jobs
+  sharing a period don't all fire at once. The offset is a stable function
+  of the job ID, so it does not drift from run to run.
+
+Due jobs are handed to the `run` callback, which sends them through the
+dispatcher and outbound stage like any command. A one-shot job keeps its row
+until its run has finished, so a run cut off by a crash or restart fires
+again at the next start, and a callback that can't start the run yet (the
+dispatcher is full, say) raises `RetryLater` to have it fire again shortly.
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import math
+import re
+import secrets
+import sqlite3
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Longest the runner sleeps without re-checking the clock.
+MAX_SLEEP = 60.0
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_INTERVAL = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhdw])\s*$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    next_run REAL NOT NULL,
+    every REAL,
+    jitter REAL NOT NULL DEFAULT 0,
+    payload TEXT,
+    declared INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def parse_interval(spec: str | float | int | None) -> Optional[float]:
+    """
+    Parse an interval such as 90, "30s", "15m", "1.5h", "1d" or "2w".
+
+    Raises:
+        ValueError: If the spec can't be parsed or isn't positive
+    """
+    if spec is None:
+        return None
+    if isinstance(spec, (int, float)):
+        seconds = float(spec)
+    else:
+        match = _INTERVAL.match(spec.lower())
+        if not match:
+            raise ValueError(f"Invalid interval '{spec}'; expected e.g. '30s', '15m' or '1h'")
+        seconds = float(match.group(1)) * _UNITS[match.group(2)]
+    if seconds <= 0:
+        raise ValueError(f"Invalid interval '{spec}'; must be positive")
+    return seconds
+
+
+class RetryLater(Exception):
+    """Raised by the run callback when a run can't start right now.
+
+    A one-shot job fires again after `delay` seconds; a periodic job just
+    waits for its next run.
+    """
+
+    def __init__(self, delay: float = 5.0):
+        super().__init__(f"retry in {delay:g}s")
+        self.delay = delay
+
+
+@dataclass(frozen=True)
+class Job:
+    """One scheduled run (or series of runs) of a task in a room."""
+    job_id: str
+    task: str  # Name of the @scheduled task
+    room_id: str
+    next_run: float  # Nominal time of the next run, before jitter
+    every: Optional[float] = None  # Seconds between runs; None runs once
+    jitter: float = 0.0  # Maximum offset added to each run
+    payload: Any = None  # JSON-serializable data for the task
+    declared: bool = False  # Created from a task's own `every`/`rooms`
+
+    @property
+    def due(self) -> float:
+        """When the job actually fires: `next_run` plus its jitter offset."""
+        if not self.jitter:
+            return self.next_run
+        digest = hashlib.blake2b(self.job_id.encode(), digest_size=4).digest()
+        return self.next_run + self.jitter * int.from_bytes(digest, "big") / 2 ** 32
+
+
+@dataclass(frozen=True)
+class Run:
+    """A job firing, as passed to the run callback."""
+    job: Job
+    scheduled_for: float  # Nominal time of this run
+    missed: int = 0  # Earlier runs coalesced into this one
+
+
+class Scheduler:
+    """Heap-based scheduler with SQLite persistence."""
+
+    def __init__(self, run: Callable[[Run], Awaitable[None]],
+                 path: str | Path | None = None,
+                 spawn: Optional[Callable[[asyncio.Task], Any]] = None,
+                 clock: Callable[[], float] = time.time):
+        self._run = run
+        self._spawn = spawn
+        self._clock = clock
+        self._jobs: dict[str, Job] = {}
+        self._heap: list[tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._wake_at = math.inf  # When the sleeping runner will next look
+        self._tasks: set[asyncio.Task] = set()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    # -- job management ----------------------------------------------------
+
+    def add(self, task: str, room_id: str, at: Optional[float] = None,
+            delay: str | float | None = None, every: str | float | None = None,
+            jitter: float = 0.0, payload: Any = None,
+            job_id: Optional[str] = None) -> Job:
+        """
+        Schedule `task` in `room_id`.
+
+        The first run is at `at` (a Unix time), after `delay`, or one `every`
+        from now. A job with the same `job_id` is replaced.
+
+        Raises:
+            ValueError: If no time is given or the payload isn't JSON
+        """
+        every = parse_interval(every)
+        now = self._clock()
+        if at is None:
+            offset = parse_interval(delay) if delay is not None else every
+            if offset is None:
+                raise ValueError("A job needs `at`, `delay` or `every`")
+            at = now + offset
+        json.dumps(payload)  # Fail now rather than when persisting
+        job = Job(job_id=job_id or secrets.token_hex(8), task=task, room_id=room_id,
+                  next_run=at, every=every, jitter=jitter, payload=payload)
+        self._put(job)
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """Remove a job. Returns True if it existed."""
+        if self._jobs.pop(job_id, None) is None:
+            return False
+        if self._db is not None:
+            self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return True
+
+    def jobs(self, room_id: Optional[str] = None, task: Optional[str] = None) -> list[Job]:
+        """Return jobs, optionally filtered by room and task, soonest first."""
+        return sorted((j for j in self._jobs.values()
+                       if (room_id is None or j.room_id == room_id)
+                       and (task is None or j.task == task)),
+                      key=lambda j: j.due)
+
+    def declare(self, tasks: Iterable[Any]) -> None:
+        """
+        Reconcile declared jobs with the registered `tasks`.
+
+        Each task with ``every`` and ``rooms`` (see ``ScheduledTask``) gets
+        one periodic job per room; declared jobs for rooms or tasks no longer
+        listed are removed. Existing jobs keep their next run time unless
+        their period or jitter changed.
+        """
+        wanted: dict[str, tuple[Any, str]] = {}
+        for task in tasks:
+            if task.every:
+                for room in task.rooms:
+                    wanted[f"{task.name}@{room}"] = (task, room)
+        for job in list(self._jobs.values()):
+            if job.declared and job.job_id not in wanted:
+                self.cancel(job.job_id)
+        now = self._clock()
+        for job_id, (task, room) in wanted.items():
+            existing = self._jobs.get(job_id)
+            if existing and existing.every == task.every and existing.jitter == task.jitter:
+                continue
+            self._put(Job(job_id=job_id, task=task.name, room_id=room,
+                          next_run=now + task.every, every=task.every,
+                          jitter=task.jitter, declared=True))
+
+    # -- running -----------------------------------------------------------
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Fire due jobs until `stop` is set."""
+        self._wakeup = asyncio.Event()
+        while not stop.is_set():
+            now = self._clock()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, job_id = heapq.heappop(self._heap)
+                job = self._jobs.get(job_id)
+                if job is None or job.due != due:
+                    continue  # Cancelled or rescheduled since it was pushed
+                self._fire(job, now)
+            delay = min(self._heap[0][0] - now, MAX_SLEEP) if self._heap else MAX_SLEEP
+            self._wake_at = now + delay
+            self._wakeup.clear()
+            waiters = [asyncio.ensure_future(stop.wait()),
+                       asyncio.ensure_future(self._wakeup.wait())]
+            try:
+                await asyncio.wait(waiters, timeout=max(delay, 0.0),
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _fire(self, job: Job, now: float) -> None:
+        scheduled_for, missed = job.next_run, 0
+        if job.every:
+            # Coalesce every run that fell due while we weren't looking.
+            missed = max(0, math.floor((now - job.next_run) / job.every))
+            scheduled_for = job.next_run + missed * job.every
+            self._put(replace(job, next_run=scheduled_for + job.every))
+        # A one-shot job stays in `_jobs` and on disk until its run finishes
+        # (see `_guarded`); it is off the heap, so it won't fire twice.
+        if missed:
+            logger.info("Job %s (%s in %s) coalesced %d missed runs",
+                        job.job_id, job.task, job.room_id, missed)
+        task = asyncio.create_task(self._guarded(Run(job, scheduled_for, missed)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if self._spawn is not None:
+            self._spawn(task)
+
+    async def _guarded(self, run: Run) -> None:
+        job = run.job
+        retry_in = None
+        try:
+            await self._run(run)
+        except RetryLater as e:
+            retry_in = e.delay
+        except Exception:
+            logger.exception("Scheduled job %s (%s) failed", job.job_id, job.task)
+        if job.every or self._jobs.get(job.job_id) is not job:
+            return  # Periodic, or cancelled or replaced while running
+        if retry_in is not None:
+            logger.info("Job %s (%s in %s) deferred; retrying in %gs",
+                        job.job_id, job.task, job.room_id, retry_in)
+            self._put(replace(job, next_run=self._clock() + retry_in))
+        else:
+            self.cancel(job.job_id)
+
+    def _put(self, job: Job) -> None:
+        self._jobs[job.job_id] = job
+        heapq.heappush(self._heap, (job.due, next(self._seq), job.job_id))
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs "
+                "(job_id, task, room_id, next_run, every, jitter, payload, declared) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.job_id, job.task, job.room_id, job.next_run, job.every,
+                 job.jitter, json.dumps(job.payload), int(job.declared)))
+        if self._wakeup is not None and job.due < self._wake_at:
+            self._wakeup.set()  # Due before the runner would look; re-plan the sleep
+
+    def _load(self) -> None:
+        rows = self._db.execute(
+            "SELECT job_id, task, room_id, next_run, every, jitter, payload, declared "
+            "FROM jobs").fetchall()
+        for job_id, task, room_id, next_run, every, jitter, payload, declared in rows:
+            job = Job(job_id, task, room_id, next_run, every, jitter,
+                      json.loads(payload) if payload else None, bool(declared))
+            self._jobs[job_id] = job
+            heapq.heappush(self._heap, (job.due, next(self._seq), job_id))
+        if rows:
+            logger.info("Restored %d scheduled jobs", len(rows))
@@ -0,0 +1,39 @@
+"""Shared services made available to command handlers via CommandContext."""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class Services:
+    """Process-wide services handlers may use.
+
+    Populated by `bot.main` at startup; fields stay None in tests or when a
+    service is disabled.
+    """
+    config: Any = None  # BotConfig
+    client: Any = None  # Primary account's AsyncClient for outbound API calls
+    history: Any = None  # MessageHistory of recent room/thread messages
+    summarizer: Any = None  # Summarizer kept up to date from history
+    storage: Any = None  # Store of per-command key-value state
+    scheduler: Any = None  # Scheduler for timed and periodic tasks
+    accounts: Any = None  # AccountPool of the bot accounts in this process
+    sync: Any = None  # Account user ID -> its SyncSupervisor (see `status()`)
+
+
+# Global services instance
+_services = Services()
+
+
+def get_services() -> Services:
+    """Get the global services instance."""
+    return _services
+
+
+def set_services(**services: Any) -> Services:
+    """Set one or more services and return the global instance."""
+    for name, value in services.items():
+        if not hasattr(_services, name):
+            raise AttributeError(f"Unknown service: {name}")
+        setattr(_services, name, value)
+    return _services
@@ -0,0 +1,152 @@
+"""Staged shutdown: stop intake, drain handlers, flush sends, persist, close.
+
+`ShutdownCoordinator` owns the tasks that must not be abandoned when the bot
+stops (message handlers, the dispatcher jobs running their commands and
+other background work) and shuts down in phases, each with its own
+deadline:
+
+1. **stop** - new events are refused (`accepting` goes False).
+2. **drain** - tracked tasks get `drain_timeout` seconds to finish; the
+   rest are cancelled, along with any that started meanwhile.
+3. **flush** - outbound sends still in progress get `flush_timeout`
+   seconds; whatever is left is cut off.
+4. **persist** - persist hooks run (seen events, journals, stores).
+5. **close** - close hooks run (HTTP clients).
+
+The returned `ShutdownReport` says what was cut off, so it can be logged
+and, during a restart handoff, passed to the successor.
+"""
+from __future__ import annotations
+import asyncio
+import inspect
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, Union
+
+from . import outbound
+
+logger = logging.getLogger(__name__)
+
+Hook = Callable[[], Union[None, Awaitable[None]]]
+
+
+@dataclass
+class ShutdownReport:
+    """What a shutdown finished and what it had to cut off."""
+    drained: int = 0  # Tasks that finished within the drain deadline
+    cancelled: int = 0  # Tasks cancelled at the drain or flush deadline
+    unsent: list[dict[str, Any]] = field(default_factory=list)  # Cut-off sends
+    failed_hooks: list[str] = field(default_factory=list)
+    phase_seconds: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def clean(self) -> bool:
+        return not (self.cancelled or self.unsent or self.failed_hooks)
+
+
+class ShutdownCoordinator:
+    """Tracks in-flight work and shuts it down in stages."""
+
+    def __init__(self, drain_timeout: float = 10.0, flush_timeout: float = 5.0):
+        self.drain_timeout = drain_timeout
+        self.flush_timeout = flush_timeout
+        self.accepting = True
+        self._tasks: set[asyncio.Task] = set()
+        self._sources: list[Callable[[], Iterable[asyncio.Task]]] = []
+        self._persist: list[Hook] = []
+        self._close: list[Hook] = []
+
+    def track(self, task: asyncio.Task) -> asyncio.Task:
+        """Drain `task` at shutdown instead of abandoning it."""
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def track_source(self, source: Callable[[], Iterable[asyncio.Task]]) -> None:
+        """Drain the tasks `source()` returns at shutdown, such as a dispatcher's jobs."""
+        self._sources.append(source)
+
+    def on_persist(self, hook: Hook) -> None:
+        """Run `hook` after in-flight work has settled."""
+        self._persist.append(hook)
+
+    def on_close(self, hook: Hook) -> None:
+        """Run `hook` last, after state has been persisted."""
+        self._close.append(hook)
+
+    async def shutdown(self) -> ShutdownReport:
+        """Run every phase and return what was cut off."""
+        report = ShutdownReport()
+        started = time.monotonic()
+        self.accepting = False
+        self._timed(report, "stop", started)
+
+        started = time.monotonic()
+        tasks = self._draining()
+        pending = await self._wait(tasks, self.drain_timeout)
+        report.drained = len(tasks) - len(pending)
+        # Cancelling a handler doesn't stop the dispatcher job it awaits, and
+        # a finishing job may start a queued one, so repeat until none run.
+        while pending := {task for task in self._draining() if not task.done()}:
+            report.cancelled += await _cancel(pending)
+        self._timed(report, "drain", started)
+
+        started = time.monotonic()
+        pending = await self._wait(outbound.sending_tasks(), self.flush_timeout)
+        report.cancelled += await _cancel(pending)
+        report.unsent = outbound.unsent()
+        self._timed(report, "flush", started)
+
+        started = time.monotonic()
+        await self._run_hooks(self._persist, report)
+        self._timed(report, "persist", started)
+
+        started = time.monotonic()
+        await self._run_hooks(self._close, report)
+        self._timed(report, "close", started)
+
+        log = logger.info if report.clean else logger.warning
+        log("Shutdown: %d tasks drained, %d cancelled, %d sends cut off, %d hooks failed (%s)",
+            report.drained, report.cancelled, len(report.unsent), len(report.failed_hooks),
+            ", ".join(f"{k} {v:.2f}s" for k, v in report.phase_seconds.items()))
+        for item in report.unsent:
+            logger.warning("Cut off reply in %s (%d chars)", item["room_id"],
+                           len(item["content"].get("body", "")))
+        return report
+
+    def _draining(self) -> set[asyncio.Task]:
+        tasks = set(self._tasks)
+        for source in self._sources:
+            tasks.update(source())
+        return tasks - {asyncio.current_task()}
+
+    @staticmethod
+    async def _wait(tasks: set[asyncio.Task], timeout: float) -> set[asyncio.Task]:
+        tasks = tasks - {asyncio.current_task()}
+        if not tasks:
+            return set()
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        return pending
+
+    @staticmethod
+    async def _run_hooks(hooks: list[Hook], report: ShutdownReport) -> None:
+        for hook in hooks:
+            try:
+                result = hook()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception("Shutdown hook %r failed", hook)
+                report.failed_hooks.append(getattr(hook, "__qualname__", repr(hook)))
+
+    @staticmethod
+    def _timed(report: ShutdownReport, phase: str, started: float) -> None:
+        report.phase_seconds[phase] = round(time.monotonic() - started, 3)
+
+
+async def _cancel(tasks: set[asyncio.Task]) -> int:
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return len(tasks)
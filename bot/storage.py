@@ -0,0 +1,230 @@
+"""Persistent key-value state for commands.
+
+Each command module gets its own namespace (``Command.module_name``), handed
+to version 2 handlers as ``ctx.storage``:
+
+    count = ctx.storage.incr(f"greeted:{ctx.sender}")
+    prefs = ctx.storage.get("prefs", {})
+    if ctx.storage.compare_and_set("turn", "@a:x", "@b:x"): ...
+
+Values are anything JSON can encode. The methods are synchronous. Reads
+come from an in-memory LRU cache, falling back to one indexed SQLite lookup
+on a miss. Writes land in the cache and a dirty set that a background task
+flushes to SQLite in one transaction every `flush_interval` seconds, or
+sooner once `max_dirty` keys are waiting. As
+the bot runs on one event loop and none of the methods await, `incr` and
+`compare_and_set` are atomic with respect to other handlers.
+
+The database uses WAL mode with ``synchronous=NORMAL``; writes still in the
+dirty set are flushed at shutdown, so only a hard crash can lose the last
+`flush_interval` seconds.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 256
+MAX_VALUE_BYTES = 64 * 1024
+# Seconds between write-behind flushes.
+FLUSH_INTERVAL = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+"""
+
+# Marks a cached key as known to be absent (or deleted but not yet flushed).
+_MISSING = object()
+
+
+class StorageError(Exception):
+    """Raised for invalid keys or values."""
+
+
+class Store:
+    """SQLite-backed key-value store with a read cache and write-behind."""
+
+    def __init__(self, path: str | Path, cache_size: int = 10000, max_dirty: int = 1000):
+        self.path = Path(path)
+        self.cache_size = cache_size
+        self.max_dirty = max_dirty
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        # (namespace, key) -> encoded JSON value or _MISSING
+        self._cache: OrderedDict[tuple[str, str], Any] = OrderedDict()
+        self._dirty: set[tuple[str, str]] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def namespace(self, name: str) -> "Namespace":
+        """Return the view of the store for one command module."""
+        # Plain closures rather than the store or its bound methods, so a
+        # namespace has no attribute leading back to the whole database.
+        store = self
+        return Namespace(name, lambda slot: store._read(slot),
+                         lambda slot, encoded: store._write(slot, encoded))
+
+    # -- cache and write-behind -------------------------------------------
+
+    def _read(self, slot: tuple[str, str]) -> Any:
+        encoded = self._cache.get(slot)
+        if encoded is not None:
+            self.hits += 1
+            self._cache.move_to_end(slot)
+            return encoded
+        self.misses += 1
+        row = self._db.execute("SELECT value FROM kv WHERE namespace = ? AND key = ?",
+                               slot).fetchone()
+        encoded = row[0] if row else _MISSING
+        self._remember(slot, encoded)
+        return encoded
+
+    def _write(self, slot: tuple[str, str], encoded: Any) -> None:
+        self._remember(slot, encoded, dirty=True)
+        if len(self._dirty) >= self.max_dirty:
+            self.flush()
+
+    def _remember(self, slot: tuple[str, str], encoded: Any, dirty: bool = False) -> None:
+        self._cache[slot] = encoded
+        self._cache.move_to_end(slot)
+        if dirty:
+            self._dirty.add(slot)
+        while len(self._cache) > self.cache_size:
+            # Dirty entries must stay cached until flushed.
+            for old in self._cache:
+                if old not in self._dirty:
+                    del self._cache[old]
+                    break
+            else:
+                self.flush()
+
+    def flush(self) -> int:
+        """
+        Write all dirty keys to SQLite in one transaction.
+
+        Returns:
+            Number of keys written
+        """
+        if not self._dirty:
+            return 0
+        upserts, deletes = [], []
+        for slot in self._dirty:
+            encoded = self._cache[slot]
+            if encoded is _MISSING:
+                deletes.append(slot)
+            else:
+                upserts.append((*slot, encoded))
+        with self._db:  # One transaction
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT INTO kv (namespace, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value",
+                upserts)
+            self._db.executemany("DELETE FROM kv WHERE namespace = ? AND key = ?", deletes)
+        written = len(self._dirty)
+        self._dirty.clear()
+        return written
+
+    async def maintain(self, stop: asyncio.Event, interval: float = FLUSH_INTERVAL) -> None:
+        """Flush every `interval` seconds until `stop` is set."""
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logger.warning("Could not flush storage to %s", self.path, exc_info=True)
+
+    def close(self) -> None:
+        """Flush pending writes and close the database."""
+        try:
+            self.flush()
+        finally:
+            self._db.close()
+
+
+class Namespace:
+    """One command module's keys. All methods are synchronous and atomic."""
+
+    __slots__ = ("name", "_read", "_write")
+
+    def __init__(self, name: str, read: Callable[[tuple[str, str]], Any],
+                 write: Callable[[tuple[str, str], Any], None]):
+        self.name = name
+        self._read = read
+        self._write = write
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the value for `key`, or `default`."""
+        encoded = self._read(self._slot(key))
+        return default if encoded is _MISSING else json.loads(encoded)
+
+    def set(self, key: str, value: Any) -> None:
+        """Store `value` (anything JSON-serializable) under `key`."""
+        self._write(self._slot(key), _encode(value))
+
+    def delete(self, key: str) -> bool:
+        """Remove `key`. Returns True if it existed."""
+        slot = self._slot(key)
+        if self._read(slot) is _MISSING:
+            return False
+        self._write(slot, _MISSING)
+        return True
+
+    def incr(self, key: str, amount: int | float = 1) -> int | float:
+        """Add `amount` to a numeric value (missing counts as 0) and return it."""
+        current = self.get(key, 0)
+        if isinstance(current, bool) or not isinstance(current, (int, float)):
+            raise StorageError(f"Value of '{key}' is not a number")
+        value = current + amount
+        self.set(key, value)
+        return value
+
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        """
+        Set `key` to `value` only if it currently equals `expected`.
+
+        Pass ``expected=None`` to require that the key is absent.
+
+        Returns:
+            True if the value was set
+        """
+        if self.get(key) != expected:
+            return False
+        self.set(key, value)
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        return self._read(self._slot(key)) is not _MISSING
+
+    def _slot(self, key: str) -> tuple[str, str]:
+        if not isinstance(key, str) or not key or len(key) > MAX_KEY_LENGTH:
+            raise StorageError(f"Keys must be non-empty strings of at most "
+                               f"{MAX_KEY_LENGTH} characters")
+        return self.name, key
+
+
+def _encode(value: Any) -> str:
+    try:
+        encoded = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    except (TypeError, ValueError) as e:
+        raise StorageError(f"Value is not JSON-serializable: {e}") from None
+    if len(encoded.encode()) > MAX_VALUE_BYTES:
+        raise StorageError(f"Values are limited to {MAX_VALUE_BYTES} bytes")
+    return encoded
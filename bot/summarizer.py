@@ -0,0 +1,188 @@
+"""Incremental extractive summaries of rooms and threads for !tldr.
+
+Each conversation (a room, or a thread within it) keeps running term
+frequencies and a bounded pool of candidate sentences. A sentence's score is
+the mean thread-wide frequency of its terms; an inverted index from term to
+sentences lets each new message update only the scores it affects. Answering
+a `!tldr` picks the best few sentences from the bounded pool and caches the
+result until the next message lands, so it never rescans the thread.
+"""
+from __future__ import annotations
+import heapq
+import itertools
+import logging
+import re
+from collections import Counter, OrderedDict, defaultdict
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"[a-z0-9']+")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+STOPWORDS = frozenset("""
+a about after again all also am an and any are as at be because been before
+being but by can could did do does doing don't for from had has have having
+he her here hers him his how i i'm if in into is it it's its just me more
+most my no nor not now of off on once only or other our ours out over own
+same she should so some such than that that's the their them then there
+these they this those through to too under until up very was we were what
+when where which while who whom why will with would you your yours yeah yes
+ok okay lol
+""".split())
+
+# Sentences shorter than this many terms are not summary candidates.
+MIN_SENTENCE_TERMS = 3
+
+ConversationKey = tuple[str, Optional[str]]  # (room_id, thread root or None)
+
+
+def _terms(text: str) -> list[str]:
+    return [w for w in _WORD.findall(text.lower())
+            if w not in STOPWORDS and len(w) > 1]
+
+
+class _Sentence:
+    __slots__ = ("seq", "text", "terms", "score")
+
+    def __init__(self, seq: int, text: str, terms: frozenset[str]):
+        self.seq = seq
+        self.text = text
+        self.terms = terms
+        self.score = 0.0
+
+
+class ConversationSummary:
+    """Running extractive summary for one room or thread."""
+
+    def __init__(self, max_sentences: int = 100):
+        self.max_sentences = max_sentences
+        self.term_freq: Counter[str] = Counter()
+        self.messages = 0
+        self.version = 0
+        # Whether the summary was built from the history cache (see
+        # `Summarizer.seed`) rather than only from messages seen live.
+        self.seeded = False
+        self._sentences: dict[int, _Sentence] = {}
+        self._postings: defaultdict[str, set[int]] = defaultdict(set)
+        self._seq = itertools.count()
+        self._cache: Optional[tuple[int, int, str]] = None  # (version, n, text)
+
+    def add(self, text: str) -> None:
+        """Fold a new message into the summary state."""
+        self.messages += 1
+        self.version += 1
+        for raw in _SENTENCE_SPLIT.split(text):
+            raw = raw.strip()
+            terms = _terms(raw)
+            if not terms:
+                continue
+            # Every candidate containing a term gains 1/|terms| per occurrence.
+            for term, count in Counter(terms).items():
+                self.term_freq[term] += count
+                for seq in self._postings.get(term, ()):
+                    sentence = self._sentences[seq]
+                    sentence.score += count / len(sentence.terms)
+            unique = frozenset(terms)
+            if len(unique) >= MIN_SENTENCE_TERMS:
+                self._add_sentence(raw, unique)
+
+    def _add_sentence(self, text: str, terms: frozenset[str]) -> None:
+        sentence = _Sentence(next(self._seq), text, terms)
+        sentence.score = sum(self.term_freq[t] for t in terms) / len(terms)
+        self._sentences[sentence.seq] = sentence
+        for term in terms:
+            self._postings[term].add(sentence.seq)
+        if len(self._sentences) > self.max_sentences:
+            # Drop the weakest candidate, never the one just added.
+            weakest = min((s for s in self._sentences.values() if s is not sentence),
+                          key=lambda s: s.score)
+            self._remove_sentence(weakest)
+
+    def _remove_sentence(self, sentence: _Sentence) -> None:
+        del self._sentences[sentence.seq]
+        for term in sentence.terms:
+            postings = self._postings[term]
+            postings.discard(sentence.seq)
+            if not postings:
+                del self._postings[term]
+
+    def summary(self, sentences: int = 2) -> Optional[str]:
+        """Return the top sentences in conversation order, or None if empty."""
+        if self._cache and self._cache[0] == self.version and self._cache[1] == sentences:
+            return self._cache[2]
+        best = heapq.nlargest(sentences, self._sentences.values(),
+                              key=lambda s: (s.score, s.seq))
+        text = " … ".join(s.text for s in sorted(best, key=lambda s: s.seq)) or None
+        self._cache = (self.version, sentences, text)
+        return text
+
+    def keywords(self, n: int = 5) -> list[str]:
+        return [term for term, _ in self.term_freq.most_common(n)]
+
+
+class Summarizer:
+    """Summaries for many conversations, with LRU eviction."""
+
+    def __init__(self, max_conversations: int = 1000, max_sentences: int = 100,
+                 ignore_senders: Iterable[str] = ()):
+        self.max_conversations = max_conversations
+        self.max_sentences = max_sentences
+        self.ignore_senders = set(ignore_senders)
+        self._conversations: OrderedDict[ConversationKey, ConversationSummary] = OrderedDict()
+        # Model-generated summaries: key -> (version, text)
+        self._model_cache: dict[ConversationKey, tuple[int, str]] = {}
+
+    def observe(self, room_id: str, message) -> None:
+        """History listener: fold a live message into its room and thread."""
+        if message.sender in self.ignore_senders or message.body.startswith("!"):
+            return
+        self.get(room_id, None, create=True).add(message.body)
+        if message.thread_root:
+            self.get(room_id, message.thread_root, create=True).add(message.body)
+
+    def seed(self, room_id: str, thread: Optional[str], messages) -> ConversationSummary:
+        """Build a conversation's summary from already-fetched messages.
+
+        Replaces anything observed live for the conversation, so `messages`
+        should include those (the history cache holds both).
+        """
+        conversation = ConversationSummary(self.max_sentences)
+        conversation.seeded = True
+        for message in messages:
+            if message.sender not in self.ignore_senders and not message.body.startswith("!"):
+                conversation.add(message.body)
+        self._model_cache.pop((room_id, thread), None)
+        self._store((room_id, thread), conversation)
+        return conversation
+
+    def get(self, room_id: str, thread: Optional[str] = None,
+            create: bool = False) -> Optional[ConversationSummary]:
+        key = (room_id, thread)
+        conversation = self._conversations.get(key)
+        if conversation is not None:
+            self._conversations.move_to_end(key)
+        elif create:
+            conversation = ConversationSummary(self.max_sentences)
+            self._store(key, conversation)
+        return conversation
+
+    def _store(self, key: ConversationKey, conversation: ConversationSummary) -> None:
+        self._conversations[key] = conversation
+        self._conversations.move_to_end(key)
+        while len(self._conversations) > self.max_conversations:
+            evicted, _ = self._conversations.popitem(last=False)
+            self._model_cache.pop(evicted, None)
+
+    def cached_model_summary(self, room_id: str, thread: Optional[str]) -> Optional[str]:
+        """Return a model summary if no messages have landed since it was made."""
+        conversation = self._conversations.get((room_id, thread))
+        cached = self._model_cache.get((room_id, thread))
+        if conversation is None or cached is None or cached[0] != conversation.version:
+            return None
+        return cached[1]
+
+    def store_model_summary(self, room_id: str, thread: Optional[str], text: str) -> None:
+        conversation = self._conversations.get((room_id, thread))
+        if conversation is not None:
+            self._model_cache[(room_id, thread)] = (conversation.version, text)
@@ -0,0 +1,239 @@
+"""Sync supervisor: drives the /sync long-poll with backoff and a watchdog."""
+from __future__ import annotations
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Optional
+
+from aiohttp import ClientError
+from nio import AsyncClient, SyncError
+
+logger = logging.getLogger(__name__)
+
+AUTH_ERRCODES = {"M_UNKNOWN_TOKEN", "M_MISSING_TOKEN", "M_FORBIDDEN"}
+RATE_LIMIT_ERRCODES = {"M_LIMIT_EXCEEDED", 429}
+
+# Consecutive successful syncs before the long-poll timeout is grown again.
+TIMEOUT_GROWTH_STREAK = 3
+
+
+class SyncHealth(str, Enum):
+    """Externally visible state of the sync loop."""
+    STARTING = "starting"
+    HEALTHY = "healthy"
+    DEGRADED = "degraded"  # Recent failures, retrying with backoff
+    RATE_LIMITED = "rate_limited"
+    UNAUTHORIZED = "unauthorized"  # Token rejected; retrying at the cap
+    STOPPED = "stopped"
+
+
+class SyncErrorKind(str, Enum):
+    """Classification of a failed sync attempt."""
+    AUTH = "auth"
+    RATE_LIMIT = "rate_limit"
+    NETWORK = "network"
+    SERVER = "server"
+    STALLED = "stalled"  # Watchdog fired: no response within the deadline
+    UNKNOWN = "unknown"
+
+
+def classify_error(error) -> tuple[SyncErrorKind, Optional[float]]:
+    """
+    Classify a sync failure.
+
+    Args:
+        error: A `SyncError` response or an exception raised by the sync call
+
+    Returns:
+        tuple: (kind, retry_after)
+               - kind: The SyncErrorKind of the failure
+               - retry_after: Server-requested delay in seconds, if any
+    """
+    if isinstance(error, SyncError):
+        status = getattr(getattr(error, "transport_response", None), "status", None)
+        retry_after = error.retry_after_ms / 1000 if error.retry_after_ms else None
+        if error.status_code in AUTH_ERRCODES or status in (401, 403):
+            return SyncErrorKind.AUTH, None
+        if error.status_code in RATE_LIMIT_ERRCODES or status == 429:
+            return SyncErrorKind.RATE_LIMIT, retry_after
+        return SyncErrorKind.SERVER, retry_after
+    if isinstance(error, asyncio.TimeoutError):
+        return SyncErrorKind.STALLED, None
+    if isinstance(error, (ClientError, OSError)):
+        return SyncErrorKind.NETWORK, None
+    return SyncErrorKind.UNKNOWN, None
+
+
+@dataclass
+class Backoff:
+    """Capped exponential backoff with jitter.
+
+    Each delay is drawn uniformly between `base` and the current exponential
+    ceiling, so clients that failed together do not retry together.
+    """
+    base: float = 1.0
+    cap: float = 60.0
+    factor: float = 2.0
+    attempts: int = 0
+    rng: random.Random = field(default_factory=random.Random, repr=False)
+
+    def next_delay(self) -> float:
+        """Return the next delay in seconds and advance the attempt counter."""
+        ceiling = min(self.cap, self.base * self.factor ** self.attempts)
+        self.attempts += 1
+        return self.rng.uniform(min(self.base, ceiling), ceiling)
+
+    def reset(self) -> None:
+        self.attempts = 0
+
+
+class SyncSupervisor:
+    """Runs `client.sync` until stopped, recovering from failures.
+
+    - Failures are classified (auth, rate limit, network, server, stalled)
+      and retried with capped, jittered exponential backoff. Rate limits
+      honour the server's ``retry_after_ms`` when given.
+    - Every attempt runs under a watchdog deadline of the long-poll timeout
+      plus a grace period; a sync that has not returned by then is cancelled
+      and restarted.
+    - The long-poll timeout adapts: network failures and stalls halve it
+      (down to `min_timeout_ms`), a streak of successes grows it back.
+    """
+
+    def __init__(self, client: AsyncClient, stop: asyncio.Event,
+                 timeout_ms: int = 30000, min_timeout_ms: int = 5000,
+                 backoff_cap: float = 60.0, stall_grace: float = 30.0,
+                 backoff: Optional[Backoff] = None):
+        self.client = client
+        self.stop = stop
+        self.max_timeout_ms = timeout_ms
+        self.min_timeout_ms = min(min_timeout_ms, timeout_ms)
+        self.timeout_ms = timeout_ms
+        self.stall_grace = stall_grace
+        self.backoff = backoff or Backoff(cap=backoff_cap)
+        self.health = SyncHealth.STARTING
+        self.last_success: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+        self._success_streak = 0
+
+    def status(self) -> dict:
+        """Return a snapshot of the sync loop's health."""
+        return {
+            "health": self.health.value,
+            "timeout_ms": self.timeout_ms,
+            "consecutive_failures": self.consecutive_failures,
+            "last_success": self.last_success,
+            "last_error": self.last_error,
+        }
+
+    def _set_health(self, health: SyncHealth) -> None:
+        if health is self.health:
+            return
+        level = logging.INFO if health is SyncHealth.HEALTHY else logging.WARNING
+        logger.log(level, "Sync health: %s -> %s", self.health.value, health.value)
+        self.health = health
+
+    async def sync_once(self) -> None:
+        """Run a single supervised sync attempt, raising or returning the error."""
+        deadline = self.timeout_ms / 1000 + self.stall_grace
+        resp = await asyncio.wait_for(self.client.sync(timeout=self.timeout_ms), deadline)
+        if isinstance(resp, SyncError):
+            raise _SyncFailed(resp)
+
+    async def run(self) -> None:
+        """Sync until the stop event is set."""
+        while not self.stop.is_set():
+            try:
+                if not await self._sync_unless_stopped():
+                    break
+            except asyncio.CancelledError:
+                raise
+            except _SyncFailed as e:
+                delay = self._on_failure(e.response)
+            except Exception as e:
+                delay = self._on_failure(e)
+            else:
+                self._on_success()
+                continue
+            await self._sleep(delay)
+        self._set_health(SyncHealth.STOPPED)
+
+    async def _sync_unless_stopped(self) -> bool:
+        """
+        Run `sync_once`, abandoning it if stop is set first.
+
+        An abandoned long-poll has not advanced the sync token, so nothing
+        is lost. Returns False if the sync was abandoned.
+        """
+        sync = asyncio.ensure_future(self.sync_once())
+        stopped = asyncio.ensure_future(self.stop.wait())
+        try:
+            done, _ = await asyncio.wait({sync, stopped},
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopped.cancel()
+            if not sync.done():
+                sync.cancel()
+        if sync not in done:
+            await asyncio.gather(sync, return_exceptions=True)
+            return False
+        sync.result()
+        return True
+
+    def _on_success(self) -> None:
+        self.last_success = time.time()
+        self.consecutive_failures = 0
+        self.backoff.reset()
+        self._success_streak += 1
+        if (self._success_streak >= TIMEOUT_GROWTH_STREAK
+                and self.timeout_ms < self.max_timeout_ms):
+            self.timeout_ms = min(self.max_timeout_ms, int(self.timeout_ms * 1.5))
+            self._success_streak = 0
+        self._set_health(SyncHealth.HEALTHY)
+
+    def _on_failure(self, error) -> float:
+        """Record a failure and return how long to wait before retrying."""
+        kind, retry_after = classify_error(error)
+        self.consecutive_failures += 1
+        self._success_streak = 0
+        detail = repr(error) if isinstance(error, Exception) else str(error)
+        self.last_error = f"{kind.value}: {detail}"
+
+        if kind in (SyncErrorKind.NETWORK, SyncErrorKind.STALLED):
+            self.timeout_ms = max(self.min_timeout_ms, self.timeout_ms // 2)
+
+        delay = self.backoff.next_delay()
+        if kind is SyncErrorKind.AUTH:
+            # Retrying quickly will not fix a revoked token.
+            delay = self.backoff.cap
+            self._set_health(SyncHealth.UNAUTHORIZED)
+        elif kind is SyncErrorKind.RATE_LIMIT:
+            delay = max(delay, retry_after or 0)
+            self._set_health(SyncHealth.RATE_LIMITED)
+        else:
+            if retry_after:
+                delay = max(delay, retry_after)
+            self._set_health(SyncHealth.DEGRADED)
+
+        logger.warning("Sync failed (%s, attempt %d); retrying in %.1fs",
+                       self.last_error, self.consecutive_failures, delay)
+        return delay
+
+    async def _sleep(self, delay: float) -> None:
+        """Sleep for `delay` seconds, waking early if stop is requested."""
+        try:
+            await asyncio.wait_for(self.stop.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+class _SyncFailed(Exception):
+    """Internal carrier for a SyncError response."""
+
+    def __init__(self, response: SyncError):
+        super().__init__(str(response))
+        self.response = response
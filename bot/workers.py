@@ -0,0 +1,370 @@
+"""Worker processes for running commands on more than one core.
+
+With ``worker_processes = N`` the main process keeps the sync loops, policy
+and rate-limit checks, the dispatcher and all outbound sends, and hands the
+execution of commands declared with ``@command(offload=True)`` to N worker
+processes. Each worker imports the command modules itself and runs
+handlers on its own event loop, so CPU-heavy handlers no longer compete
+with sync parsing for one core.
+
+The processes talk over a socketpair with one small JSON object per line
+(see `bot.reload.HandoffChannel`). The main process sends
+``{"id", "room", "sender", "body", "command", "event", "thread", "ts"}``,
+naming the command it already matched so the worker only checks that
+command's pattern. The worker reports ``{"id", "type": "start"}`` once the
+call is running, then answers ``{"id", "type": "done", "body", "html"}``,
+or for a streaming handler ``{"type": "stream"}``, any number of
+``{"type": "piece", "text"}`` and then ``{"type": "done"}``.
+
+- **Per-room ordering**: a room always goes to the same worker (hashed by
+  room ID), and each worker runs one room's commands one at a time in
+  arrival order, so replies in a room come back in the order asked.
+- **Backpressure**: a worker accepts at most `max_pending` calls; past that
+  `execute` raises `DispatcherBusy` and the user gets the busy reply.
+- **Supervision**: a worker that exits is restarted with capped, jittered
+  backoff. Calls it had not answered get an error reply rather than
+  hanging. A running call that sends nothing for `call_timeout` seconds
+  (a handler spinning or stuck) gets its worker killed, which restarts it
+  the same way.
+
+Offloaded handlers get a `CommandContext` whose ``services`` only carries
+the config: history, storage and the Matrix client live in the main
+process, so commands that use them stay in-process (the default).
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import logging
+import os
+import re
+import signal
+import socket
+import sys
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Optional
+
+from .commands import Command, Reply
+from .dispatcher import DispatcherBusy
+from .reload import READY_TIMEOUT, HandoffChannel
+from .sync import Backoff
+
+logger = logging.getLogger(__name__)
+
+# Environment variable telling a worker which fd is its channel.
+WORKER_FD_ENV = "BOT_WORKER_FD"
+# A worker that stayed up this long has its restart backoff reset.
+HEALTHY_UPTIME = 60.0
+# Longest message on the channel; replies are far smaller than this.
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+ERROR_REPLY = "Error executing command. Check logs for details."
+
+# How workers are started: ``sys.executable`` followed by these arguments.
+WORKER_ARGS = ("-m", "bot.workers")
+
+
+@dataclass
+class _Call:
+    future: asyncio.Future
+    pieces: Optional[asyncio.Queue] = None  # Set once the reply turns out to stream
+    deadline: Optional[asyncio.TimerHandle] = None  # Armed while the call runs
+
+
+@dataclass
+class _Worker:
+    index: int
+    process: Optional[asyncio.subprocess.Process] = None
+    channel: Optional[HandoffChannel] = None
+    calls: dict[int, _Call] = field(default_factory=dict)
+    started: float = 0.0
+    restarts: int = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.channel is not None
+
+
+class WorkerPool:
+    """Runs offloaded commands in worker processes, sticky by room."""
+
+    def __init__(self, size: int, max_pending: int = 100, call_timeout: float = 60.0,
+                 restart_backoff_cap: float = 30.0):
+        if size < 1:
+            raise ValueError("A worker pool needs at least one worker")
+        self.size = size
+        self.max_pending = max_pending
+        self.call_timeout = call_timeout
+        self.restart_backoff_cap = restart_backoff_cap
+        self._workers = [_Worker(i) for i in range(size)]
+        self._ids = itertools.count()
+        self._supervisors: list[asyncio.Task] = []
+        self._closing = False
+
+    async def start(self) -> None:
+        """Start the workers and wait (up to READY_TIMEOUT) for them to be ready."""
+        started = [asyncio.get_running_loop().create_future() for _ in self._workers]
+        self._supervisors = [asyncio.create_task(self._supervise(worker, ready))
+                             for worker, ready in zip(self._workers, started)]
+        await asyncio.wait(started, timeout=READY_TIMEOUT)
+        logger.info("%d of %d command workers ready",
+                    sum(w.ready for w in self._workers), self.size)
+
+    def worker_for(self, room_id: Optional[str]) -> int:
+        """Index of the worker that runs `room_id`'s commands."""
+        return zlib.crc32((room_id or "").encode()) % self.size
+
+    async def execute(self, body: str, found: Optional[tuple[Command, re.Match]] = None,
+                      **context: Any) -> Optional[str | Reply | AsyncIterator[str]]:
+        """
+        Run the command matching `body` in the room's worker.
+
+        Takes the same arguments as `CommandRegistry.execute` (found,
+        room_id, sender, event_id, thread_root, server_timestamp); others,
+        such as services, stay in this process.
+
+        Raises:
+            DispatcherBusy: If the worker is restarting or has too many calls
+        """
+        worker = self._workers[self.worker_for(context.get("room_id"))]
+        if not worker.ready:
+            raise DispatcherBusy(f"Command worker {worker.index} is restarting")
+        if len(worker.calls) >= self.max_pending:
+            raise DispatcherBusy(f"Command worker {worker.index} has too many calls")
+        call_id = next(self._ids)
+        call = worker.calls[call_id] = _Call(asyncio.get_running_loop().create_future())
+        try:
+            await worker.channel.send({
+                "id": call_id, "room": context.get("room_id"), "sender": context.get("sender"),
+                "body": body, "command": found[0].name if found else None,
+                "event": context.get("event_id"),
+                "thread": context.get("thread_root"), "ts": context.get("server_timestamp")})
+        except (OSError, ConnectionError):
+            worker.calls.pop(call_id, None)
+            raise DispatcherBusy(f"Command worker {worker.index} is restarting") from None
+        return await call.future
+
+    def snapshot(self) -> dict[str, Any]:
+        """Pending calls and restarts per worker."""
+        return {f"worker{w.index}": {"pending": len(w.calls), "restarts": w.restarts,
+                                     "ready": w.ready} for w in self._workers}
+
+    async def close(self) -> None:
+        """Stop the workers; they answer the calls they were sent first."""
+        self._closing = True
+        for worker in self._workers:
+            if worker.channel is not None:
+                await worker.channel.end()  # EOF tells the worker to exit
+        for task in self._supervisors:
+            try:
+                await asyncio.wait_for(asyncio.shield(task), 5.0)
+            except asyncio.TimeoutError:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    # -- supervision -------------------------------------------------------
+
+    async def _supervise(self, worker: _Worker, ready: asyncio.Future) -> None:
+        backoff = Backoff(cap=self.restart_backoff_cap)
+        try:
+            while not self._closing:
+                await self._run_worker(worker, ready)
+                if self._closing:
+                    break
+                if time.monotonic() - worker.started >= HEALTHY_UPTIME:
+                    backoff.reset()
+                worker.restarts += 1
+                delay = backoff.next_delay()
+                logger.warning("Command worker %d exited; restarting in %.1fs",
+                               worker.index, delay)
+                await asyncio.sleep(delay)
+        finally:
+            if worker.process is not None and worker.process.returncode is None:
+                worker.process.kill()
+                await worker.process.wait()
+            if not ready.done():
+                ready.set_result(None)
+
+    async def _run_worker(self, worker: _Worker, ready: asyncio.Future) -> None:
+        ours, theirs = socket.socketpair()
+        env = dict(os.environ, **{WORKER_FD_ENV: str(theirs.fileno())})
+        try:
+            worker.process = await asyncio.create_subprocess_exec(
+                sys.executable, *WORKER_ARGS, env=env, pass_fds=(theirs.fileno(),))
+        except OSError:
+            logger.exception("Could not start command worker %d", worker.index)
+            ours.close()
+            return
+        finally:
+            theirs.close()
+        worker.started = time.monotonic()
+        channel = await HandoffChannel.open(ours, MAX_MESSAGE_BYTES)
+        try:
+            message = await channel.receive(READY_TIMEOUT)
+            if not message or message.get("type") != "ready":
+                logger.error("Command worker %d did not become ready", worker.index)
+                return
+            worker.channel = channel
+            if not ready.done():
+                ready.set_result(None)
+            while (message := await channel.receive(None)) is not None:
+                self._deliver(worker, message)
+        except (asyncio.TimeoutError, ValueError, OSError, ConnectionError):
+            logger.exception("Lost contact with command worker %d", worker.index)
+        finally:
+            worker.channel = None
+            await channel.close()
+            self._fail_calls(worker)
+            if worker.process.returncode is None:
+                try:
+                    await asyncio.wait_for(worker.process.wait(), 5.0)
+                except asyncio.TimeoutError:
+                    worker.process.kill()
+                    await worker.process.wait()
+
+    def _deliver(self, worker: _Worker, message: dict[str, Any]) -> None:
+        call_id = message.get("id")
+        call = worker.calls.get(call_id)
+        if call is None:
+            return
+        kind = message.get("type")
+        if call.deadline is not None:
+            call.deadline.cancel()
+        if kind != "done":  # Any progress pushes the deadline back
+            call.deadline = asyncio.get_running_loop().call_later(
+                self.call_timeout, self._expire, worker, call_id)
+        if kind == "stream":
+            call.pieces = asyncio.Queue()
+            call.future.set_result(_drain(call.pieces))
+        elif kind == "piece" and call.pieces is not None:
+            call.pieces.put_nowait(message.get("text", ""))
+        elif kind == "done":
+            del worker.calls[message["id"]]
+            if call.pieces is not None:
+                call.pieces.put_nowait(None)
+            elif not call.future.done():
+                body = message.get("body")
+                html = message.get("html")
+                call.future.set_result(Reply(body, html) if html else body)
+
+    def _expire(self, worker: _Worker, call_id: int) -> None:
+        process = worker.process
+        if call_id not in worker.calls or process is None or process.returncode is not None:
+            return
+        logger.error("Command worker %d made no progress on call %d for %.0fs; restarting it",
+                     worker.index, call_id, self.call_timeout)
+        process.kill()  # The channel closes, failing its calls; _supervise restarts it
+
+    def _fail_calls(self, worker: _Worker) -> None:
+        if worker.calls:
+            logger.error("Command worker %d lost %d calls", worker.index, len(worker.calls))
+        for call in worker.calls.values():
+            if call.deadline is not None:
+                call.deadline.cancel()
+            if call.pieces is not None:
+                call.pieces.put_nowait(f"\n\n{ERROR_REPLY}")
+                call.pieces.put_nowait(None)
+            elif not call.future.done():
+                call.future.set_result(ERROR_REPLY)
+        worker.calls.clear()
+
+
+async def _drain(pieces: asyncio.Queue) -> AsyncIterator[str]:
+    """Yield streamed pieces until the end marker."""
+    while (piece := await pieces.get()) is not None:
+        yield piece
+
+
+# -- worker process --------------------------------------------------------
+
+async def serve(channel: HandoffChannel) -> None:
+    """Worker side: run commands sent over `channel` until it closes."""
+    from .commands import execute_command, get_registry
+    from .services import get_services
+
+    # Room -> [lock, calls holding or waiting for it]; asyncio.Lock is FIFO
+    rooms: dict[Optional[str], list] = {}
+    running: set[asyncio.Task] = set()
+
+    async def run(message: dict[str, Any]) -> None:
+        room_id = message.get("room")
+        entry = rooms.get(room_id)
+        if entry is None:
+            entry = rooms[room_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:  # One command at a time per room, in arrival order
+                await channel.send({"id": message["id"], "type": "start"})
+                name = message.get("command")
+                found = get_registry().resolve(name, message["body"]) if name else None
+                await _answer(channel, message, await execute_command(
+                    message["body"], found, room_id=room_id, sender=message.get("sender"),
+                    event_id=message.get("event"), thread_root=message.get("thread"),
+                    server_timestamp=message.get("ts"), services=get_services()))
+        except Exception:
+            logger.exception("Worker failed to answer call %s", message.get("id"))
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del rooms[room_id]
+
+    await channel.send({"type": "ready"})
+    while (message := await channel.receive(None)) is not None:
+        task = asyncio.create_task(run(message))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    await asyncio.gather(*running, return_exceptions=True)
+    await channel.close()
+
+
+async def _answer(channel: HandoffChannel, message: dict[str, Any],
+                  reply: Optional[str | Reply | AsyncIterator[str]]) -> None:
+    call_id = message["id"]
+    if reply is None or isinstance(reply, (str, Reply)):
+        if isinstance(reply, Reply):
+            body, html = reply.body, reply.formatted_body
+        else:
+            body, html = reply, None
+        await channel.send({"id": call_id, "type": "done", "body": body, "html": html})
+        return
+    await channel.send({"id": call_id, "type": "stream"})
+    try:
+        async for piece in reply:
+            await channel.send({"id": call_id, "type": "piece", "text": piece})
+    finally:
+        await channel.send({"id": call_id, "type": "done"})
+
+
+def worker_main() -> None:
+    """Entry point of a worker process (``python -m bot.workers``)."""
+    from .config import ConfigService, set_config_service
+    from .logging_setup import setup_logging, shutdown_logging
+    from .services import set_services
+
+    fd = os.environ.pop(WORKER_FD_ENV, None)
+    if fd is None:
+        raise SystemExit(f"{WORKER_FD_ENV} is not set; workers are started by the bot")
+    # The bot stops its workers itself (by closing the channel) once their
+    # calls are done; a signal to the whole process group must not cut them off.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    config_service = ConfigService()
+    set_config_service(config_service)
+    cfg = config_service.current
+    setup_logging(level=cfg.log_level, fmt=cfg.log_format,
+                  log_bodies=cfg.log_message_bodies, sampling=cfg.log_sampling)
+    set_services(config=cfg)
+
+    async def main() -> None:
+        await serve(await HandoffChannel.open(socket.socket(fileno=int(fd)),
+                                              MAX_MESSAGE_BYTES))
+
+    try:
+        asyncio.run(main())
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    worker_main()
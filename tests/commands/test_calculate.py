@@ -174,4 +174,50 @@ async def test_calculate_invalid_pattern():
 async def test_calculate_large_numbers():
     from . import calculate_handler
     result = await calculate_handler("!calculate 1000000+2000000")
-    assert result == "1000000+2000000 = 3000000.0"
\ No newline at end of file
+    assert result == "1000000+2000000 = 3000000.0"
+
+@pytest.mark.asyncio
+async def test_calculate_parentheses_and_powers():
+    from bot.commands.calculate import calculate_handler
+    assert await calculate_handler("!calculate (1+2)*3") == "(1+2)*3 = 9.0"
+    assert await calculate_handler("!calculate 2^3^2") == "2^3^2 = 512.0"
+    assert await calculate_handler("!calculate -2^2") == "-2^2 = -4.0"
+    assert await calculate_handler("!calculate 2*-3") == "2*-3 = -6.0"
+
+
+@pytest.mark.asyncio
+async def test_calculate_exact_modes():
+    from bot.commands.calculate import calculate_handler
+    assert await calculate_handler("!calculate --fraction 1/3+1/6") == "1/3+1/6 = 1/2"
+    assert await calculate_handler("!calculate --decimal 0.1+0.2") == "0.1+0.2 = 0.3"
+
+
+@pytest.mark.asyncio
+async def test_calculate_limits():
+    from bot.commands.calculate import calculate_handler
+    assert await calculate_handler("!calculate 10^1000") == "Error: Result too large"
+    assert "too long" in await calculate_handler("!calculate " + "1+" * 150 + "1")
+    assert "nested too deeply" in await calculate_handler("!calculate " + "(" * 30 + "1" + ")" * 30)
+    assert (await calculate_handler("!calculate (1+2")).startswith("Error:")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("expression, error", [
+    ("--fraction (1/3)^(10^10)", "Exponent too large (max 10000)"),
+    ("--fraction (1/2)^(10^8)", "Exponent too large (max 10000)"),
+    ("--fraction (1/2)^5000", "Result too small"),
+    ("--decimal 0.5^9999", "Result too small"),
+    ("--fraction (1/3)^900*(1/7)^900", "Result too large"),
+    ("0.5^(10^10)", "Exponent too large (max 10000)"),
+])
+async def test_calculate_bounds_exact_results(expression, error):
+    from bot.commands.calculate import calculate_handler
+    assert await calculate_handler(f"!calculate {expression}") == f"Error: {error}"
+
+
+def test_compiled_expressions_are_cached():
+    from bot.commands.calculate import compile_expression, evaluate
+    compile_expression.cache_clear()
+    evaluate("6*7")
+    evaluate("6*7", "fraction")
+    assert compile_expression.cache_info().hits == 1
@@ -153,7 +153,7 @@ async def test_reactmoji_party_to_neutral():
 async def test_reactmoji_multiple_emojis():
     from reactmoji import reactmoji_handler
     result = await reactmoji_handler("!reactmoji 😇😈")
-    assert result == "I don't know the opposite of 😇😈 yet! 🤷"
+    assert result == "😈😇"
 
 
 @pytest.mark.asyncio
@@ -174,4 +174,25 @@ async def test_reactmoji_cold_to_hot():
 async def test_reactmoji_hot_to_cold():
     from reactmoji import reactmoji_handler
     result = await reactmoji_handler("!reactmoji 🥵")
-    assert result == "🥶"
\ No newline at end of file
+    assert result == "🥶"
+
+
+@pytest.mark.asyncio
+async def test_reactmoji_folds_variation_selectors_and_skin_tones():
+    from bot.commands.reactmoji import reactmoji_handler
+    assert await reactmoji_handler("!reactmoji \u2600") == "🌙"
+    assert await reactmoji_handler("!reactmoji 👍🏽") == "👎"
+
+
+@pytest.mark.asyncio
+async def test_reactmoji_maps_each_emoji_and_keeps_spacing():
+    from bot.commands.reactmoji import reactmoji_handler
+    assert await reactmoji_handler("!reactmoji 🔥 😇🚀") == "💧 😈⚓"
+    assert await reactmoji_handler("!reactmoji 🔥🦄") == "I don't know the opposite of 🔥🦄 yet! 🤷"
+
+
+def test_graphemes_keep_sequences_together():
+    from bot.commands.reactmoji import graphemes
+    family = "👨\u200d👩\u200d👧"
+    assert list(graphemes(family + "🇫🇷🇩🇪1\ufe0f\u20e3👍🏽")) == [
+        family, "🇫🇷", "🇩🇪", "1\ufe0f\u20e3", "👍🏽"]
@@ -0,0 +1,42 @@
+import pytest
+from types import SimpleNamespace
+
+from bot.commands import CommandContext, ScheduleContext
+from bot.commands.remind import remind_handler, remind_task
+from bot.scheduler import Scheduler
+
+
+async def _noop(_):
+    pass
+
+
+def _ctx(args, scheduler):
+    return CommandContext(body=f"!remind {args}", command="remind", args=args,
+                          room_id="!r:x", sender="@alice:x",
+                          services=SimpleNamespace(scheduler=scheduler))
+
+
+@pytest.mark.asyncio
+async def test_remind_schedules_a_job():
+    scheduler = Scheduler(_noop)
+    result = await remind_handler("!remind in 10m stretch", _ctx("in 10m stretch", scheduler))
+    assert result == "OK, I'll remind you in 10m."
+    [job] = scheduler.jobs()
+    assert (job.task, job.room_id, job.every) == ("remind", "!r:x", None)
+    assert job.payload == {"sender": "@alice:x", "text": "stretch"}
+
+
+@pytest.mark.asyncio
+async def test_remind_rejects_bad_input():
+    scheduler = Scheduler(_noop)
+    assert (await remind_handler("!remind", _ctx("", scheduler))).startswith("Usage")
+    assert "Invalid interval" in await remind_handler("!remind in soon x", _ctx("in soon x", scheduler))
+    assert "a year" in await remind_handler("!remind in 400d x", _ctx("in 400d x", scheduler))
+    assert len(scheduler) == 0
+
+
+@pytest.mark.asyncio
+async def test_remind_task_posts_the_reminder():
+    ctx = ScheduleContext(task="remind", job_id="j", room_id="!r:x", scheduled_for=0.0,
+                          payload={"sender": "@alice:x", "text": "stretch"})
+    assert await remind_task(ctx) == "@alice:x: reminder: stretch"
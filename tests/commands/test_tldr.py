@@ -106,4 +106,57 @@ async def test_tldr_never_returns_empty_string():
     for _ in range(10):
         result = await tldr_handler("!tldr")
         assert result != ""
-        assert len(result) > 0
\ No newline at end of file
+        assert len(result) > 0
+
+@pytest.mark.asyncio
+async def test_tldr_summarizes_observed_thread():
+    """With a summarizer available, tldr summarizes the thread's messages."""
+    from bot.commands import CommandContext
+    from bot.history import HistoryMessage
+    from bot.services import Services
+    from bot.summarizer import Summarizer
+
+    summarizer = Summarizer()
+    for body in ["The flaky login test fails on CI again.",
+                 "Login test flakiness comes from a CI timeout.",
+                 "Raising the CI timeout fixed the login test."]:
+        summarizer.observe("!r", HistoryMessage("$e", "@u:x", body, 0, "$root"))
+
+    ctx = CommandContext(body="!tldr", command="tldr", args="", room_id="!r",
+                         thread_root="$root",
+                         services=Services(summarizer=summarizer))
+    result = await tldr_handler("!tldr", ctx)
+    assert result.startswith("TL;DR (3 messages):")
+    assert "login test" in result.lower()
+
+
+@pytest.mark.asyncio
+async def test_tldr_seeds_from_history_after_live_messages():
+    """Live messages seen after a restart don't stop the history seed."""
+    from bot.commands import CommandContext
+    from bot.history import HistoryMessage
+    from bot.services import Services
+    from bot.summarizer import Summarizer
+
+    older = [HistoryMessage(f"$old{i}", "@u:x", f"Deploy number {i} broke staging again.", i)
+             for i in range(3)]
+    live = [HistoryMessage("$live", "@u:x", "Staging deploy rollback worked fine.", 10)]
+
+    class FakeHistory:
+        fetches = 0
+
+        async def fetch(self, room_id, limit, client=None, thread=None):
+            self.fetches += 1
+            return older + live
+
+    summarizer = Summarizer()
+    for message in live:
+        summarizer.observe("!r", message)
+    history = FakeHistory()
+    ctx = CommandContext(body="!tldr", command="tldr", args="", room_id="!r",
+                         services=Services(summarizer=summarizer, history=history))
+
+    assert (await tldr_handler("!tldr", ctx)).startswith("TL;DR (4 messages):")
+    summarizer.observe("!r", HistoryMessage("$next", "@u:x", "Staging is green now.", 11))
+    assert (await tldr_handler("!tldr", ctx)).startswith("TL;DR (5 messages):")
+    assert history.fetches == 1
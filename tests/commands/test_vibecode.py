@@ -255,4 +255,34 @@ async def test_vibecode_write_csv():
 @pytest.mark.asyncio
 async def test_vibecode_default_response():
     """Test vibecode with unrecognized description."""
-    from vibecode import vibecode
\ No newline at end of file
+    from vibecode import vibecode
+
+def test_vibecode_automaton_reports_overlapping_phrases():
+    from bot.commands.vibecode import _Automaton
+    automaton = _Automaton([("he",), ("she",), ("he", "said"), ("said", "so")])
+    assert sorted(automaton.matches(["she", "said", "so"])) == [("said", "so"), ("she",)]
+    assert sorted(automaton.matches(["he", "said", "so"])) == [
+        ("he",), ("he", "said"), ("said", "so")]
+
+
+@pytest.mark.asyncio
+async def test_vibecode_specific_phrases_outweigh_generic_words():
+    from bot.commands.vibecode import vibecode_handler
+    assert "datetime.now()" in await vibecode_handler("!vibecode get current time")
+    assert "os.getenv" in await vibecode_handler("!vibecode get environment variable")
+
+
+@pytest.mark.asyncio
+async def test_vibecode_fuzzy_fallback_fixes_typos():
+    from bot.commands.vibecode import vibecode_handler
+    assert "sqlite3" in await vibecode_handler("!vibecode query an sqlte databse")
+    assert "pass  # Replace" in await vibecode_handler("!vibecode i know nothing")
+
+
+@pytest.mark.asyncio
+async def test_vibecode_top_k_lists_ranked_snippets():
+    from bot.commands.vibecode import INDEX, vibecode_handler
+    result = await vibecode_handler("!vibecode --top 2 write csv file")
+    assert result.startswith("1. Write a CSV file\n")
+    assert "\n\n2. " in result
+    assert [s.name for s in INDEX.search("write csv file", k=2)] == ["write_csv", "read_csv"]
@@ -22,3 +22,14 @@ def bot_config():
         allowed_rooms=["!test:example.com"],
         enable_auto_commit=False
     )
+
+
+@pytest.fixture
+def outbound_state():
+    """The outbound stage's module state, reset after the test."""
+    from bot import outbound
+
+    yield outbound
+    outbound._cut_off.clear()
+    outbound._in_flight.clear()
+    outbound.set_journal(None)
@@ -0,0 +1,36 @@
+"""Tests for optional runtime accelerations."""
+import pytest
+
+from bot.accel import STDLIB_JSON, get_json_codec, get_loop_factory
+from bot.client import PooledAsyncClient
+
+
+class FakeResponse:
+    def __init__(self, raw: bytes):
+        self.raw = raw
+
+    async def read(self) -> bytes:
+        return self.raw
+
+
+def test_json_codec_resolution():
+    """Codecs resolve by name and fall back to stdlib."""
+    assert get_json_codec("stdlib") is STDLIB_JSON
+    assert get_json_codec("auto").loads(b'{"a": 1}') == {"a": 1}
+    with pytest.raises(ValueError):
+        get_json_codec("simdjson-turbo")
+
+
+def test_loop_factory_disabled():
+    """Disabling uvloop selects asyncio's default loop."""
+    assert get_loop_factory(False) == (None, "asyncio")
+
+
+@pytest.mark.asyncio
+async def test_parse_body_uses_codec():
+    """Response bodies are decoded from bytes; junk yields an empty dict."""
+    client = PooledAsyncClient("https://example.com", "@bot:example.com",
+                               json_codec=get_json_codec("auto"))
+    assert await client.parse_body(FakeResponse(b'{"next_batch": "s1"}')) == {"next_batch": "s1"}
+    assert await client.parse_body(FakeResponse(b"<html>")) == {}
+    assert await client.parse_body(FakeResponse(b"")) == {}
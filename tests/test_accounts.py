@@ -0,0 +1,152 @@
+"""Tests for serving several accounts from one process."""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from nio import RoomMessageText
+
+from bot import handlers
+from bot.accounts import Account, AccountConfig, AccountPool, FairSendGate, account_configs
+from bot.commands import get_registry
+from bot.config import BotConfig
+from bot.dedup import SeenEvents
+from bot.services import get_services
+
+
+def test_account_configs_put_the_primary_first(monkeypatch):
+    config = BotConfig(homeserver="https://example.org", user_id="@bot:example.org",
+                       accounts=[{"user_id": "@helper:example.org",
+                                  "token_env": "HELPER_TOKEN"}])
+    primary, helper = account_configs(config)
+    assert primary.user_id == "@bot:example.org"
+    assert primary.token_env == "MATRIX_ACCESS_TOKEN"
+    assert (helper.homeserver, helper.device_id) == ("https://example.org", "DEV1")
+
+    monkeypatch.setenv("HELPER_TOKEN", "secret")
+    assert helper.access_token == "secret"
+    monkeypatch.delenv("HELPER_TOKEN")
+    with pytest.raises(RuntimeError, match="HELPER_TOKEN"):
+        helper.access_token
+
+
+@pytest.mark.parametrize("entry", [
+    {"token_env": "T"},
+    {"user_id": "@helper:example.org"},
+    {"user_id": "@helper:example.org", "token_env": "T", "password": "x"},
+    {"user_id": "@bot:example.org", "token_env": "T"},  # Same as the primary
+])
+def test_invalid_accounts_are_rejected(entry):
+    config = BotConfig(homeserver="https://example.org", user_id="@bot:example.org",
+                       accounts=[entry])
+    with pytest.raises(ValueError):
+        account_configs(config)
+
+
+def fake_account(user_id, rooms=(), next_batch=None):
+    sync = SimpleNamespace(rooms={room: object() for room in rooms}, next_batch=next_batch)
+    return Account(AccountConfig(user_id=user_id, homeserver="https://x"),
+                   SimpleNamespace(sync=sync))
+
+
+def test_pool_routes_by_account_and_room():
+    pool = AccountPool([fake_account("@a:x", ["!shared:x"], "s1"),
+                        fake_account("@b:x", ["!shared:x", "!b:x"])])
+    assert pool.get("@b:x").user_id == "@b:x"
+    assert pool.get(None) is pool.get("@gone:x") is pool.primary
+    assert pool.for_room("!shared:x").user_id == "@a:x"
+    assert pool.for_room("!b:x").user_id == "@b:x"
+
+    pool.restore_next_batches({"@b:x": "s9", "@gone:x": "s0"})
+    assert pool.next_batches() == {"@a:x": "s1", "@b:x": "s9"}
+    pool.restore_next_batches("s2")  # A single-account predecessor
+    assert pool.primary.clients.sync.next_batch == "s2"
+    assert pool.sync_delays(30000) == [0.0, 2.5]
+
+
+@pytest.mark.asyncio
+async def test_send_gate_serves_accounts_round_robin():
+    gate = FairSendGate(max_concurrent=1)
+    release = asyncio.Event()
+    order = []
+
+    async def send(account, label, hold=False):
+        async with gate.slot(account):
+            order.append(label)
+            if hold:
+                await release.wait()
+
+    first = asyncio.create_task(send("@a:x", "a0", hold=True))
+    await asyncio.sleep(0)
+    # A burst from @a:x queues ahead of a single send from @b:x.
+    waiting = [asyncio.create_task(send("@a:x", f"a{i}")) for i in range(1, 4)]
+    waiting.append(asyncio.create_task(send("@b:x", "b1")))
+    await asyncio.sleep(0)
+    assert gate.waiting == 4
+    release.set()
+    await asyncio.gather(first, *waiting)
+    assert order == ["a0", "a1", "b1", "a2", "a3"]
+    assert gate.waiting == 0 and gate._active == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_gives_up_its_place():
+    gate = FairSendGate(max_concurrent=1)
+    release = asyncio.Event()
+
+    async def hold():
+        async with gate.slot("@a:x"):
+            await release.wait()
+
+    async def quick():
+        async with gate.slot("@b:x"):
+            pass
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    cancelled = asyncio.create_task(quick())
+    other = asyncio.create_task(quick())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.gather(cancelled, return_exceptions=True)
+    release.set()
+    await asyncio.gather(holder, other)
+    assert gate.waiting == 0 and gate._active == 0
+
+
+@pytest.mark.asyncio
+async def test_one_account_answers_and_accounts_ignore_each_other(monkeypatch):
+    pool = AccountPool([fake_account("@a:x", ["!shared:x"]),
+                        fake_account("@b:x", ["!shared:x", "!b:x"])])
+    monkeypatch.setattr(get_services(), "accounts", pool)
+    monkeypatch.setattr(handlers, "_seen_events", SeenEvents())
+    replies = []
+
+    async def send_reply(client, room_id, event, reply, **kwargs):
+        replies.append((client.user_id, room_id, reply))
+
+    async def ping(body):
+        return "pong"
+
+    monkeypatch.setattr(handlers, "send_reply", send_reply)
+    get_registry().register("acctping", "Ping", r"^!acctping$", ping)
+    a, b = SimpleNamespace(user_id="@a:x"), SimpleNamespace(user_id="@b:x")
+
+    def message(event_id, sender, room_id):
+        event = RoomMessageText.from_dict({
+            "event_id": event_id, "sender": sender, "type": "m.room.message",
+            "origin_server_ts": int(time.time() * 1000),
+            "content": {"msgtype": "m.text", "body": "!acctping"}})
+        return SimpleNamespace(room_id=room_id), event
+
+    try:
+        for client in (b, a):
+            await handlers.on_message(client, *message("$1", "@u:x", "!shared:x"))
+        await handlers.on_message(b, *message("$2", "@u:x", "!b:x"))
+        for client in (a, b):  # The accounts' own replies
+            await handlers.on_message(client, *message("$3", "@a:x", "!shared:x"))
+            await handlers.on_message(client, *message("$4", "@b:x", "!b:x"))
+    finally:
+        get_registry().unregister("acctping")
+
+    assert replies == [("@a:x", "!shared:x", "pong"), ("@b:x", "!b:x", "pong")]
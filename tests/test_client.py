@@ -0,0 +1,74 @@
+"""Tests for the pooled Matrix client layer."""
+import asyncio
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from bot.client import create_clients
+
+
+@pytest_asyncio.fixture
+async def slow_server():
+    """Local HTTP server whose responses take a moment, to fill the pool."""
+    async def handler(request):
+        await asyncio.sleep(0.05)
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    yield f"http://127.0.0.1:{port}"
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_pools_are_separate_and_measured(slow_server):
+    """Requests on the API pool queue only behind each other, not sync."""
+    clients = create_clients(slow_server, "@bot:example.com", "DEV",
+                             sync_pool_size=1, api_pool_size=1)
+    try:
+        await asyncio.gather(
+            clients.sync.send("GET", "/sync"),
+            clients.api.send("GET", "/a"),
+            clients.api.send("GET", "/b"),
+        )
+        metrics = clients.metrics()
+        assert clients.sync.client_session is not clients.api.client_session
+    finally:
+        await clients.close()
+
+    assert metrics["sync"]["requests"] == 1
+    assert metrics["sync"]["queue_waits"] == 0
+    assert metrics["api"]["requests"] == 2
+    assert metrics["api"]["queue_waits"] == 1
+    assert metrics["api"]["peak_in_flight"] == 2
+    assert metrics["api"]["in_flight"] == 0
+
+
+def test_sync_client_surfaces_errors():
+    """The sync client leaves retries to the supervisor."""
+    clients = create_clients("https://example.com", "@bot:example.com", "DEV")
+    assert clients.sync.config.max_timeouts == 0
+    assert clients.sync.config.max_limit_exceeded == 0
+    assert clients.api.config.max_timeouts > 0
+
+
+@pytest.mark.asyncio
+async def test_decorated_methods_use_pooled_session(slow_server):
+    """nio helpers called before any `send` still get the sized pool."""
+    clients = create_clients(slow_server, "@bot:example.com", "DEV",
+                             api_pool_size=3)
+    clients.login("@bot:example.com", "token")
+    try:
+        await clients.api.get_profile()
+        session = clients.api.client_session
+        assert session.connector.limit == 3
+        assert session.connector.connect.func.__name__ == "connect_wrapper"
+        assert clients.api.pool_metrics.connections_created == 1
+    finally:
+        await clients.close()
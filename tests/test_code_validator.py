@@ -58,3 +58,58 @@ async def test_example():
     is_valid, error = validate_test_code(code)
     assert is_valid
     assert error is None
+
+
+@pytest.mark.parametrize("line", [
+    "import sqlite3",
+    "import pickle",
+    "from bot.storage import Store",
+    "from ..storage import Store",
+    "x = ctx.storage._store",
+    "from bot import storage",
+    "from .. import storage",
+])
+def test_validate_rejects_storage_bypass(line):
+    """State must go through ctx.storage's public methods."""
+    code = f'''
+from bot.commands import command
+
+@command(name="test", description="Test", pattern=r"^!test$")
+async def test_handler(body: str, ctx) -> str:
+    {line}
+    return "test"
+'''
+    is_valid, error = validate_command_code(code, "test")
+    assert not is_valid
+    assert "storage" in error
+
+
+@pytest.mark.parametrize("line", [
+    "s = ctx.storage; s._read(('other', 'key'))",
+    "s = ctx.storage; s.get.__closure__",
+    "getattr(ctx.storage, '_write')",
+    "name = '_read'; getattr(ctx.storage, name)",
+])
+def test_validate_rejects_private_attributes(line):
+    code = f'''
+from bot.commands import command
+
+@command(name="test", description="Test", pattern=r"^!test$")
+async def test_handler(body: str, ctx) -> str:
+    {line}
+    return "test"
+'''
+    is_valid, error = validate_command_code(code, "test")
+    assert not is_valid
+    assert "attribute" in error
+
+
+def test_validate_allows_ctx_storage():
+    code = '''
+from bot.commands import command
+
+@command(name="test", description="Test", pattern=r"^!test$")
+async def test_handler(body: str, ctx) -> str:
+    return str(ctx.storage.incr("count")) if ctx.storage else "0"
+'''
+    assert validate_command_code(code, "test") == (True, None)
@@ -1,6 +1,6 @@
 """Tests for command registry system."""
 import pytest
-from bot.commands import CommandRegistry, command
+from bot.commands import CommandContext, CommandRegistry, command
 
 
 @pytest.mark.asyncio
@@ -47,3 +47,132 @@ async def test_list_commands():
     assert len(commands) > 0
     command_names = [name for name, _ in commands]
     assert "ping" in command_names
+
+
+@pytest.mark.asyncio
+async def test_context_handler_receives_metadata():
+    """Handlers with a second parameter get a populated CommandContext."""
+    from bot.commands import CommandContext
+
+    registry = CommandRegistry()
+    seen = []
+
+    async def ctx_handler(body: str, ctx: CommandContext):
+        seen.append(ctx)
+        return ctx.args
+
+    registry.register("echo", "Echo", r"^!echo\s*(.*)$", ctx_handler)
+    result = await registry.execute("  !echo hello there ", room_id="!r:x",
+                                    sender="@u:x", event_id="$e",
+                                    thread_root="$root")
+
+    assert result == "hello there"
+    ctx = seen[0]
+    assert registry.get_command("echo").api_version == 2
+    assert (ctx.command, ctx.room_id, ctx.sender, ctx.event_id, ctx.thread_root) == \
+        ("echo", "!r:x", "@u:x", "$e", "$root")
+    assert ctx.match.group(1) == "hello there"
+
+
+@pytest.mark.asyncio
+async def test_body_only_handler_still_supported():
+    """Version 1 handlers are called with just the body."""
+    registry = CommandRegistry()
+
+    async def body_handler(body: str):
+        return body.upper()
+
+    registry.register("shout", "Shout", r"^!shout", body_handler)
+    assert registry.get_command("shout").api_version == 1
+    assert await registry.execute("!shout hi", room_id="!r:x") == "!SHOUT HI"
+
+
+def test_listing_is_cached_until_commands_change():
+    """The rendered listing is reused until register/unregister."""
+    registry = CommandRegistry()
+
+    async def handler(body: str):
+        return None
+
+    registry.register("a", "First <one>", r"^!a$", handler, category="Math")
+    pages = registry.listing()
+    assert registry.listing() is pages
+    assert pages[0].body == "Available commands:\n  !a - First <one>"
+    assert "<code>!a</code> - First &lt;one&gt;" in pages[0].formatted_body
+
+    registry.register("b", "Second", r"^!b$", handler)
+    assert registry.listing() is not pages
+    assert registry.categories() == ["general", "math"]
+    assert [r.body for r in registry.listing("math")] == ["Available math commands:\n  !a - First <one>"]
+
+    registry.unregister("a")
+    assert registry.listing("math") == []
+
+
+def test_listing_pages_respect_size_limit(monkeypatch):
+    """Long listings are split into pages that fit the size budget."""
+    import bot.commands as commands
+    monkeypatch.setattr(commands, "LISTING_PAGE_BYTES", 2048)
+    registry = CommandRegistry()
+
+    async def handler(body: str):
+        return None
+
+    for i in range(40):
+        registry.register(f"cmd{i}", "x" * 60, rf"^!cmd{i}$", handler)
+    pages = registry.listing()
+    assert len(pages) > 1
+    for page in pages:
+        assert len(page.body.encode()) + len(page.formatted_body.encode()) <= 2048
+    assert pages[0].body.startswith(f"Available commands (page 1/{len(pages)}):")
+    assert pages[0].body.endswith("Send !list 2 for more.")
+    assert sum(page.body.count("  !cmd") for page in pages) == 40
+
+
+@pytest.mark.asyncio
+async def test_list_command_pages_and_categories():
+    """!list accepts a category and/or a page number."""
+    from bot.commands import Reply, execute_command
+
+    page = await execute_command("!list math")
+    assert isinstance(page, Reply)
+    assert "!calculate" in page.body and "!ping" not in page.body
+    assert "no page 99" in await execute_command("!list 99")
+    assert (await execute_command("!list nope")).startswith("Unknown category 'nope'")
+    # Superscript digits aren't page numbers, and must not crash int()
+    assert (await execute_command("!list ²")).startswith("Unknown category '²'")
+    assert (await execute_command("!list math ²")).startswith("Unknown category 'math ²'")
+
+
+def test_priority_is_recorded_and_validated():
+    """Commands carry a dispatcher priority; unknown ones are rejected."""
+    registry = CommandRegistry()
+
+    async def handler(body: str):
+        return None
+
+    registry.register("fast", "Fast", r"^!fast$", handler, priority="interactive")
+    assert registry.get_command("fast").priority == "interactive"
+    assert registry.find("  !fast ")[0].name == "fast"
+    with pytest.raises(ValueError):
+        registry.register("odd", "Odd", r"^!odd$", handler, priority="urgent")
+
+
+@pytest.mark.asyncio
+async def test_execute_reuses_a_match_found_earlier(monkeypatch):
+    """Callers that already matched the message skip the pattern scan."""
+    registry = CommandRegistry()
+
+    async def echo(body: str, ctx: CommandContext):
+        return ctx.args
+
+    registry.register("echo", "Echo", r"^!echo\s+(.*)$", echo)
+    found = registry.find("!echo hi")
+    assert registry.resolve("echo", " !echo hi ")[1].group(1) == "hi"
+    assert registry.resolve("echo", "!other") is None
+
+    def no_scan(body):
+        raise AssertionError("patterns scanned again")
+
+    monkeypatch.setattr(registry, "find", no_scan)
+    assert await registry.execute("!echo hi", found) == "hi"
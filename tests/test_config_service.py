@@ -0,0 +1,70 @@
+"""Tests for the hot-reloading config service."""
+import asyncio
+import dataclasses
+import os
+
+import pytest
+
+from bot.config import ConfigService
+
+BASE = '[bot]\nhomeserver = "https://example.org"\nuser_id = "@bot:example.org"\n'
+
+
+def make_service(tmp_path, extra=""):
+    path = tmp_path / "config.toml"
+    path.write_text(BASE + extra)
+    return ConfigService(str(path), str(tmp_path / ".env")), path
+
+
+def rewrite(path, text):
+    path.write_text(text)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))  # Coarse mtimes
+
+
+def test_snapshot_is_immutable(tmp_path):
+    service, _ = make_service(tmp_path)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        service.current.log_level = "DEBUG"
+
+
+def test_reload_swaps_snapshot_and_notifies(tmp_path):
+    service, path = make_service(tmp_path)
+    seen = []
+    service.subscribe(lambda old, new: seen.append((old.log_level, new.log_level)))
+    before = service.current
+
+    rewrite(path, BASE + 'log_level = "DEBUG"\n')
+    assert service.reload()
+    assert service.current.log_level == "DEBUG" and before.log_level == "INFO"
+    assert seen == [("INFO", "DEBUG")]
+    assert not service.reload()  # Unchanged: no notification
+    assert len(seen) == 1
+
+
+def test_invalid_config_keeps_previous_snapshot(tmp_path):
+    service, path = make_service(tmp_path, 'log_level = "DEBUG"\n')
+    seen = []
+    service.subscribe(lambda old, new: seen.append(new))
+    for broken in (BASE + 'rate_limit_user = "lots"\n', BASE + "nonsense = 1\n", "[bot"):
+        rewrite(path, broken)
+        assert not service.reload()
+    assert service.current.log_level == "DEBUG" and not seen
+
+
+@pytest.mark.asyncio
+async def test_watch_reloads_after_debounce(tmp_path):
+    service, path = make_service(
+        tmp_path, "config_poll_interval = 0.01\nconfig_debounce = 0.02\n")
+    changed = asyncio.Event()
+    service.subscribe(lambda old, new: changed.set())
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(service.watch(stop))
+
+    rewrite(path, BASE + 'config_poll_interval = 0.01\nconfig_debounce = 0.02\n'
+                         'allowed_rooms = ["!a:example.org"]\n')
+    await asyncio.wait_for(changed.wait(), 2)
+    assert service.current.allowed_rooms == ["!a:example.org"]
+
+    stop.set()
+    await asyncio.wait_for(watcher, 1)
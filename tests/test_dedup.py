@@ -0,0 +1,70 @@
+"""Tests for the seen-event index."""
+from bot.dedup import SeenEvents
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_duplicates_rejected():
+    """The same event ID is only accepted once."""
+    seen = SeenEvents()
+    assert seen.check_and_add("$a")
+    assert not seen.check_and_add("$a")
+    assert seen.check_and_add("$b")
+    assert "$a" in seen
+    assert len(seen) == 2
+
+
+def test_entries_expire_by_bucket():
+    """IDs are forgotten once their bucket is older than the TTL."""
+    clock = FakeClock()
+    seen = SeenEvents(ttl=60, buckets=6, clock=clock)
+    seen.check_and_add("$old")
+    clock.now += 90
+    seen.check_and_add("$new")
+    assert "$old" not in seen
+    assert "$new" in seen
+    assert len(seen) == 1
+
+
+def test_size_is_capped():
+    """The oldest bucket is dropped when the cap is exceeded."""
+    clock = FakeClock()
+    seen = SeenEvents(ttl=600, max_events=10, buckets=6, clock=clock)
+    for i in range(8):
+        seen.check_and_add(f"$first{i}")
+    clock.now += 100
+    for i in range(8):
+        seen.check_and_add(f"$second{i}")
+    assert len(seen) == 8
+    assert "$first0" not in seen
+    assert "$second0" in seen
+
+
+def test_size_is_capped_within_one_bucket():
+    """A burst inside one bucket window still respects the cap."""
+    seen = SeenEvents(max_events=100, clock=FakeClock())
+    for i in range(5000):
+        assert seen.check_and_add(f"$burst{i}")
+    assert len(seen) == 100
+    assert sum(len(keys) for _, keys in seen._buckets) == 100
+    assert "$burst0" not in seen
+    assert "$burst4999" in seen
+
+
+def test_spill_survives_restart(tmp_path):
+    """A new index loaded from the spill file remembers earlier events."""
+    path = tmp_path / "seen_events"
+    seen = SeenEvents(path=path)
+    seen.check_and_add("$a")
+    seen.close()
+
+    restarted = SeenEvents(path=path)
+    assert not restarted.check_and_add("$a")
+    assert restarted.check_and_add("$b")
+    restarted.close()
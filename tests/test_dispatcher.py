@@ -0,0 +1,115 @@
+"""Tests for the priority-lane dispatcher."""
+import asyncio
+
+import pytest
+
+from bot.dispatcher import Dispatcher, DispatcherBusy, LaneConfig, lane_configs
+
+
+def lanes(**overrides):
+    return lane_configs(overrides)
+
+
+@pytest.mark.asyncio
+async def test_interactive_runs_while_bulk_saturates_the_pool():
+    dispatcher = Dispatcher(lanes(bulk={"concurrency": 2}), max_workers=2)
+    release = asyncio.Event()
+
+    async def slow():
+        await release.wait()
+        return "bulk"
+
+    bulk = [asyncio.create_task(dispatcher.submit("bulk", slow)) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    async def ping():
+        return "pong"
+
+    assert await asyncio.wait_for(dispatcher.submit("interactive", ping), 1) == "pong"
+    assert dispatcher.snapshot()["bulk"]["queued"] == 1
+    release.set()
+    assert await asyncio.gather(*bulk) == ["bulk"] * 3
+
+
+@pytest.mark.asyncio
+async def test_shared_pool_is_split_by_weight():
+    dispatcher = Dispatcher(lanes(standard={"concurrency": 10, "weight": 3},
+                                  bulk={"concurrency": 10, "weight": 1, "max_queued": 100}),
+                            max_workers=1)
+    order = []
+    gate = asyncio.Event()
+
+    def job(name):
+        async def run():
+            await gate.wait()
+            order.append(name)
+        return run
+
+    blocker = asyncio.create_task(dispatcher.submit("standard", job("first")))
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(dispatcher.submit(lane, job(lane)))
+             for _ in range(8) for lane in ("standard", "bulk")]
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(blocker, *tasks)
+
+    first_eight = order[1:9]
+    assert first_eight.count("standard") == 6
+    assert first_eight.count("bulk") == 2
+
+
+@pytest.mark.asyncio
+async def test_queued_bulk_waits_for_pending_interactive():
+    dispatcher = Dispatcher(lanes(interactive={"concurrency": 1}), max_workers=4)
+    gate = asyncio.Event()
+    order = []
+
+    async def blocking():
+        await gate.wait()
+        order.append("interactive-1")
+
+    async def quick(name):
+        order.append(name)
+
+    first = asyncio.create_task(dispatcher.submit("interactive", blocking))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(dispatcher.submit("interactive", lambda: quick("interactive-2")))
+    await asyncio.sleep(0)
+    bulk = asyncio.create_task(dispatcher.submit("bulk", lambda: quick("bulk")))
+    await asyncio.sleep(0)
+    assert order == []  # Bulk is held back while interactive work waits
+    gate.set()
+    await asyncio.gather(first, second, bulk)
+    assert order == ["interactive-1", "interactive-2", "bulk"]
+
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_and_errors_propagate():
+    dispatcher = Dispatcher({"bulk": LaneConfig(concurrency=1, weight=1, max_queued=1)})
+    gate = asyncio.Event()
+
+    async def wait():
+        await gate.wait()
+
+    running = asyncio.create_task(dispatcher.submit("bulk", wait))
+    queued = asyncio.create_task(dispatcher.submit("bulk", wait))
+    await asyncio.sleep(0)
+    with pytest.raises(DispatcherBusy):
+        await dispatcher.submit("bulk", wait)
+    gate.set()
+    await asyncio.gather(running, queued)
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await dispatcher.submit("bulk", fail)
+    assert dispatcher.snapshot()["bulk"]["rejected"] == 1
+
+
+def test_lane_overrides_are_validated():
+    assert lane_configs({"bulk": {"concurrency": 3}})["bulk"].concurrency == 3
+    with pytest.raises(ValueError):
+        lane_configs({"urgent": {}})
+    with pytest.raises(ValueError):
+        lane_configs({"bulk": {"speed": 1}})
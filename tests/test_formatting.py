@@ -0,0 +1,87 @@
+"""Tests for Markdown rendering, the render cache and the outbound stage."""
+import pytest
+from nio import RoomMessageText
+
+from bot.commands import Reply
+from bot.formatting import RenderCache, render_markdown, split_message
+from bot.outbound import build_contents, thread_relation
+
+
+def make_event(event_id: str, thread: str = None) -> RoomMessageText:
+    content = {"msgtype": "m.text", "body": "hi"}
+    if thread:
+        content["m.relates_to"] = {"rel_type": "m.thread", "event_id": thread}
+    return RoomMessageText.from_dict({
+        "event_id": event_id, "sender": "@u:x", "origin_server_ts": 0,
+        "type": "m.room.message", "content": content,
+    })
+
+
+def test_plain_text_needs_no_html():
+    assert render_markdown("pong") is None
+    assert render_markdown("2*3 = 6.0") is None
+
+
+def test_renders_code_blocks_and_inline_markup():
+    html = render_markdown("```python\nprint(1 < 2)\n```")
+    assert html.startswith('<pre><code class="language-python">')
+    assert "&lt;" in html and "```" not in html
+
+    html = render_markdown("Use **this** and `a<b` from [docs](https://x.y/?a=1&b=2)\n- one\n- two")
+    assert "<strong>this</strong>" in html
+    assert "<code>a&lt;b</code>" in html
+    assert '<a href="https://x.y/?a=1&amp;b=2">docs</a>' in html
+    assert "<ul><li>one</li><li>two</li></ul>" in html
+
+
+def test_render_cache_skips_repeat_renders():
+    cache = RenderCache(maxsize=2)
+    first = cache.render("**a**")
+    assert cache.render("**a**") is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.render("**b**")
+    cache.render("**c**")
+    assert len(cache) == 2
+    cache.render("**a**")  # Evicted, rendered again
+    assert cache.misses == 4
+
+
+def test_split_message_keeps_code_blocks_balanced():
+    code = "\n".join(f"x{i} = {i}" for i in range(300))
+    text = f"intro\n\n```python\n{code}\n```\n\noutro"
+    chunks = split_message(text, 1000)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk.encode()) <= 1000
+        assert chunk.count("```") % 2 == 0
+    assert chunks[1].startswith("```python\n")
+    assert all(line in "\n".join(chunks) for line in ("x0 = 0", "x299 = 299", "outro"))
+
+
+def test_split_message_cuts_long_lines_at_spaces():
+    chunks = split_message(" ".join(["word"] * 600), 1000)
+    assert all(len(c.encode()) <= 1000 for c in chunks)
+    assert all(not c.endswith("wor") for c in chunks)
+    assert sum(c.count("word") for c in chunks) == 600
+
+
+def test_thread_relation_uses_existing_thread_root():
+    assert thread_relation(make_event("$e"))["event_id"] == "$e"
+    relation = thread_relation(make_event("$reply", thread="$root"))
+    assert relation["event_id"] == "$root"
+    assert relation["m.in_reply_to"] == {"event_id": "$reply"}
+
+
+def test_build_contents_renders_and_splits():
+    [content] = build_contents("```python\npass\n```", {"rel_type": "m.thread"})
+    assert content["format"] == "org.matrix.custom.html"
+    assert "language-python" in content["formatted_body"]
+    assert content["m.relates_to"] == {"rel_type": "m.thread"}
+
+    [plain] = build_contents("pong")
+    assert "formatted_body" not in plain
+
+    [given] = build_contents(Reply(body="x", formatted_body="<b>x</b>"))
+    assert given["formatted_body"] == "<b>x</b>"
+
+    assert len(build_contents("line\n" * 10000)) > 1
@@ -0,0 +1,135 @@
+"""Tests for the message history cache."""
+import pytest
+from nio import RoomMessagesError, RoomMessagesResponse, RoomMessageText
+
+from bot.history import MessageHistory
+
+
+def make_event(event_id: str, body: str = "hello", thread: str = None,
+               sender: str = "@u:x", ts: int = 0) -> RoomMessageText:
+    content = {"msgtype": "m.text", "body": body}
+    if thread:
+        content["m.relates_to"] = {"rel_type": "m.thread", "event_id": thread}
+    return RoomMessageText.from_dict({
+        "event_id": event_id, "sender": sender, "origin_server_ts": ts,
+        "type": "m.room.message", "content": content,
+    })
+
+
+class FakeClient:
+    """Serves /messages pages, newest first."""
+
+    def __init__(self, events):
+        self.events = list(reversed(events))
+        self.calls = 0
+
+    async def room_messages(self, room_id, start=None, direction=None, limit=10):
+        self.calls += 1
+        offset = int(start or 0)
+        chunk = self.events[offset:offset + limit]
+        return RoomMessagesResponse(room_id, chunk, str(offset),
+                                    str(offset + len(chunk)))
+
+
+def test_room_ring_buffer_and_threads():
+    """Rooms keep the last N messages; threads are tracked separately."""
+    history = MessageHistory(depth=3, thread_depth=3)
+    history.record("!r", make_event("$root", "root"))
+    for i in range(4):
+        history.record("!r", make_event(f"$t{i}", f"reply {i}", thread="$root"))
+
+    assert [m.event_id for m in history.recent("!r")] == ["$t1", "$t2", "$t3"]
+    assert [m.body for m in history.recent("!r", thread="$root")] == \
+        ["reply 1", "reply 2", "reply 3"]
+    assert [m.event_id for m in history.recent("!r", limit=1)] == ["$t3"]
+
+
+def test_cold_rooms_evicted():
+    """The least recently used room is dropped when over the room cap."""
+    history = MessageHistory(max_rooms=2)
+    history.record("!a", make_event("$1"))
+    history.record("!b", make_event("$2"))
+    history.recent("!a")  # Touch !a so !b is coldest
+    history.record("!c", make_event("$3"))
+
+    assert history.recent("!b") == []
+    assert history.recent("!a") and history.recent("!c")
+
+
+def test_memory_budget_evicts():
+    """The approximate byte budget bounds total memory."""
+    history = MessageHistory(max_bytes=5000)
+    for i in range(20):
+        history.record(f"!room{i}", make_event(f"${i}", "x" * 1000))
+    assert history.approx_bytes <= 5000
+    assert history.recent("!room19")
+
+
+def test_thread_buffers_count_toward_budget():
+    """Thread replies that scrolled out of the room buffer still use budget."""
+    history = MessageHistory(depth=2, thread_depth=50, max_bytes=20_000)
+    for i in range(30):
+        history.record("!r", make_event(f"$t{i}", "x" * 1000, thread=f"$root{i % 3}"))
+    threads = [history.recent("!r", thread=f"$root{i}") for i in range(3)]
+    assert [] in threads and threads[2]
+    assert history.approx_bytes <= 20_000
+
+    history.record("!other", make_event("$o", "hi"))
+    assert history.approx_bytes == sum(
+        m.size for room in ("!r", "!other") for m in history.recent(room)
+    ) + sum(m.size for thread in threads for m in thread)
+
+def test_listeners_notified():
+    """Subscribers see each recorded message."""
+    history = MessageHistory()
+    seen = []
+    history.subscribe(lambda room_id, message: seen.append((room_id, message.body)))
+    history.record("!r", make_event("$1", "hi"))
+    assert seen == [("!r", "hi")]
+
+
+@pytest.mark.asyncio
+async def test_backfill_on_miss_runs_once():
+    """A miss backfills older messages before live ones, only once per room."""
+    history = MessageHistory(depth=10)
+    client = FakeClient([make_event(f"$old{i}", f"old {i}") for i in range(5)])
+    history.record("!r", make_event("$live", "live"))
+
+    messages = await history.fetch("!r", 4, client=client)
+    assert [m.body for m in messages] == ["old 2", "old 3", "old 4", "live"]
+
+    calls = client.calls
+    await history.fetch("!r", 50, client=client)
+    assert client.calls == calls
+
+
+
+class FlakyClient(FakeClient):
+    """Fails its first /messages request."""
+
+    async def room_messages(self, *args, **kwargs):
+        if not self.calls:
+            self.calls += 1
+            return RoomMessagesError("unavailable")
+        return await super().room_messages(*args, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_failed_backfill_is_retried():
+    history = MessageHistory(depth=10)
+    client = FlakyClient([make_event(f"$old{i}", f"old {i}") for i in range(3)])
+    history.record("!r", make_event("$live", "live"))
+
+    assert [m.body for m in await history.fetch("!r", 4, client=client)] == ["live"]
+    messages = await history.fetch("!r", 4, client=client)
+    assert [m.body for m in messages] == ["old 0", "old 1", "old 2", "live"]
+
+def test_event_seen_by_two_accounts_is_recorded_once():
+    history = MessageHistory()
+    seen = []
+    history.subscribe(lambda room_id, message: seen.append(message.event_id))
+    assert history.record("!r:x", make_event("$1")) is not None
+    history.record("!r:x", make_event("$2"))
+    assert history.record("!r:x", make_event("$1")) is None
+    assert [m.event_id for m in history.recent("!r:x")] == ["$1", "$2"]
+    assert seen == ["$1", "$2"]
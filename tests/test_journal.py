@@ -0,0 +1,140 @@
+"""Tests for the outbound reply journal."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from nio import RoomSendError, RoomSendResponse
+
+from bot.journal import OutboundJournal
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_pending_entries_survive_reopen(tmp_path):
+    path = tmp_path / "outbound.sqlite3"
+    journal = OutboundJournal(path)
+    sent = journal.record("!r:x", {"body": "acknowledged"})
+    lost = journal.record("!r:x", {"body": "lost in a crash"})
+    journal.done(sent)
+    journal.close()
+
+    reopened = OutboundJournal(path)
+    assert reopened.pending() == [
+        {"txn_id": lost, "room_id": "!r:x", "content": {"body": "lost in a crash"},
+         "account": None}]
+    reopened.close()
+
+
+def test_stale_entries_are_not_replayed(tmp_path):
+    clock = Clock()
+    journal = OutboundJournal(tmp_path / "j.sqlite3", clock=clock)
+    journal.record("!r:x", {"body": "old"})
+    clock.now += 3600
+    fresh = journal.record("!r:x", {"body": "new"})
+    assert [e["txn_id"] for e in journal.pending(max_age=600)] == [fresh]
+    assert [e["txn_id"] for e in journal.pending()] == [fresh]  # Old one marked done
+    journal.close()
+
+
+def test_compaction_bounds_the_journal(tmp_path):
+    clock = Clock()
+    journal = OutboundJournal(tmp_path / "j.sqlite3", max_entries=3, clock=clock)
+    txns = []
+    for i in range(5):
+        clock.now += 1
+        txns.append(journal.record("!r:x", {"body": str(i)}))
+    journal.done(txns[4])
+    journal.compact()
+    assert [e["txn_id"] for e in journal.pending()] == txns[2:4]
+    journal.close()
+
+
+@pytest.mark.asyncio
+async def test_room_send_journals_under_txn_id(tmp_path, outbound_state):
+    journal = OutboundJournal(tmp_path / "j.sqlite3")
+    outbound_state.set_journal(journal)
+
+    class Client:
+        def __init__(self):
+            self.tx_ids = []
+
+        async def room_send(self, room_id, message_type, content, tx_id=None):
+            self.tx_ids.append(tx_id)
+            if content["body"] == "hang":
+                await asyncio.sleep(3600)
+            return RoomSendResponse(f"$event{len(self.tx_ids)}", room_id)
+
+    client = Client()
+    await outbound_state.room_send(client, "!r:x", {"body": "fine"})
+    send = asyncio.create_task(outbound_state.room_send(client, "!r:x", {"body": "hang"}))
+    await asyncio.sleep(0)
+    send.cancel()
+    await asyncio.gather(send, return_exceptions=True)
+
+    [pending] = journal.pending()
+    assert pending["content"] == {"body": "hang"}
+    assert client.tx_ids[1] == pending["txn_id"] and client.tx_ids[0] != pending["txn_id"]
+
+    # Replaying under the original ID marks it done.
+    await outbound_state.room_send(client, "!r:x", {"body": "again"}, txn_id=pending["txn_id"])
+    assert journal.pending() == []
+    journal.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status, kept", [(502, True), (429, True), (403, False)])
+async def test_failed_sends_stay_journaled_unless_rejected(tmp_path, outbound_state,
+                                                           monkeypatch, status, kept):
+    journal = OutboundJournal(tmp_path / "j.sqlite3")
+    outbound_state.set_journal(journal)
+    monkeypatch.setattr(outbound_state, "SEND_RETRY_DELAY", 0)
+
+    class Client:
+        attempts = 0
+
+        async def room_send(self, room_id, message_type, content, tx_id=None):
+            self.attempts += 1
+            error = RoomSendError("server said no", room_id=room_id)
+            error.transport_response = SimpleNamespace(status=status)
+            return error
+
+    client = Client()
+    resp = await outbound_state.room_send(client, "!r:x", {"body": "hi"})
+    assert isinstance(resp, RoomSendError)
+    assert [e["content"] for e in journal.pending()] == ([{"body": "hi"}] if kept else [])
+    # Transient failures are retried in process; rejections are not.
+    assert client.attempts == (outbound_state.SEND_RETRIES + 1 if kept else 1)
+    journal.close()
+
+
+@pytest.mark.asyncio
+async def test_transient_failures_are_retried_under_one_txn_id(tmp_path, outbound_state,
+                                                               monkeypatch):
+    journal = OutboundJournal(tmp_path / "j.sqlite3")
+    outbound_state.set_journal(journal)
+    monkeypatch.setattr(outbound_state, "SEND_RETRY_DELAY", 0)
+
+    class Client:
+        def __init__(self):
+            self.tx_ids = []
+
+        async def room_send(self, room_id, message_type, content, tx_id=None):
+            self.tx_ids.append(tx_id)
+            if len(self.tx_ids) < 3:
+                error = RoomSendError("bad gateway", room_id=room_id)
+                error.transport_response = SimpleNamespace(status=502)
+                return error
+            return RoomSendResponse("$event", room_id)
+
+    client = Client()
+    resp = await outbound_state.room_send(client, "!r:x", {"body": "hi"})
+    assert isinstance(resp, RoomSendResponse)
+    assert len(client.tx_ids) == 3 and len(set(client.tx_ids)) == 1
+    assert journal.pending() == []
+    journal.close()
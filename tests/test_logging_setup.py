@@ -0,0 +1,85 @@
+"""Tests for the logging pipeline."""
+import io
+import json
+import logging
+
+import pytest
+
+from bot.logging_setup import (
+    SamplingFilter, redact, setup_logging, shutdown_logging
+)
+
+
+@pytest.fixture
+def log_stream():
+    """Install the pipeline writing to a buffer, restoring root handlers after."""
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    stream = io.StringIO()
+    yield stream
+    shutdown_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in saved_handlers:
+        root.addHandler(handler)
+    root.setLevel(saved_level)
+
+
+def _record(name: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, "msg", None, None)
+
+
+def test_json_output_and_redaction(log_stream):
+    """Bodies are redacted by default and records are emitted as JSON."""
+    setup_logging(level="INFO", fmt="json", stream=log_stream)
+    logging.getLogger("bot.test").info("Replying: %s", redact("secret text"))
+    shutdown_logging()
+
+    entry = json.loads(log_stream.getvalue().strip())
+    assert entry["logger"] == "bot.test"
+    assert entry["level"] == "INFO"
+    assert entry["msg"] == "Replying: <redacted 11 chars>"
+
+
+def test_bodies_logged_when_enabled(log_stream):
+    """Message bodies appear when body logging is explicitly enabled."""
+    setup_logging(level="INFO", log_bodies=True, stream=log_stream)
+    logging.getLogger("bot.test").info("Replying: %s", redact("hello"))
+    shutdown_logging()
+
+    assert "Replying: hello" in log_stream.getvalue()
+
+
+def test_sampling_filter_keeps_fraction():
+    """Sampled loggers keep every Nth record; others pass through."""
+    sampler = SamplingFilter({"bot.handlers": 0.25})
+    kept = sum(sampler.filter(_record("bot.handlers.sub")) for _ in range(100))
+    assert kept == 25
+    assert sampler.filter(_record("bot.other"))
+
+
+def test_sampling_never_drops_warnings():
+    """WARNING and above bypass sampling."""
+    sampler = SamplingFilter({"bot": 0.0})
+    assert not sampler.filter(_record("bot.x"))
+    assert sampler.filter(_record("bot.x", logging.WARNING))
+
+
+@pytest.mark.parametrize("rate", [0.1, 0.29, 0.4, 0.67, 0.9])
+def test_sampling_filter_keeps_fractional_rates(rate):
+    """Rates that aren't 1/N keep their share of records."""
+    sampler = SamplingFilter({"bot": rate})
+    kept = sum(sampler.filter(_record("bot.x")) for _ in range(100))
+    assert kept == round(100 * rate)
+
+
+def test_mutable_arguments_are_formatted_when_logged(log_stream):
+    """A list changed after logging is shown as it was at the call."""
+    setup_logging(level="INFO", stream=log_stream)
+    rooms = ["!a:x"]
+    logging.getLogger("bot.test").info("Rooms: %s (%s)", rooms, redact("body"))
+    rooms.append("!b:x")
+    shutdown_logging()
+    shutdown_logging()  # A second stop is harmless
+
+    assert "Rooms: ['!a:x'] (<redacted 4 chars>)" in log_stream.getvalue()
@@ -0,0 +1,69 @@
+"""Tests for compiled room policies."""
+import pytest
+
+from bot.config import BotConfig
+from bot.policy import PolicyRule, RoomPolicies
+from bot.ratelimit import Rate
+
+
+def test_no_rules_allows_everything():
+    policy = RoomPolicies().for_room("!any:example.org")
+    assert policy.enabled and policy.allows("add")
+    assert policy.rate is None and policy.max_concurrent is None
+
+
+def test_allowed_rooms_disables_other_rooms():
+    policies = RoomPolicies(allowed_rooms=["!ok:example.org"])
+    assert policies.for_room("!ok:example.org").enabled
+    assert not policies.for_room("!other:example.org").enabled
+
+
+def test_specific_rules_override_field_by_field():
+    policies = RoomPolicies([
+        PolicyRule.from_dict({"match": "*", "rate": "60/min"}),
+        PolicyRule.from_dict({"match": "*:example.org", "deny_commands": ["Add"],
+                              "max_concurrent": 4}),
+        PolicyRule.from_dict({"match": "!quiet:example.org",
+                              "commands": ["ping", "list"], "rate": "5/min"}),
+    ])
+    server = policies.for_room("!room:example.org")
+    assert server.rate == Rate(60, 60) and server.max_concurrent == 4
+    assert server.allows("ping") and not server.allows("add")
+
+    quiet = policies.for_room("!quiet:example.org")
+    assert quiet.rate == Rate(5, 60) and quiet.max_concurrent == 4
+    assert quiet.allows("list") and not quiet.allows("calculate")
+    assert not quiet.allows("add")  # Still denied by the server rule
+
+    elsewhere = policies.for_room("!room:other.org")
+    assert elsewhere.max_concurrent is None and elsewhere.allows("add")
+
+
+def test_rule_can_enable_room_outside_allowed_rooms():
+    config = BotConfig(homeserver="https://example.org", user_id="@bot:example.org",
+                       allowed_rooms=["!ok:example.org"],
+                       room_policies=[{"match": "*:trusted.org", "enabled": True}])
+    policies = RoomPolicies.from_config(config)
+    assert policies.for_room("!any:trusted.org").enabled
+    assert not policies.for_room("!any:example.org").enabled
+
+
+def test_decisions_are_cached_until_invalidated():
+    policies = RoomPolicies()
+    first = policies.for_room("!r:example.org")
+    assert policies.for_room("!r:example.org") is first
+    policies.invalidate()
+    assert policies.for_room("!r:example.org") is not first
+
+
+@pytest.mark.parametrize("entry", [
+    {"match": "!a*:example.org"},
+    {"match": "*:*"},
+    {"commands": ["ping"]},
+    {"match": "*", "colour": "red"},
+    {"match": "*", "max_concurrent": 0},
+    {"match": "*", "rate": "lots"},
+])
+def test_invalid_rules_are_rejected(entry):
+    with pytest.raises(ValueError):
+        PolicyRule.from_dict(entry)
@@ -0,0 +1,67 @@
+"""Tests for token-bucket rate limiting."""
+import pytest
+
+from bot.ratelimit import Rate, RateLimiter, TokenBuckets, parse_rate
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_rate():
+    assert parse_rate("5/min") == Rate(5, 60)
+    assert parse_rate("10/30s") == Rate(10, 30)
+    assert parse_rate("3 / hour") == Rate(3, 3600)
+    assert parse_rate("") is None and parse_rate(None) is None
+    for bad in ("fast", "5/fortnight", "0/min"):
+        with pytest.raises(ValueError):
+            parse_rate(bad)
+
+
+def test_bucket_allows_burst_then_refills():
+    clock = Clock()
+    limiter = RateLimiter(user_rate="2/min", clock=clock)
+    assert limiter.check("@a:x", "!r", "ping").allowed
+    assert limiter.check("@a:x", "!r", "ping").allowed
+    denied = limiter.check("@a:x", "!r", "ping")
+    assert not denied.allowed and denied.retry_after == pytest.approx(30)
+    assert limiter.check("@b:x", "!r", "ping").allowed  # Other senders unaffected
+    clock.now = 30
+    assert limiter.check("@a:x", "!r", "ping").allowed
+
+
+def test_command_rate_only_consumes_when_all_buckets_admit():
+    clock = Clock()
+    limiter = RateLimiter(user_rate="10/min", clock=clock)
+    add_rate = parse_rate("1/hour")
+    assert limiter.check("@a:x", "!r", "add", add_rate).allowed
+    for _ in range(5):
+        assert not limiter.check("@a:x", "!r", "add", add_rate).allowed
+    # Rejected !add calls did not spend the sender's general budget.
+    for _ in range(9):
+        assert limiter.check("@a:x", "!r", "ping").allowed
+
+
+def test_rejection_notices_are_rate_limited():
+    clock = Clock()
+    limiter = RateLimiter(room_rate="1/min", notice_rate="1/min", clock=clock)
+    limiter.check("@a:x", "!r", "ping")
+    notices = [limiter.check("@a:x", "!r", "ping").notify for _ in range(5)]
+    assert notices == [True, False, False, False, False]
+    assert limiter.rejected == 5
+
+
+def test_idle_buckets_are_evicted_and_table_is_bounded():
+    clock = Clock()
+    buckets = TokenBuckets(max_keys=3, clock=clock)
+    rate = Rate(1, 10)
+    for key in "abcd":
+        buckets.try_acquire([(key, rate)])
+    assert len(buckets) == 3
+    clock.now = 11
+    buckets.try_acquire([("e", rate)])
+    assert len(buckets) == 1
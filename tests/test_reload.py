@@ -0,0 +1,97 @@
+"""Tests for the restart handoff protocol."""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from bot import outbound
+from bot.reload import HandoffChannel, Successor, restart_command, take_over
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+async def channel_pair():
+    ours, theirs = socket.socketpair()
+    return await HandoffChannel.open(ours), await HandoffChannel.open(theirs)
+
+
+@pytest.mark.asyncio
+async def test_handoff_passes_sync_token_and_unsent_replies():
+    old_end, new_end = await channel_pair()
+    taking_over = asyncio.create_task(take_over(new_end))
+
+    assert await old_end.receive(1) == {"type": "ready"}
+    successor = Successor(SimpleNamespace(pid=1, returncode=0), old_end)
+    unsent = [{"room_id": "!r:x", "content": {"msgtype": "m.text", "body": "hi"}}]
+    assert await successor.hand_over("s72_1", unsent)
+
+    handoff = await asyncio.wait_for(taking_over, 1)
+    assert handoff["next_batch"] == "s72_1"
+    assert handoff["unsent"] == unsent
+
+
+
+@pytest.mark.asyncio
+async def test_handoff_carries_many_large_replies():
+    old_end, new_end = await channel_pair()
+    taking_over = asyncio.create_task(take_over(new_end))
+
+    assert await old_end.receive(1) == {"type": "ready"}
+    successor = Successor(SimpleNamespace(pid=1, returncode=0), old_end)
+    unsent = [{"room_id": "!r:x", "content": {"msgtype": "m.text", "body": "\u00e9" * 60_000}}
+              for _ in range(3)]
+    assert await successor.hand_over({"@bot:x": "s72_1"}, unsent)
+
+    handoff = await asyncio.wait_for(taking_over, 5)
+    assert handoff["next_batch"] == {"@bot:x": "s72_1"}
+    assert handoff["unsent"] == unsent
+
+
+def test_restart_command_starts_the_real_entry_point(tmp_path, monkeypatch):
+    """Relaunching ``python -m bot.main`` gets as far as reading the config."""
+    monkeypatch.setattr(sys, "orig_argv", ["python3", "-m", "bot.main"])
+    command = restart_command()
+    assert command == [sys.executable, "-m", "bot.main"]
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [str(REPO), os.environ.get("PYTHONPATH")])))
+    result = subprocess.run(command, cwd=tmp_path, env=env, capture_output=True,
+                            text=True, timeout=60)
+    assert result.returncode != 0
+    assert "ImportError" not in result.stderr
+    assert "Config file 'config.toml' not found" in result.stderr
+
+@pytest.mark.asyncio
+async def test_take_over_without_predecessor_state():
+    old_end, new_end = await channel_pair()
+    taking_over = asyncio.create_task(take_over(new_end))
+    assert await old_end.receive(1) == {"type": "ready"}
+    await old_end.close()  # Predecessor died before handing over
+    assert await asyncio.wait_for(taking_over, 1) is None
+
+
+@pytest.mark.asyncio
+async def test_cancelled_send_is_reported_unsent(outbound_state):
+    class SlowClient:
+        user_id = "@bot:x"
+
+        async def room_send(self, room_id, message_type, content):
+            await asyncio.sleep(3600)
+
+    class FastClient:
+        async def room_send(self, room_id, message_type, content):
+            return "ok"
+
+    await outbound.room_send(FastClient(), "!r:x", {"body": "sent"})
+    send = asyncio.create_task(outbound.room_send(SlowClient(), "!r:x", {"body": "cut off"}))
+    await asyncio.sleep(0)
+    send.cancel()
+    await asyncio.gather(send, return_exceptions=True)
+
+    assert outbound.unsent() == [{"room_id": "!r:x", "content": {"body": "cut off"},
+                                  "txn_id": None, "account": "@bot:x"}]
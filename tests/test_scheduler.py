@@ -0,0 +1,230 @@
+"""Tests for the job scheduler."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from bot.commands import CommandRegistry, ScheduleContext
+from bot.scheduler import Job, RetryLater, Scheduler, parse_interval
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def task(name, every=None, rooms=(), jitter=0.0):
+    return SimpleNamespace(name=name, every=every, rooms=tuple(rooms), jitter=jitter)
+
+
+def test_parse_interval():
+    assert parse_interval("90s") == 90
+    assert parse_interval("15m") == 900
+    assert parse_interval("1.5h") == 5400
+    assert parse_interval(30) == 30
+    with pytest.raises(ValueError):
+        parse_interval("soon")
+    with pytest.raises(ValueError):
+        parse_interval(0)
+
+
+def test_jitter_is_stable_and_bounded():
+    job = Job("a", "t", "!r:x", next_run=100.0, every=60, jitter=30)
+    assert 100.0 <= job.due < 130.0
+    assert job.due == Job("a", "t", "!r:x", next_run=100.0, jitter=30).due
+    assert Job("a", "t", "!r:x", next_run=100.0).due == 100.0
+
+
+def test_jobs_survive_reopen(tmp_path):
+    path = tmp_path / "schedule.sqlite3"
+
+    async def run(_):
+        pass
+
+    scheduler = Scheduler(run, path=path)
+    job = scheduler.add("remind", "!r:x", delay="10m", payload={"text": "hi"})
+    scheduler.add("remind", "!r:x", delay=60, job_id="gone")
+    assert scheduler.cancel("gone")
+    scheduler.close()
+
+    reopened = Scheduler(run, path=path)
+    assert reopened.jobs() == [job]
+    reopened.close()
+
+
+def test_declare_reconciles_jobs():
+    clock = Clock()
+
+    async def run(_):
+        pass
+
+    scheduler = Scheduler(run, clock=clock)
+    scheduler.declare([task("digest", every=3600, rooms=["!a:x", "!b:x"])])
+    before = {j.job_id: j.next_run for j in scheduler.jobs()}
+    assert set(before) == {"digest@!a:x", "digest@!b:x"}
+
+    clock.now += 10
+    scheduler.add("remind", "!a:x", delay=60)
+    scheduler.declare([task("digest", every=3600, rooms=["!a:x"])])
+    assert {j.job_id for j in scheduler.jobs(task="digest")} == {"digest@!a:x"}
+    assert scheduler.jobs(task="digest")[0].next_run == before["digest@!a:x"]
+    assert len(scheduler.jobs(task="remind")) == 1  # Runtime jobs are untouched
+
+    scheduler.declare([])
+    assert [j.task for j in scheduler.jobs()] == ["remind"]
+
+
+@pytest.mark.asyncio
+async def test_due_jobs_run_in_order_and_one_shots_are_removed():
+    clock = Clock()
+    ran = []
+
+    async def run(r):
+        ran.append(r.job.payload)
+
+    scheduler = Scheduler(run, clock=clock)
+    scheduler.add("t", "!r:x", delay=20, payload="second")
+    scheduler.add("t", "!r:x", delay=10, payload="first")
+    scheduler.add("t", "!r:x", delay=500, payload="later")
+    clock.now += 30
+    stop = asyncio.Event()
+    runner = asyncio.create_task(scheduler.run(stop))
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert ran == ["first", "second"]
+
+    scheduler.add("t", "!r:x", at=clock.now, payload="now")  # Wakes the runner
+    for _ in range(5):
+        await asyncio.sleep(0)
+    stop.set()
+    await runner
+
+    assert ran == ["first", "second", "now"]
+    assert [j.payload for j in scheduler.jobs()] == ["later"]
+
+
+@pytest.mark.asyncio
+async def test_missed_periodic_runs_are_coalesced():
+    clock = Clock()
+    runs = []
+
+    async def run(r):
+        runs.append(r)
+
+    scheduler = Scheduler(run, clock=clock)
+    scheduler.declare([task("digest", every=60, rooms=["!r:x"])])
+    clock.now += 60 * 5 + 15  # Down for five periods
+    stop = asyncio.Event()
+    runner = asyncio.create_task(scheduler.run(stop))
+    for _ in range(3):
+        await asyncio.sleep(0)
+    stop.set()
+    await runner
+
+    [r] = runs
+    assert r.missed == 4
+    assert r.scheduled_for == 1000 + 300
+    assert scheduler.jobs()[0].next_run == 1000 + 360
+
+
+@pytest.mark.asyncio
+async def test_failing_job_does_not_stop_the_runner():
+    clock = Clock()
+    ran = []
+
+    async def run(r):
+        ran.append(r.job.payload)
+        raise RuntimeError("boom")
+
+    scheduler = Scheduler(run, clock=clock)
+    scheduler.add("t", "!r:x", at=clock.now, payload=1)
+    scheduler.add("t", "!r:x", at=clock.now, payload=2)
+    stop = asyncio.Event()
+    runner = asyncio.create_task(scheduler.run(stop))
+    for _ in range(3):
+        await asyncio.sleep(0)
+    stop.set()
+    await runner
+    assert sorted(ran) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_one_shot_kept_until_its_run_finishes(tmp_path):
+    """A one-shot job cut off mid-run fires again after a restart."""
+    clock = Clock()
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def run(r):
+        started.set()
+        await release.wait()
+
+    path = tmp_path / "jobs.sqlite3"
+    scheduler = Scheduler(run, path=path, clock=clock)
+    scheduler.add("remind", "!r:x", at=clock.now, payload="tea", job_id="j1")
+    stop = asyncio.Event()
+    runner = asyncio.create_task(scheduler.run(stop))
+    await started.wait()
+    assert [j.job_id for j in Scheduler(run, path=path, clock=clock).jobs()] == ["j1"]
+
+    release.set()
+    for _ in range(3):
+        await asyncio.sleep(0)
+    stop.set()
+    await runner
+    assert scheduler.jobs() == []
+    assert Scheduler(run, path=path, clock=clock).jobs() == []
+
+
+@pytest.mark.asyncio
+async def test_retry_later_defers_one_shots_only():
+    clock = Clock()
+    attempts = []
+
+    async def run(r):
+        attempts.append(r.job.job_id)
+        if len(attempts) <= 2:
+            raise RetryLater(30)
+
+    scheduler = Scheduler(run, clock=clock)
+    scheduler.add("remind", "!r:x", at=clock.now, job_id="once")
+    scheduler.add("digest", "!r:x", at=clock.now, every=600, job_id="periodic")
+    stop = asyncio.Event()
+    runner = asyncio.create_task(scheduler.run(stop))
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert sorted(attempts) == ["once", "periodic"]
+    assert {j.job_id: j.next_run for j in scheduler.jobs()} == {
+        "once": clock.now + 30, "periodic": clock.now + 600}
+
+    clock.now += 30
+    scheduler._wakeup.set()
+    for _ in range(5):
+        await asyncio.sleep(0)
+    stop.set()
+    await runner
+    assert attempts[2:] == ["once"]
+    assert [j.job_id for j in scheduler.jobs()] == ["periodic"]
+
+
+@pytest.mark.asyncio
+async def test_registry_runs_scheduled_tasks():
+    registry = CommandRegistry()
+
+    async def digest(ctx: ScheduleContext):
+        return f"{ctx.task} in {ctx.room_id}, missed {ctx.missed}"
+
+    registry.register_scheduled("digest", digest, every="1h", rooms=["!r:x"], jitter="5m")
+    [scheduled] = registry.scheduled_tasks()
+    assert (scheduled.every, scheduled.jitter) == (3600, 300)
+
+    ctx = ScheduleContext(task="digest", job_id="j", room_id="!r:x",
+                          scheduled_for=0.0, missed=2)
+    assert await registry.run_scheduled(scheduled, ctx) == "digest in !r:x, missed 2"
+
+    with pytest.raises(ValueError):
+        registry.register_scheduled("bad", digest, rooms=["!r:x"])
+    registry.clear()
+    assert registry.scheduled_tasks() == []
@@ -0,0 +1,76 @@
+"""Tests for the staged shutdown coordinator."""
+import asyncio
+
+import pytest
+
+from bot import outbound
+from bot.dispatcher import Dispatcher
+from bot.shutdown import ShutdownCoordinator
+
+
+@pytest.mark.asyncio
+async def test_shutdown_drains_then_persists_then_closes(outbound_state):
+    coordinator = ShutdownCoordinator(drain_timeout=1)
+    order = []
+
+    async def handler():
+        await asyncio.sleep(0.01)
+        order.append("handler")
+
+    async def close():
+        order.append("close")
+
+    coordinator.track(asyncio.create_task(handler()))
+    coordinator.on_persist(lambda: order.append("persist"))
+    coordinator.on_close(close)
+    report = await coordinator.shutdown()
+
+    assert order == ["handler", "persist", "close"]
+    assert report.clean and report.drained == 1
+    assert not coordinator.accepting
+    assert set(report.phase_seconds) == {"stop", "drain", "flush", "persist", "close"}
+
+
+@pytest.mark.asyncio
+async def test_shutdown_reports_what_was_cut_off(outbound_state):
+    class HangingClient:
+        async def room_send(self, room_id, message_type, content):
+            await asyncio.sleep(3600)
+
+    coordinator = ShutdownCoordinator(drain_timeout=0.01, flush_timeout=0.01)
+    coordinator.track(asyncio.create_task(
+        outbound.room_send(HangingClient(), "!r:x", {"msgtype": "m.text", "body": "late"})))
+
+    def broken():
+        raise RuntimeError("disk full")
+
+    coordinator.on_persist(broken)
+    report = await coordinator.shutdown()
+
+    assert report.cancelled == 1 and report.drained == 0
+    assert report.unsent == [{"room_id": "!r:x", "txn_id": None, "account": None,
+                              "content": {"msgtype": "m.text", "body": "late"}}]
+    assert len(report.failed_hooks) == 1 and not report.clean
+
+
+@pytest.mark.asyncio
+async def test_shutdown_cancels_dispatcher_jobs_before_closing(outbound_state):
+    dispatcher = Dispatcher()
+    coordinator = ShutdownCoordinator(drain_timeout=0.01)
+    coordinator.track_source(dispatcher.tasks)
+    order = []
+
+    async def job():
+        try:
+            await asyncio.sleep(3600)
+        finally:
+            order.append("job ended")
+
+    coordinator.track(asyncio.create_task(dispatcher.submit("standard", job)))
+    await asyncio.sleep(0)
+    assert dispatcher.tasks()
+    coordinator.on_close(lambda: order.append("close"))
+    report = await coordinator.shutdown()
+
+    assert order == ["job ended", "close"]
+    assert report.cancelled == 2 and not dispatcher.tasks()
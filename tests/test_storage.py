@@ -0,0 +1,99 @@
+"""Tests for the command key-value store."""
+import pytest
+
+from bot.commands import CommandRegistry
+from bot.services import Services
+from bot.storage import Store, StorageError
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(tmp_path / "kv.sqlite3")
+    yield store
+    store.close()
+
+
+def test_values_round_trip_and_namespaces_are_separate(store):
+    a, b = store.namespace("bot.commands.a"), store.namespace("bot.commands.b")
+    a.set("prefs", {"lang": "en", "tags": [1, 2]})
+    assert a.get("prefs") == {"lang": "en", "tags": [1, 2]}
+    assert b.get("prefs", "none") == "none"
+    assert "prefs" in a and "prefs" not in b
+    assert a.delete("prefs") and not a.delete("prefs")
+    assert a.get("prefs") is None
+
+
+def test_incr_and_compare_and_set(store):
+    ns = store.namespace("game")
+    assert ns.incr("score") == 1
+    assert ns.incr("score", 4) == 5
+    assert ns.compare_and_set("turn", None, "@a:x")  # None means absent
+    assert not ns.compare_and_set("turn", "@b:x", "@a:x")
+    assert ns.compare_and_set("turn", "@a:x", "@b:x")
+    assert ns.get("turn") == "@b:x"
+    ns.set("name", "x")
+    with pytest.raises(StorageError):
+        ns.incr("name")
+
+
+def test_invalid_keys_and_values_are_rejected(store):
+    ns = store.namespace("n")
+    with pytest.raises(StorageError):
+        ns.set("", 1)
+    with pytest.raises(StorageError):
+        ns.set("k", object())
+    with pytest.raises(StorageError):
+        ns.set("k", "x" * (64 * 1024 + 1))
+
+
+def test_writes_are_deferred_until_flush_and_survive_reopen(tmp_path):
+    path = tmp_path / "kv.sqlite3"
+    store = Store(path)
+    ns = store.namespace("n")
+    ns.set("a", 1)
+    ns.set("b", 2)
+    ns.delete("b")
+    assert store._db.execute("SELECT COUNT(*) FROM kv").fetchone()[0] == 0
+    assert store.flush() == 2
+    store.close()
+
+    reopened = Store(path)
+    assert reopened.namespace("n").get("a") == 1
+    assert "b" not in reopened.namespace("n")
+    reopened.close()
+
+
+def test_cache_eviction_keeps_dirty_entries(tmp_path):
+    store = Store(tmp_path / "kv.sqlite3", cache_size=2)
+    ns = store.namespace("n")
+    for i in range(5):
+        ns.set(str(i), i)
+    assert len(store._cache) <= 2
+    assert [ns.get(str(i)) for i in range(5)] == [0, 1, 2, 3, 4]
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_handlers_get_their_module_namespace(store):
+    registry = CommandRegistry()
+
+    async def count_handler(body, ctx):
+        return str(ctx.storage.incr("count"))
+
+    registry.register("count", "Count", r"^!count$", count_handler,
+                      module_name="bot.commands.count")
+    services = Services(storage=store)
+    assert await registry.execute("!count", services=services) == "1"
+    assert await registry.execute("!count", services=services) == "2"
+    assert store.namespace("bot.commands.count").get("count") == 2
+
+
+def test_namespace_holds_no_reference_to_the_store(tmp_path):
+    store = Store(tmp_path / "kv.sqlite3")
+    ns = store.namespace("cmd")
+    ns.set("k", 1)
+    assert ns.get("k") == 1
+    assert not any(isinstance(getattr(ns, slot), Store)
+                   or getattr(getattr(ns, slot), "__self__", None) is store
+                   for slot in type(ns).__slots__)
+    store.close()
@@ -0,0 +1,70 @@
+"""Tests for streaming replies from async-generator handlers."""
+import asyncio
+
+import pytest
+from nio import RoomSendResponse
+
+from bot.commands import CommandRegistry
+from bot.outbound import stream_reply
+from tests.test_formatting import make_event
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    async def room_send(self, room_id, message_type, content):
+        self.sent.append(content)
+        return RoomSendResponse(f"$sent{len(self.sent)}", room_id)
+
+
+async def pieces(*items, delay=0.0):
+    for item in items:
+        await asyncio.sleep(delay)
+        yield item
+
+
+@pytest.mark.asyncio
+async def test_stream_sends_first_piece_then_coalesced_edits():
+    client = FakeClient()
+    await stream_reply(client, "!r:x", make_event("$e"),
+                       pieces("one", " two", " three", " four", delay=0.01),
+                       edit_interval=0.1)
+
+    first, *edits = client.sent
+    assert first["body"] == "one"
+    assert first["m.relates_to"]["rel_type"] == "m.thread"
+    # Pieces arriving within one interval are batched into a single edit.
+    assert len(edits) == 1
+    assert edits[0]["m.new_content"]["body"] == "one two three four"
+    assert edits[0]["m.relates_to"] == {"rel_type": "m.replace", "event_id": "$sent1"}
+
+
+@pytest.mark.asyncio
+async def test_stream_overflow_continues_in_new_message(monkeypatch):
+    import bot.outbound as outbound
+    monkeypatch.setattr(outbound, "MAX_CHUNK_BYTES", 300)
+    client = FakeClient()
+    await stream_reply(client, "!r:x", make_event("$e"),
+                       pieces("x" * 150 + "\n", "y" * 150), edit_interval=0)
+
+    bodies = [c.get("m.new_content", c)["body"] for c in client.sent]
+    assert bodies[-1] == "y" * 150
+    assert "m.new_content" not in client.sent[-1]  # A new message, not an edit
+
+
+@pytest.mark.asyncio
+async def test_registry_streams_async_generator_handlers():
+    registry = CommandRegistry()
+
+    async def counting(body: str):
+        yield "1"
+        yield "2"
+        raise RuntimeError("boom")
+
+    registry.register("count", "Count", r"^!count$", counting)
+    assert registry.get_command("count").streaming
+    result = await registry.execute("!count")
+    collected = [piece async for piece in result]
+    assert collected[:2] == ["1", "2"]
+    assert "Error executing command 'count'" in collected[2]
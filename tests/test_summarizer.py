@@ -0,0 +1,63 @@
+"""Tests for the incremental summarizer."""
+from bot.history import HistoryMessage
+from bot.summarizer import ConversationSummary, Summarizer
+
+
+def msg(body: str, sender: str = "@u:x", thread: str = None) -> HistoryMessage:
+    return HistoryMessage("$e", sender, body, 0, thread)
+
+
+def test_summary_prefers_central_sentences():
+    """Sentences sharing the conversation's frequent terms score highest."""
+    conversation = ConversationSummary()
+    conversation.add("The database migration failed on staging last night.")
+    conversation.add("Anyone want lunch tacos today?")
+    conversation.add("Rolling back the database migration fixed staging.")
+    conversation.add("Database migration needs a staging dry run first.")
+
+    summary = conversation.summary(sentences=1)
+    assert "database migration" in summary.lower()
+    assert "tacos" not in summary
+    assert conversation.keywords(3)[0] in {"database", "migration", "staging"}
+
+
+def test_summary_cached_until_new_message():
+    """The summary is reused until another message changes the version."""
+    conversation = ConversationSummary()
+    conversation.add("Deploy the release candidate to production today.")
+    first = conversation.summary()
+    assert conversation.summary() is first
+    conversation.add("Production deploy of the release candidate went fine.")
+    assert conversation.version == 2
+    assert "Production deploy" in conversation.summary()
+
+
+def test_candidate_pool_is_bounded():
+    """Only the configured number of candidate sentences is kept."""
+    conversation = ConversationSummary(max_sentences=5)
+    for i in range(50):
+        conversation.add(f"Message number {i} talks about cache eviction policy.")
+    assert len(conversation._sentences) == 5
+    assert conversation.messages == 50
+
+
+def test_observe_tracks_room_and_thread_and_skips_commands():
+    """Live messages update room and thread summaries; commands are ignored."""
+    summarizer = Summarizer(ignore_senders=["@bot:x"])
+    summarizer.observe("!r", msg("Cache invalidation broke the search index.", thread="$t"))
+    summarizer.observe("!r", msg("!tldr"))
+    summarizer.observe("!r", msg("Bot reply about search index cache.", sender="@bot:x"))
+
+    assert summarizer.get("!r").messages == 1
+    assert summarizer.get("!r", "$t").messages == 1
+    assert summarizer.get("!other") is None
+
+
+def test_model_summary_invalidated_by_new_messages():
+    """Cached model summaries are dropped once the conversation changes."""
+    summarizer = Summarizer()
+    summarizer.observe("!r", msg("First message about the outage timeline."))
+    summarizer.store_model_summary("!r", None, "An outage happened.")
+    assert summarizer.cached_model_summary("!r", None) == "An outage happened."
+    summarizer.observe("!r", msg("Second message about the outage root cause."))
+    assert summarizer.cached_model_summary("!r", None) is None
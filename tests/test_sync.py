@@ -0,0 +1,95 @@
+"""Tests for the sync supervisor."""
+import asyncio
+import random
+
+import pytest
+from aiohttp import ClientConnectionError
+from nio import SyncError
+
+from bot.sync import (
+    Backoff, SyncErrorKind, SyncHealth, SyncSupervisor, classify_error
+)
+
+
+class FakeClient:
+    """Client whose sync() replays a script of results."""
+
+    def __init__(self, script, stop: asyncio.Event):
+        self.script = list(script)
+        self.stop = stop
+        self.timeouts = []
+
+    async def sync(self, timeout=None):
+        self.timeouts.append(timeout)
+        item = self.script.pop(0)
+        if not self.script:
+            self.stop.set()
+        if item == "hang":
+            await asyncio.sleep(3600)
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+
+def test_classify_error():
+    """Errors are classified by errcode and exception type."""
+    assert classify_error(SyncError("bad", "M_UNKNOWN_TOKEN"))[0] is SyncErrorKind.AUTH
+    kind, retry_after = classify_error(SyncError("slow", "M_LIMIT_EXCEEDED", 2500))
+    assert kind is SyncErrorKind.RATE_LIMIT
+    assert retry_after == 2.5
+    assert classify_error(ClientConnectionError())[0] is SyncErrorKind.NETWORK
+    assert classify_error(asyncio.TimeoutError())[0] is SyncErrorKind.STALLED
+    assert classify_error(ValueError())[0] is SyncErrorKind.UNKNOWN
+
+
+def test_backoff_grows_and_caps():
+    """Delays stay within the exponential ceiling and never exceed the cap."""
+    backoff = Backoff(base=1.0, cap=8.0, rng=random.Random(1))
+    delays = [backoff.next_delay() for _ in range(10)]
+    assert delays[0] == 1.0
+    assert all(1.0 <= d <= 8.0 for d in delays)
+    backoff.reset()
+    assert backoff.next_delay() == 1.0
+
+
+@pytest.mark.asyncio
+async def test_supervisor_recovers_and_adapts_timeout():
+    """Network failures shrink the timeout; success restores health."""
+    stop = asyncio.Event()
+    client = FakeClient([ClientConnectionError(), object()], stop)
+    supervisor = SyncSupervisor(client, stop, timeout_ms=30000,
+                                backoff=Backoff(base=0.001, cap=0.001))
+    await supervisor.run()
+
+    assert client.timeouts == [30000, 15000]
+    assert supervisor.consecutive_failures == 0
+    assert supervisor.last_success is not None
+    assert supervisor.health is SyncHealth.STOPPED
+
+
+@pytest.mark.asyncio
+async def test_watchdog_restarts_hung_sync():
+    """A sync that never returns is cancelled after the deadline."""
+    stop = asyncio.Event()
+    client = FakeClient(["hang", object()], stop)
+    supervisor = SyncSupervisor(client, stop, timeout_ms=10, min_timeout_ms=10,
+                                stall_grace=0.01,
+                                backoff=Backoff(base=0.001, cap=0.001))
+    await supervisor.run()
+
+    assert len(client.timeouts) == 2
+    assert supervisor.last_error.startswith("stalled")
+
+
+@pytest.mark.asyncio
+async def test_stop_abandons_in_flight_long_poll():
+    """Setting stop cancels a waiting sync instead of letting it run out."""
+    stop = asyncio.Event()
+    client = FakeClient(["hang", "hang"], stop)
+    supervisor = SyncSupervisor(client, stop, timeout_ms=30000)
+    task = asyncio.create_task(supervisor.run())
+    await asyncio.sleep(0.01)
+    stop.set()
+    await asyncio.wait_for(task, 1)
+    assert supervisor.health is SyncHealth.STOPPED
+    assert supervisor.consecutive_failures == 0
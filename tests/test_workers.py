@@ -0,0 +1,155 @@
+"""Tests for offloading commands to worker processes."""
+import asyncio
+import os
+import socket
+from pathlib import Path
+
+import pytest
+
+from bot.commands import Reply, get_registry
+from bot.dispatcher import DispatcherBusy
+from bot.reload import HandoffChannel
+from bot import workers
+from bot.workers import ERROR_REPLY, WorkerPool, serve
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def temp_commands():
+    registry = get_registry()
+    names = []
+
+    def add(name, handler):
+        registry.register(name, name, rf"^!{name}\b", handler, api_version=1)
+        names.append(name)
+
+    yield add
+    for name in names:
+        registry.unregister(name)
+
+
+@pytest.mark.asyncio
+async def test_worker_answers_in_order_per_room(temp_commands):
+    gates = {"!slow:x": asyncio.Event()}
+
+    async def wait_handler(body):
+        room = body.split()[1]
+        if room in gates:
+            await gates[room].wait()
+        return f"{body} done"
+
+    async def html_handler(body):
+        return Reply("plain", "<b>rich</b>")
+
+    async def stream_handler(body):
+        yield "a"
+        yield "b"
+
+    temp_commands("wkwait", wait_handler)
+    temp_commands("wkhtml", html_handler)
+    temp_commands("wkstream", stream_handler)
+
+    ours, theirs = socket.socketpair()
+    main = await HandoffChannel.open(ours)
+    worker = asyncio.create_task(serve(await HandoffChannel.open(theirs)))
+    assert await main.receive() == {"type": "ready"}
+
+    for i, (room, body) in enumerate([("!slow:x", "!wkwait !slow:x 1"),
+                                      ("!slow:x", "!wkwait !slow:x 2"),
+                                      ("!fast:x", "!wkwait !fast:x 3"),
+                                      ("!fast:x", "!wkhtml"),
+                                      ("!fast:x", "!wkstream")]):
+        await main.send({"id": i, "room": room, "body": body,
+                         "command": body.split()[0][1:] if i % 2 else None})
+
+    async def answers(count):
+        received = []
+        while len(received) < count:
+            message = await main.receive()
+            if message["type"] != "start":
+                received.append(message)
+        return received
+
+    assert await answers(6) == [
+        {"id": 2, "type": "done", "body": "!wkwait !fast:x 3 done", "html": None},
+        {"id": 3, "type": "done", "body": "plain", "html": "<b>rich</b>"},
+        {"id": 4, "type": "stream"},
+        {"id": 4, "type": "piece", "text": "a"},
+        {"id": 4, "type": "piece", "text": "b"},
+        {"id": 4, "type": "done"},
+    ]
+    gates["!slow:x"].set()
+    assert [answer["id"] for answer in await answers(2)] == [0, 1]
+
+    await main.end()  # The worker finishes and exits on EOF
+    await asyncio.wait_for(worker, 5)
+    await main.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_rejects_calls_it_cannot_take():
+    pool = WorkerPool(2, max_pending=1)
+    assert pool.worker_for("!r:x") == pool.worker_for("!r:x")
+    with pytest.raises(DispatcherBusy):
+        await pool.execute("!calculate 1+1", room_id="!r:x")  # Not started
+
+
+@pytest.fixture
+def worker_env(tmp_path, monkeypatch):
+    """Let worker processes find the package and a config file."""
+    (tmp_path / "config.toml").write_text(
+        '[bot]\nhomeserver = "https://example.org"\nuser_id = "@bot:example.org"\n')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(
+        filter(None, [str(REPO), os.environ.get("PYTHONPATH")])))
+
+
+@pytest.mark.asyncio
+async def test_worker_process_runs_commands_and_is_restarted(worker_env):
+    pool = WorkerPool(1, max_pending=10)
+    await pool.start()
+    try:
+        assert pool.snapshot()["worker0"]["ready"]
+        assert await pool.execute("!calculate 2+3", room_id="!r:x") == "2+3 = 5.0"
+
+        pool._workers[0].process.kill()
+        for _ in range(100):
+            await asyncio.sleep(0.1)
+            if pool.snapshot()["worker0"] == {"pending": 0, "restarts": 1, "ready": True}:
+                break
+        assert await pool.execute("!calculate 6*7", room_id="!r:x") == "6*7 = 42.0"
+    finally:
+        await pool.close()
+    assert pool._workers[0].process.returncode is not None
+
+
+# A worker with an extra offloaded command that never yields the event loop.
+SPINNING_WORKER = """
+from bot import workers
+from bot.commands import get_registry
+
+async def spin(body):
+    while True:
+        pass
+
+get_registry().register("spin", "Spin", r"^!spin$", spin, offload=True)
+workers.worker_main()
+"""
+
+
+@pytest.mark.asyncio
+async def test_worker_stuck_on_a_call_is_restarted(worker_env, monkeypatch):
+    monkeypatch.setattr(workers, "WORKER_ARGS", ("-c", SPINNING_WORKER))
+    pool = WorkerPool(1, max_pending=10, call_timeout=0.5, restart_backoff_cap=0.1)
+    await pool.start()
+    try:
+        assert await asyncio.wait_for(pool.execute("!spin", room_id="!r:x"), 30) == ERROR_REPLY
+        for _ in range(100):
+            if pool.snapshot()["worker0"]["ready"]:
+                break
+            await asyncio.sleep(0.1)
+        assert pool.snapshot()["worker0"]["restarts"] == 1
+        assert await pool.execute("!calculate 6*7", room_id="!r:x") == "6*7 = 42.0"
+    finally:
+        await pool.close()